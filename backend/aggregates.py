@@ -0,0 +1,271 @@
+"""
+Agregados de ventas y actividad mantenidos de forma incremental.
+
+Se cargan una vez desde el almacén de auditoría al arrancar y después se
+actualizan con cada compra o canción registrada, de modo que los endpoints
+de administración responden sin recorrer el historial.
+
+Con el libro de cuotas en Redis los contadores viven en el mismo servidor
+(HINCRBY/SADD), así que todos los workers ven los mismos totales. Sin Redis
+se usan contadores del proceso, válidos solo con un worker.
+"""
+
+import uuid
+from typing import Any, Dict, Mapping, Optional, Set
+
+try:
+    from redis.exceptions import WatchError
+except ImportError:  # pragma: no cover - redis es opcional en modo memoria
+
+    class WatchError(Exception):  # type: ignore[no-redef]
+        pass
+
+
+from backend.audit_store import AuditStore
+from backend.quota import QuotaLedger, RedisQuotaLedger
+
+Planes = Mapping[str, Mapping[str, Any]]
+
+# Vida de la copia temporal de la carga inicial si el worker cae antes de publicarla
+_STAGING_TTL = 300
+
+
+class SalesAggregates:
+    """
+    Totales de ventas por plan, canciones generadas y usuarios activos.
+    """
+
+    name = "base"
+
+    async def record_purchase(self, email: str, plan: str, price: int) -> None:
+        raise NotImplementedError
+
+    async def record_song(self, email: str) -> None:
+        raise NotImplementedError
+
+    async def sales(self) -> Dict[str, Any]:
+        """`total_ventas`, `ventas_por_plan`, `compras_por_plan` y `total_compras`."""
+        raise NotImplementedError
+
+    async def total_songs(self) -> int:
+        raise NotImplementedError
+
+    async def active_users(self) -> Set[str]:
+        raise NotImplementedError
+
+    async def load(self, store: AuditStore, planes: Optional[Planes] = None) -> None:
+        """
+        Reconstruye los agregados a partir de la auditoría persistida.
+
+        Args:
+            store: Almacén de auditoría ya iniciado
+            planes: Catálogo de planes; solo se usa su `precio` para las
+                compras antiguas, registradas sin el precio pagado
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    async def _snapshot(store: AuditStore, planes: Optional[Planes]) -> Dict[str, Any]:
+        revenue: Dict[str, int] = {}
+        purchases: Dict[str, int] = {}
+        for plan, (count, paid, unpriced) in (await store.purchase_totals()).items():
+            fallback = int((planes or {}).get(plan, {}).get("precio", 0))
+            revenue[plan] = paid + fallback * unpriced
+            purchases[plan] = count
+        return {
+            "revenue_by_plan": revenue,
+            "purchases_by_plan": purchases,
+            "songs": await store.count("songs"),
+            "users": set(await store.distinct_emails()),
+        }
+
+
+class InMemorySalesAggregates(SalesAggregates):
+    """Contadores del proceso; con varios workers cada uno ve solo lo suyo."""
+
+    name = "memory"
+
+    def __init__(self) -> None:
+        self.revenue_by_plan: Dict[str, int] = {}
+        self.purchases_by_plan: Dict[str, int] = {}
+        self.songs = 0
+        self.users: Set[str] = set()
+
+    async def record_purchase(self, email: str, plan: str, price: int) -> None:
+        self.revenue_by_plan[plan] = self.revenue_by_plan.get(plan, 0) + price
+        self.purchases_by_plan[plan] = self.purchases_by_plan.get(plan, 0) + 1
+        self.users.add(email)
+
+    async def record_song(self, email: str) -> None:
+        self.songs += 1
+        self.users.add(email)
+
+    async def sales(self) -> Dict[str, Any]:
+        return {
+            "total_ventas": sum(self.revenue_by_plan.values()),
+            "ventas_por_plan": dict(self.revenue_by_plan),
+            "compras_por_plan": dict(self.purchases_by_plan),
+            "total_compras": sum(self.purchases_by_plan.values()),
+        }
+
+    async def total_songs(self) -> int:
+        return self.songs
+
+    async def active_users(self) -> Set[str]:
+        return set(self.users)
+
+    async def load(self, store: AuditStore, planes: Optional[Planes] = None) -> None:
+        snapshot = await self._snapshot(store, planes)
+        self.revenue_by_plan = snapshot["revenue_by_plan"]
+        self.purchases_by_plan = snapshot["purchases_by_plan"]
+        self.songs = snapshot["songs"]
+        self.users = snapshot["users"]
+
+
+class RedisSalesAggregates(SalesAggregates):
+    """
+    Contadores compartidos en Redis.
+
+    Claves:
+        sales:revenue_by_plan    hash plan -> ingresos
+        sales:purchases_by_plan  hash plan -> compras
+        sales:totals             hash con `songs`
+        sales:users              set de emails activos
+        sales:loaded             marca de que ya se cargó la auditoría
+        sales:pending:*          eventos anotados antes de que exista `loaded`
+
+    Solo el primer worker que arranca con Redis vacío carga la auditoría;
+    los demás (y los reinicios) siguen con los contadores compartidos. La
+    carga se prepara en claves temporales y se publica con RENAME en la
+    misma transacción que fija `loaded`. Mientras no hay carga publicada
+    nadie toca los contadores vivos: los eventos van a `sales:pending:*` y
+    se suman a la instantánea al publicar, así que ninguno se pierde.
+    """
+
+    name = "redis"
+
+    def __init__(self, client: Any, prefix: str = "sales"):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}:{name}"
+
+    async def _record(self, counters: Mapping[str, Mapping[str, int]], email: str) -> None:
+        """Suma los contadores a las claves vivas o, si aún no hay carga, a las pendientes."""
+        loaded = self._key("loaded")
+        async with self.client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    # Si la carga se publica a mitad, se repite contra las claves vivas
+                    await pipe.watch(loaded)
+                    base = self.prefix if await pipe.exists(loaded) else self._key("pending")
+                    pipe.multi()
+                    for name, fields in counters.items():
+                        for field, amount in fields.items():
+                            pipe.hincrby(f"{base}:{name}", field, amount)
+                    pipe.sadd(f"{base}:users", email)
+                    await pipe.execute()
+                    return
+                except WatchError:
+                    continue
+
+    async def record_purchase(self, email: str, plan: str, price: int) -> None:
+        await self._record(
+            {"revenue_by_plan": {plan: price}, "purchases_by_plan": {plan: 1}}, email
+        )
+
+    async def record_song(self, email: str) -> None:
+        await self._record({"totals": {"songs": 1}}, email)
+
+    async def sales(self) -> Dict[str, Any]:
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self._key("revenue_by_plan"))
+            pipe.hgetall(self._key("purchases_by_plan"))
+            revenue, purchases = await pipe.execute()
+        revenue = {plan: int(value) for plan, value in revenue.items()}
+        purchases = {plan: int(value) for plan, value in purchases.items()}
+        return {
+            "total_ventas": sum(revenue.values()),
+            "ventas_por_plan": revenue,
+            "compras_por_plan": purchases,
+            "total_compras": sum(purchases.values()),
+        }
+
+    async def total_songs(self) -> int:
+        return int(await self.client.hget(self._key("totals"), "songs") or 0)
+
+    async def active_users(self) -> Set[str]:
+        return set(await self.client.smembers(self._key("users")))
+
+    async def load(self, store: AuditStore, planes: Optional[Planes] = None) -> None:
+        loaded = self._key("loaded")
+        if await self.client.exists(loaded):
+            return
+        names = ("revenue_by_plan", "purchases_by_plan", "totals", "users")
+        pending = {name: f"{self.prefix}:pending:{name}" for name in names}
+        # Lo anotado hasta aquí ya está en la auditoría que lee la instantánea
+        await self.client.delete(*pending.values())
+        snapshot = await self._snapshot(store, planes)
+        # La instantánea se escribe aparte y se publica de golpe junto con la marca:
+        # nadie cuenta sobre los contadores vivos hasta que existen ya completos
+        staging = f"{self.prefix}:loading:{uuid.uuid4().hex}"
+        values = {
+            "revenue_by_plan": snapshot["revenue_by_plan"],
+            "purchases_by_plan": snapshot["purchases_by_plan"],
+            "totals": {"songs": snapshot["songs"]},
+            "users": snapshot["users"],
+        }
+        async with self.client.pipeline(transaction=True) as pipe:
+            for name, value in values.items():
+                if not value:
+                    continue
+                if name == "users":
+                    pipe.sadd(f"{staging}:{name}", *value)
+                else:
+                    pipe.hset(f"{staging}:{name}", mapping=value)
+                # Si el worker cae antes de publicar, la copia temporal desaparece sola
+                pipe.expire(f"{staging}:{name}", _STAGING_TTL)
+            await pipe.execute()
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                while True:
+                    try:
+                        # Otro worker puede publicar su carga mientras se construía esta,
+                        # y cualquier evento nuevo cambia las claves pendientes
+                        await pipe.watch(loaded, *pending.values())
+                        if await pipe.exists(loaded):
+                            return
+                        users = await pipe.smembers(pending["users"])
+                        counters = {
+                            name: await pipe.hgetall(key)
+                            for name, key in pending.items()
+                            if name != "users"
+                        }
+                        pipe.multi()
+                        for name, value in values.items():
+                            if value:
+                                pipe.rename(f"{staging}:{name}", self._key(name))
+                                pipe.persist(self._key(name))
+                            else:
+                                pipe.delete(self._key(name))
+                        for name, fields in counters.items():
+                            for field, amount in fields.items():
+                                pipe.hincrby(self._key(name), field, int(amount))
+                        if users:
+                            pipe.sadd(self._key("users"), *users)
+                        pipe.delete(*pending.values())
+                        pipe.set(loaded, "1")
+                        await pipe.execute()
+                        return
+                    except WatchError:
+                        continue
+        finally:
+            await self.client.delete(*(f"{staging}:{name}" for name in values))
+
+
+def create_sales_aggregates(ledger: QuotaLedger) -> SalesAggregates:
+    """Agregados en el mismo Redis que el libro de cuotas, o en memoria si no lo hay."""
+    if isinstance(ledger, RedisQuotaLedger):
+        return RedisSalesAggregates(ledger.client)
+    return InMemorySalesAggregates()
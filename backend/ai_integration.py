@@ -1,83 +1,379 @@
-from typing import Any, Dict
+from typing import Any, AsyncGenerator, Dict, Optional, Tuple
+import asyncio
 import openai
+from openai import AsyncOpenAI
 
 import os
-import requests
+import httpx
+
+from backend.config import (
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_IN_FLIGHT,
+    OPENAI_MODEL_LIMITS,
+    OPENAI_TIMEOUT,
+    PROMPT_CACHE_DISK_MAX_BYTES,
+    PROMPT_CACHE_ENABLED,
+    PROMPT_CACHE_IMAGE_TTL,
+    PROMPT_CACHE_MEMORY_SIZE,
+    PROMPT_CACHE_PATH,
+    PROMPT_CACHE_TTL,
+    SUNO_BACKOFF_BASE,
+    SUNO_BACKOFF_MAX,
+    SUNO_BREAKER_RESET,
+    SUNO_BREAKER_THRESHOLD,
+    SUNO_MAX_CONNECTIONS,
+    SUNO_MAX_RETRIES,
+    SUNO_TIMEOUT,
+)
+from backend.prompt_cache import PromptCache, cache_key
+from backend.single_flight import SingleFlight
+from backend.suno_client import CircuitBreaker, CircuitOpenError, SunoClient, SunoError
+
+# Un cliente asíncrono (y su pool de conexiones) por API key, compartido por
+# todas las instancias de AIIntegration del proceso
+_ASYNC_CLIENTS: Dict[str, AsyncOpenAI] = {}
+
+
+def get_async_client(api_key: str) -> AsyncOpenAI:
+    """Devuelve el cliente AsyncOpenAI compartido para `api_key`."""
+    client = _ASYNC_CLIENTS.get(api_key)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=api_key,
+            timeout=OPENAI_TIMEOUT,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                ),
+            ),
+        )
+        _ASYNC_CLIENTS[api_key] = client
+    return client
+
+
+# Igual para Suno: un cliente (pool, reintentos y circuit breaker) por URL y key
+_SUNO_CLIENTS: Dict[Tuple[str, str], SunoClient] = {}
+
+
+def get_suno_client(base_url: str, api_key: str) -> SunoClient:
+    """Devuelve el cliente de Suno compartido para `base_url` y `api_key`."""
+    client = _SUNO_CLIENTS.get((base_url, api_key))
+    if client is None:
+        client = SunoClient(
+            base_url,
+            api_key,
+            timeout=SUNO_TIMEOUT,
+            max_connections=SUNO_MAX_CONNECTIONS,
+            max_retries=SUNO_MAX_RETRIES,
+            backoff_base=SUNO_BACKOFF_BASE,
+            backoff_max=SUNO_BACKOFF_MAX,
+            breaker=CircuitBreaker(SUNO_BREAKER_THRESHOLD, SUNO_BREAKER_RESET),
+        )
+        _SUNO_CLIENTS[(base_url, api_key)] = client
+    return client
+
+
+# Límite de llamadas en vuelo por modelo, común a todas las instancias de
+# AIIntegration del proceso (main y las rutas /ai crean la suya)
+_SEMAPHORES: Dict[str, asyncio.Semaphore] = {}
+
+
+def get_model_semaphore(model: str, limit: Optional[int] = None) -> asyncio.Semaphore:
+    """
+    Devuelve el semáforo compartido de `model`.
+
+    El límite (`limit`, si no OPENAI_MODEL_LIMITS u OPENAI_MAX_IN_FLIGHT) se
+    fija al crearlo; las llamadas posteriores reciben el mismo semáforo.
+    """
+    semaphore = _SEMAPHORES.get(model)
+    if semaphore is None:
+        if limit is None:
+            limit = OPENAI_MODEL_LIMITS.get(model, OPENAI_MAX_IN_FLIGHT)
+        semaphore = asyncio.Semaphore(limit)
+        _SEMAPHORES[model] = semaphore
+    return semaphore
+
+
+_PROMPT_CACHE: Optional[PromptCache] = None
+# Llamadas idénticas en vuelo, compartidas entre instancias (misma clave que la caché)
+_FLIGHTS = SingleFlight()
+
+
+def get_prompt_cache() -> Optional[PromptCache]:
+    """Caché de prompts compartida por el proceso (None si está desactivada)."""
+    global _PROMPT_CACHE
+    if not PROMPT_CACHE_ENABLED:
+        return None
+    if _PROMPT_CACHE is None:
+        _PROMPT_CACHE = PromptCache(
+            PROMPT_CACHE_PATH or None,
+            memory_size=PROMPT_CACHE_MEMORY_SIZE,
+            disk_max_bytes=PROMPT_CACHE_DISK_MAX_BYTES,
+            ttl=PROMPT_CACHE_TTL,
+        )
+    return _PROMPT_CACHE
+
+
+async def close_async_clients() -> None:
+    """Cierra los clientes compartidos (llamar al apagar la app)."""
+    clients = list(_ASYNC_CLIENTS.values())
+    _ASYNC_CLIENTS.clear()
+    # Los semáforos quedan ligados al event loop que se cierra
+    _SEMAPHORES.clear()
+    for client in clients:
+        await client.close()
+    suno_clients = list(_SUNO_CLIENTS.values())
+    _SUNO_CLIENTS.clear()
+    for suno_client in suno_clients:
+        await suno_client.aclose()
 
 
 class AIIntegration:
-    def __init__(self, api_key: str):
+    TEXT_MODEL = "gpt-3.5-turbo"
+    IMAGE_MODEL = "dall-e-2"
+
+    def __init__(
+        self,
+        api_key: str,
+        model_limits: Optional[Dict[str, int]] = None,
+        cache: Optional[PromptCache] = None,
+        flights: Optional[SingleFlight] = None,
+    ):
         openai.api_key = api_key
+        self.api_key = api_key
+        self.cache = cache if cache is not None else get_prompt_cache()
+        self.flights = flights if flights is not None else _FLIGHTS
+        # Máximo de llamadas en vuelo por modelo (el resto espera su turno); el
+        # semáforo es del proceso, así que manda la primera instancia que lo usa
+        self.model_limits = dict(OPENAI_MODEL_LIMITS)
+        self.model_limits.update(model_limits or {})
         # Integración Suno
         self.suno_api_key = os.getenv("SUNO_API_KEY", "YOUR_SUNO_API_KEY")
         self.suno_base_url = os.getenv("SUNO_API_URL", "https://api.suno.ai/v1")
 
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        return get_async_client(self.api_key)
+
+    def _semaphore(self, model: str) -> asyncio.Semaphore:
+        return get_model_semaphore(model, self.model_limits.get(model, OPENAI_MAX_IN_FLIGHT))
+
+    @property
+    def suno(self) -> SunoClient:
+        return get_suno_client(self.suno_base_url, self.suno_api_key)
+
+    @staticmethod
+    def _suno_error(error: SunoError) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"success": False, "error": error.message}
+        if isinstance(error, CircuitOpenError):
+            result["retry_after"] = round(error.retry_after, 1)
+        return result
+
     def generate_song_suno(self, prompt: str, style: str = "pop", timeout: int = 30):
         """
         Genera una canción usando la API de Suno (API Box)
         Args:
             prompt (str): Descripción o letra base
             style (str): Estilo musical
-            timeout (int): Timeout en segundos
+            timeout (int): Timeout en segundos de cada intento
         Returns:
             dict: Respuesta de la API Suno
         """
-        headers = {
-            "Authorization": f"Bearer {self.suno_api_key}",
-            "Content-Type": "application/json",
-        }
-        payload = {"prompt": prompt, "style": style}
         try:
-            response = requests.post(
-                f"{self.suno_base_url}/generate-song",
-                headers=headers,
-                json=payload,
-                timeout=timeout,
-            )
-            response.raise_for_status()
-            return {"success": True, "data": response.json()}
-        except requests.Timeout:
-            return {"success": False, "error": "Timeout al conectar con Suno"}
-        except Exception as e:
-            return {"success": False, "error": str(e)}
+            return {"success": True, "data": self.suno.generate_song_sync(prompt, style, timeout)}
+        except SunoError as e:
+            return self._suno_error(e)
 
-    def generate_text(self, prompt: str, max_tokens: int = 100):
+    async def agenerate_song_suno(
+        self, prompt: str, style: str = "pop", timeout: int = 30
+    ) -> Dict[str, Any]:
+        """Versión asíncrona de `generate_song_suno` sobre el pool compartido."""
+        try:
+            return {"success": True, "data": await self.suno.generate_song(prompt, style, timeout)}
+        except SunoError as e:
+            return self._suno_error(e)
+
+    @staticmethod
+    def _text_result(response: Any) -> Dict[str, Any]:
+        content = None
+        if (
+            response.choices
+            and response.choices[0].message
+            and response.choices[0].message.content
+        ):
+            content = response.choices[0].message.content
+        if content:
+            return {"success": True, "data": content.strip()}
+        else:
+            return {"success": False, "error": "Respuesta vacía de OpenAI"}
+
+    @staticmethod
+    def _image_result(response: Any) -> Dict[str, Any]:
+        url = None
+        if (
+            hasattr(response, "data")
+            and response.data
+            and hasattr(response.data[0], "url")
+        ):
+            url = response.data[0].url
+        if url:
+            return {"success": True, "data": url}
+        else:
+            return {
+                "success": False,
+                "error": "No se pudo obtener la URL de la imagen generada",
+            }
+
+    def _text_key(self, prompt: str, max_tokens: int) -> str:
+        return cache_key("text", self.TEXT_MODEL, prompt, max_tokens=max_tokens)
+
+    def _image_key(self, description: str) -> str:
+        return cache_key("image", self.IMAGE_MODEL, description, n=1, size="1024x1024")
+
+    def _cached_sync(self, key: str, use_cache: bool) -> Optional[Dict[str, Any]]:
+        if self.cache is None:
+            return None
+        if not use_cache:
+            self.cache.record_bypass()
+            return None
+        return self.cache.get_sync(key)
+
+    async def _cached(self, key: str, use_cache: bool) -> Optional[Dict[str, Any]]:
+        if self.cache is None:
+            return None
+        if not use_cache:
+            self.cache.record_bypass()
+            return None
+        return await self.cache.get(key)
+
+    def generate_text(
+        self, prompt: str, max_tokens: int = 100, use_cache: bool = True
+    ) -> Dict[str, Any]:
+        key = self._text_key(prompt, max_tokens)
+        cached = self._cached_sync(key, use_cache)
+        if cached is not None:
+            return cached
         try:
             response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
+                model=self.TEXT_MODEL,
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=max_tokens,
             )
-            content = None
-            if (
-                response.choices
-                and response.choices[0].message
-                and response.choices[0].message.content
-            ):
-                content = response.choices[0].message.content
-            if content:
-                return {"success": True, "data": content.strip()}
-            else:
-                return {"success": False, "error": "Respuesta vacía de OpenAI"}
+            result = self._text_result(response)
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+        if self.cache is not None and result["success"]:
+            self.cache.set_sync(key, result)
+        return result
+
+    def generate_image(self, description: str, use_cache: bool = True) -> Dict[str, Any]:
+        key = self._image_key(description)
+        cached = self._cached_sync(key, use_cache)
+        if cached is not None:
+            return cached
+        try:
+            response = openai.images.generate(
+                model=self.IMAGE_MODEL, prompt=description, n=1, size="1024x1024"
+            )
+            result = self._image_result(response)
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+        if self.cache is not None and result["success"]:
+            self.cache.set_sync(key, result, ttl=PROMPT_CACHE_IMAGE_TTL)
+        return result
+
+    async def agenerate_text(
+        self, prompt: str, max_tokens: int = 100, use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Versión asíncrona de `generate_text` sobre el cliente compartido.
+        Con `use_cache=False` ignora la caché y guarda el resultado nuevo.
+        Las peticiones idénticas simultáneas comparten una sola llamada.
+        """
+        key = self._text_key(prompt, max_tokens)
+        cached = await self._cached(key, use_cache)
+        if cached is not None:
+            return cached
+        result: Dict[str, Any] = await self.flights.do(
+            key, lambda: self._fetch_text(key, prompt, max_tokens)
+        )
+        return result
+
+    async def _fetch_text(self, key: str, prompt: str, max_tokens: int) -> Dict[str, Any]:
+        try:
+            async with self._semaphore(self.TEXT_MODEL):
+                response = await self.async_client.chat.completions.create(
+                    model=self.TEXT_MODEL,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=max_tokens,
+                )
+            result = self._text_result(response)
         except Exception as e:
             return {"success": False, "error": str(e)}
+        if self.cache is not None and result["success"]:
+            await self.cache.set(key, result)
+        return result
+
+    async def astream_text(
+        self, prompt: str, max_tokens: int = 100, use_cache: bool = True
+    ) -> AsyncGenerator[str, None]:
+        """
+        Genera texto en streaming y lo entrega fragmento a fragmento.
+        Un acierto de caché sale como un único fragmento; el texto completo se
+        guarda en caché al terminar. Cerrar el generador cierra la conexión.
+
+        Raises:
+            Exception: Errores de OpenAI (antes o durante el stream)
+        """
+        key = self._text_key(prompt, max_tokens)
+        cached = await self._cached(key, use_cache)
+        if cached is not None:
+            yield cached["data"]
+            return
+        parts = []
+        async with self._semaphore(self.TEXT_MODEL):
+            stream = await self.async_client.chat.completions.create(
+                model=self.TEXT_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                stream=True,
+            )
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
+        text = "".join(parts).strip()
+        if self.cache is not None and text:
+            await self.cache.set(key, {"success": True, "data": text})
+
+    async def agenerate_image(self, description: str, use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Versión asíncrona de `generate_image` sobre el cliente compartido.
+        Con `use_cache=False` ignora la caché y guarda el resultado nuevo.
+        Las peticiones idénticas simultáneas comparten una sola llamada.
+        """
+        key = self._image_key(description)
+        cached = await self._cached(key, use_cache)
+        if cached is not None:
+            return cached
+        result: Dict[str, Any] = await self.flights.do(
+            key, lambda: self._fetch_image(key, description)
+        )
+        return result
 
-    def generate_image(self, description: str):
+    async def _fetch_image(self, key: str, description: str) -> Dict[str, Any]:
         try:
-            response = openai.images.generate(prompt=description, n=1, size="1024x1024")
-            url = None
-            if (
-                hasattr(response, "data")
-                and response.data
-                and hasattr(response.data[0], "url")
-            ):
-                url = response.data[0].url
-            if url:
-                return {"success": True, "data": url}
-            else:
-                return {
-                    "success": False,
-                    "error": "No se pudo obtener la URL de la imagen generada",
-                }
+            async with self._semaphore(self.IMAGE_MODEL):
+                response = await self.async_client.images.generate(
+                    model=self.IMAGE_MODEL, prompt=description, n=1, size="1024x1024"
+                )
+            result = self._image_result(response)
         except Exception as e:
             return {"success": False, "error": str(e)}
+        if self.cache is not None and result["success"]:
+            await self.cache.set(key, result, ttl=PROMPT_CACHE_IMAGE_TTL)
+        return result
@@ -0,0 +1,354 @@
+"""
+Arte de álbum local renderizado en memoria y direccionado por contenido.
+
+Cada imagen se identifica por el hash de (descripción, estilo, tamaño): la
+misma petición devuelve siempre la misma clave, así que el resultado se
+puede cachear y servir con un ETag fuerte. El render (PIL, CPU) corre en un
+pool de procesos fuera del event loop; las imágenes se guardan en una LRU
+acotada por número y por bytes, y renders idénticos concurrentes se
+comparten.
+
+Los parámetros se guardan en el almacén de blobs: su JSON es justo lo que
+se hashea, así que el blob de parámetros tiene como sha la propia clave.
+El PNG renderizado es otro blob, enlazado desde un anexo del de parámetros.
+Con el almacén local, cualquier worker (o el proceso tras un reinicio)
+sirve `/album-art/<clave>.png` sin haber visto la petición original.
+
+Las variantes (miniaturas y tamaños intermedios en PNG, WebP o AVIF) se
+generan a partir de la portada la primera vez que se piden, se cachean
+con la clave de variante `<clave>-<ancho>.<formato>` y se guardan igual.
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+import textwrap
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from PIL import Image, ImageDraw, ImageFont, features
+
+from backend.config import (
+    ALBUM_ART_CACHE_ITEMS,
+    ALBUM_ART_CACHE_MAX_BYTES,
+    ALBUM_ART_VARIANT_WIDTHS,
+    ALBUM_ART_WORKERS,
+)
+from backend.blob_store import BlobStore, InMemoryBlobStore
+from backend.single_flight import SingleFlight
+
+# Tipo de los blobs de parámetros de portada
+ART_CONTENT_TYPE = "application/vnd.album-art+json"
+
+# Color de fondo y de texto por estilo; los demás estilos derivan el color del hash
+STYLE_COLORS: Dict[str, Tuple[Tuple[int, int, int], Tuple[int, int, int]]] = {
+    "": ((73, 109, 137), (255, 255, 0)),
+    "pop": ((232, 67, 147), (255, 255, 255)),
+    "rock": ((30, 30, 30), (220, 40, 40)),
+    "jazz": ((44, 62, 80), (241, 196, 15)),
+    "electronica": ((20, 20, 60), (0, 255, 200)),
+    "clasica": ((245, 240, 225), (60, 40, 20)),
+}
+
+
+# Formatos de variante disponibles en esta instalación de PIL
+VARIANT_FORMATS: Dict[str, str] = {
+    fmt: content_type
+    for fmt, content_type, available in (
+        ("png", "image/png", True),
+        ("webp", "image/webp", features.check("webp")),
+        ("avif", "image/avif", features.check("avif")),
+    )
+    if available
+}
+
+
+def art_params(description: str, style: str = "", size: int = 600) -> bytes:
+    """Parámetros de render normalizados, en el JSON que se guarda y se hashea."""
+    payload = json.dumps(
+        {"description": description, "style": style.strip().lower(), "size": size},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return payload.encode("utf-8")
+
+
+def art_key(description: str, style: str = "", size: int = 600) -> str:
+    """Clave de contenido de una imagen: sha256 de sus parámetros de render."""
+    return hashlib.sha256(art_params(description, style, size)).hexdigest()
+
+
+def _colors(style: str) -> Tuple[Tuple[int, int, int], Tuple[int, int, int]]:
+    style = style.strip().lower()
+    if style in STYLE_COLORS:
+        return STYLE_COLORS[style]
+    digest = hashlib.sha256(style.encode("utf-8")).digest()
+    background = (digest[0] // 2, digest[1] // 2, digest[2] // 2)
+    return background, (255, 255, 255)
+
+
+def render_album_art(description: str, style: str = "", size: int = 600) -> bytes:
+    """Dibuja la portada y la devuelve en PNG (nivel de módulo: se ejecuta en el pool)."""
+    background, foreground = _colors(style)
+    img = Image.new("RGB", (size, size), color=background)
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default()
+    y = 10
+    for line in textwrap.wrap(description, width=max(10, size // 7)) or [""]:
+        draw.text((10, y), line, fill=foreground, font=font)
+        y += 14
+        if y > size - 14:
+            break
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG", optimize=False)
+    return buffer.getvalue()
+
+
+def render_variant(data: bytes, width: int, fmt: str) -> bytes:
+    """Reescala una portada al ancho pedido y la codifica en `fmt` (se ejecuta en el pool)."""
+    img: Image.Image = Image.open(io.BytesIO(data))
+    img.load()
+    if img.width != width:
+        height = round(img.height * width / img.width)
+        img = img.resize((width, height), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    if fmt == "webp":
+        img.save(buffer, format="WEBP", quality=80, method=4)
+    elif fmt == "avif":
+        img.save(buffer, format="AVIF", quality=60)
+    else:
+        img.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def variant_key(key: str, width: int, fmt: str) -> str:
+    return f"{key}-{width}.{fmt}"
+
+
+@dataclass(frozen=True)
+class RenderedImage:
+    key: str
+    data: bytes
+    content_type: str = "image/png"
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.key}"'
+
+    @property
+    def extension(self) -> str:
+        return self.content_type.split("/")[-1]
+
+
+class AlbumArtCache:
+    """
+    LRU de imágenes renderizadas, acotada por número de entradas y por bytes,
+    delante del almacén de blobs donde se guardan parámetros e imágenes.
+
+    Args:
+        max_items: Imágenes máximas en memoria
+        max_bytes: Bytes máximos de imágenes en memoria
+        workers: Procesos del pool de render
+        executor: Executor a usar en lugar del pool propio
+        variant_widths: Anchos de variante permitidos (además del original)
+        blobs: Almacén de blobs compartido (por defecto uno en memoria)
+    """
+
+    def __init__(
+        self,
+        max_items: int = 256,
+        max_bytes: int = 64 * 2**20,
+        workers: int = 2,
+        executor: Optional[Executor] = None,
+        variant_widths: Sequence[int] = (128, 256, 512),
+        blobs: Optional[BlobStore] = None,
+    ):
+        self.max_items = max(1, max_items)
+        self.max_bytes = max_bytes
+        self.workers = max(1, workers)
+        self._executor = executor
+        self._owns_executor = executor is None
+        self.variant_widths = sorted(set(variant_widths))
+        self.blobs = blobs if blobs is not None else InMemoryBlobStore()
+        self._images: "OrderedDict[str, RenderedImage]" = OrderedDict()
+        self._bytes = 0
+        self._flights = SingleFlight()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stored_hits": 0,
+            "renders": 0,
+            "evictions": 0,
+            "variant_renders": 0,
+        }
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            # spawn: el proceso del servidor ya tiene hilos (uvicorn, torch) y fork no es seguro
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def get(self, key: str) -> Optional[RenderedImage]:
+        image = self._images.get(key)
+        if image is not None:
+            self._images.move_to_end(key)
+        return image
+
+    def _store(self, image: RenderedImage) -> None:
+        if len(image.data) > self.max_bytes:
+            return
+        old = self._images.pop(image.key, None)
+        if old is not None:
+            self._bytes -= len(old.data)
+        self._images[image.key] = image
+        self._bytes += len(image.data)
+        while len(self._images) > self.max_items or self._bytes > self.max_bytes:
+            _, evicted = self._images.popitem(last=False)
+            self._bytes -= len(evicted.data)
+            self.stats["evictions"] += 1
+
+    # --- Almacén de blobs ---
+
+    async def _params(self, key: str) -> Optional[Tuple[str, str, int]]:
+        """Parámetros de una clave guardados por cualquier proceso (None si no existen)."""
+        meta = await self.blobs.get(key)
+        if meta is None or meta.content_type != ART_CONTENT_TYPE:
+            return None
+        with self.blobs.open(key) as data:
+            params = json.loads(bytes(data))
+        return params["description"], params["style"], int(params["size"])
+
+    async def _load(
+        self, key: str, name: str, image_key: str, content_type: str
+    ) -> Optional[RenderedImage]:
+        """Imagen enlazada desde el anexo `name` del blob de parámetros."""
+        ref = await self.blobs.get_sidecar(key, name)
+        if ref is None or await self.blobs.get(ref.decode()) is None:
+            return None
+        with self.blobs.open(ref.decode()) as data:
+            image = RenderedImage(image_key, bytes(data), content_type)
+        self.stats["stored_hits"] += 1
+        return image
+
+    async def _save(self, key: str, name: str, image: RenderedImage) -> None:
+        meta, _ = await self.blobs.put(image.data, image.content_type)
+        await self.blobs.put_sidecar(key, name, meta.sha256.encode())
+
+    # --- API ---
+
+    async def _render(self, key: str, description: str, style: str, size: int) -> RenderedImage:
+        await self.blobs.put(art_params(description, style, size), ART_CONTENT_TYPE)
+        image = await self._load(key, "png", key, "image/png")
+        if image is None:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(
+                self.executor, render_album_art, description, style, size
+            )
+            self.stats["renders"] += 1
+            image = RenderedImage(key, data)
+            await self._save(key, "png", image)
+        self._store(image)
+        return image
+
+    async def get_or_render(
+        self, description: str, style: str = "", size: int = 600
+    ) -> RenderedImage:
+        """Devuelve la imagen de la caché o la renderiza (una sola vez por clave en vuelo)."""
+        key = art_key(description, style, size)
+        image = self.get(key)
+        if image is not None:
+            self.stats["hits"] += 1
+            return image
+        self.stats["misses"] += 1
+        rendered: RenderedImage = await self._flights.do(
+            key, lambda: self._render(key, description, style, size)
+        )
+        return rendered
+
+    async def get_by_key(self, key: str) -> Optional[RenderedImage]:
+        """Imagen por clave; fuera de memoria se busca en el almacén o se vuelve a renderizar."""
+        image = self.get(key)
+        if image is not None:
+            self.stats["hits"] += 1
+            return image
+        params = await self._params(key)
+        if params is None:
+            return None
+        return await self.get_or_render(*params)
+
+    async def _render_variant(
+        self, key: str, vkey: str, width: int, fmt: str
+    ) -> Optional[RenderedImage]:
+        name = f"{width}{fmt}"
+        image = await self._load(key, name, vkey, VARIANT_FORMATS[fmt])
+        if image is None:
+            base = await self.get_by_key(key)
+            if base is None:
+                return None
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(self.executor, render_variant, base.data, width, fmt)
+            self.stats["variant_renders"] += 1
+            image = RenderedImage(vkey, data, VARIANT_FORMATS[fmt])
+            await self._save(key, name, image)
+        self._store(image)
+        return image
+
+    async def get_variant(self, key: str, width: int, fmt: str) -> Optional[RenderedImage]:
+        """
+        Variante de una portada; se genera la primera vez que se pide.
+
+        Returns:
+            None si la portada no existe, el formato no está disponible o el
+            ancho supera al de la portada (no se amplía)
+        """
+        if fmt not in VARIANT_FORMATS:
+            return None
+        vkey = variant_key(key, width, fmt)
+        image = self.get(vkey)
+        if image is not None:
+            self.stats["hits"] += 1
+            return image
+        params = await self._params(key)
+        # Solo anchos conocidos: un ancho arbitrario por petición llenaría el almacén
+        if params is None or (width not in self.variant_widths and width != params[2]):
+            return None
+        if width > params[2]:
+            return None
+        self.stats["misses"] += 1
+        variant: Optional[RenderedImage] = await self._flights.do(
+            vkey, lambda: self._render_variant(key, vkey, width, fmt)
+        )
+        return variant
+
+    def variant_urls(
+        self, key: str, size: int, prefix: str = "/album-art"
+    ) -> Dict[str, Dict[str, str]]:
+        """URLs de las variantes de una portada por ancho y formato (se generan al pedirlas)."""
+        widths = [w for w in self.variant_widths if w < size] + [size]
+        return {
+            str(width): {fmt: f"{prefix}/{key}/{width}.{fmt}" for fmt in VARIANT_FORMATS}
+            for width in widths
+        }
+
+    def metrics(self) -> Dict[str, Any]:
+        return {**self.stats, "items": len(self._images), "bytes": self._bytes}
+
+    def shutdown(self) -> None:
+        if self._executor is not None and self._owns_executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+album_art_cache = AlbumArtCache(
+    ALBUM_ART_CACHE_ITEMS,
+    ALBUM_ART_CACHE_MAX_BYTES,
+    ALBUM_ART_WORKERS,
+    variant_widths=ALBUM_ART_VARIANT_WIDTHS,
+)
@@ -0,0 +1,394 @@
+"""
+Decodificación y codificación de audio con NumPy.
+
+Las muestras se manejan siempre como `float32` en [-1, 1] con forma
+`(frames, canales)`. WAV (PCM de 8/16/24/32 bits y float32) se decodifica
+directamente desde el buffer (mmap del almacén de blobs) sin copias
+intermedias; MP3 y demás formatos se delegan en ffmpeg si está instalado
+(FFMPEG_BINARY).
+
+`LoudnessMeter` mide la sonoridad integrada al estilo de ITU-R BS.1770
+(ponderación K y bloques de 400 ms con puertas absoluta y relativa) por
+bloques de tamaño fijo, y `normalize_loudness` ajusta la ganancia a un
+objetivo en LUFS sin pasar de un techo de pico.
+
+`render_song` sintetiza una canción de relleno mientras el generador local
+sigue simulado, para que el resto del pipeline (picos, previas) trabaje con
+audio real.
+"""
+
+import hashlib
+import shutil
+import struct
+import subprocess
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend.config import FFMPEG_BINARY
+
+# Frecuencia de trabajo del pipeline y de la decodificación con ffmpeg
+SAMPLE_RATE = 44100
+
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_FLOAT = 3
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+_PCM_FORMATS = {
+    (_WAVE_FORMAT_PCM, 8),
+    (_WAVE_FORMAT_PCM, 16),
+    (_WAVE_FORMAT_PCM, 24),
+    (_WAVE_FORMAT_PCM, 32),
+    (_WAVE_FORMAT_FLOAT, 32),
+}
+
+
+class AudioDecodeError(Exception):
+    pass
+
+
+def _pcm24(raw: np.ndarray) -> np.ndarray:
+    # 3 bytes little-endian por muestra: se amplían a int32 con el signo en el byte alto
+    triples = raw.reshape(-1, 3).astype(np.int32)
+    values = triples[:, 0] | (triples[:, 1] << 8) | (triples[:, 2] << 16)
+    return ((values << 8) >> 8).astype(np.float32) / 2**23
+
+
+@dataclass(frozen=True)
+class WavLayout:
+    """Formato y posición de los datos PCM dentro de un WAV."""
+
+    tag: int
+    channels: int
+    sample_rate: int
+    bits: int
+    data_start: int
+    data_end: int
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.bits // 8 * self.channels
+
+    @property
+    def frames(self) -> int:
+        return (self.data_end - self.data_start) // self.frame_bytes
+
+
+def wav_layout(buffer: Any) -> WavLayout:
+    """
+    Lee la cabecera de un WAV sin tocar los datos de audio.
+
+    Raises:
+        AudioDecodeError: Si no es un WAV o el formato no está soportado
+    """
+    view = memoryview(buffer)
+    if len(view) < 12 or view[:4] != b"RIFF" or view[8:12] != b"WAVE":
+        raise AudioDecodeError("No es un archivo WAV")
+    offset = 12
+    fmt: Optional[Tuple[int, int, int, int]] = None
+    while offset + 8 <= len(view):
+        chunk_id = bytes(view[offset : offset + 4])
+        (size,) = struct.unpack_from("<I", view, offset + 4)
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            tag, channels, rate = struct.unpack_from("<HHI", view, body)
+            (bits,) = struct.unpack_from("<H", view, body + 14)
+            if tag == _WAVE_FORMAT_EXTENSIBLE and size >= 26:
+                (tag,) = struct.unpack_from("<H", view, body + 24)
+            if (tag, bits) not in _PCM_FORMATS or channels == 0:
+                raise AudioDecodeError(f"Formato WAV no soportado (tipo {tag}, {bits} bits)")
+            fmt = (tag, channels, rate, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise AudioDecodeError("WAV sin cabecera de formato")
+            tag, channels, rate, bits = fmt
+            # Algunos escritores dejan el tamaño a 0 o 0xFFFFFFFF al emitir en streaming
+            end = len(view) if size in (0, 0xFFFFFFFF) else min(len(view), body + size)
+            end -= (end - body) % (bits // 8 * channels)
+            return WavLayout(tag, channels, rate, bits, body, end)
+        offset = body + size + (size & 1)
+    raise AudioDecodeError("WAV sin datos de audio")
+
+
+def pcm_to_float(raw: np.ndarray, layout: WavLayout) -> np.ndarray:
+    """Convierte bytes PCM (uint8) de un WAV en float32 (frames, canales)."""
+    tag, bits = layout.tag, layout.bits
+    if tag == _WAVE_FORMAT_FLOAT:
+        samples = raw.view("<f4").astype(np.float32)
+    elif bits == 8:
+        samples = ((raw.astype(np.float32) - 128) / 128).astype(np.float32, copy=False)
+    elif bits == 16:
+        samples = (raw.view("<i2").astype(np.float32) / 2**15).astype(np.float32, copy=False)
+    elif bits == 24:
+        samples = _pcm24(raw)
+    else:
+        samples = (raw.view("<i4") / 2**31).astype(np.float32)
+    return samples.reshape(-1, layout.channels)
+
+
+def decode_wav(buffer: Any) -> Tuple[np.ndarray, int]:
+    """
+    Decodifica un WAV desde un buffer (bytes, memoryview o mmap).
+
+    Returns:
+        (muestras float32 (frames, canales), frecuencia de muestreo)
+
+    Raises:
+        AudioDecodeError: Si no es un WAV o el formato no está soportado
+    """
+    layout = wav_layout(buffer)
+    raw = np.frombuffer(memoryview(buffer)[layout.data_start : layout.data_end], dtype=np.uint8)
+    return pcm_to_float(raw, layout), layout.sample_rate
+
+
+def decode_with_ffmpeg(data: Any, sample_rate: int = SAMPLE_RATE) -> Tuple[np.ndarray, int]:
+    """Decodifica cualquier formato que entienda ffmpeg a float32 estéreo."""
+    binary = shutil.which(FFMPEG_BINARY)
+    if binary is None:
+        raise AudioDecodeError("Formato no WAV y ffmpeg no está instalado")
+    result = subprocess.run(
+        [
+            binary, "-v", "error", "-i", "pipe:0",
+            "-f", "f32le", "-ac", "2", "-ar", str(sample_rate), "pipe:1",
+        ],
+        input=bytes(data),
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        raise AudioDecodeError(result.stderr.decode("utf-8", "replace").strip() or "ffmpeg falló")
+    return np.frombuffer(result.stdout, dtype="<f4").reshape(-1, 2), sample_rate
+
+
+def decode_audio(buffer: Any) -> Tuple[np.ndarray, int]:
+    """WAV con NumPy; el resto (MP3, OGG, FLAC, M4A) con ffmpeg."""
+    if bytes(buffer[:4]) == b"RIFF":
+        return decode_wav(buffer)
+    return decode_with_ffmpeg(buffer)
+
+
+def _wav_header(channels: int, sample_rate: int, data_size: int) -> bytes:
+    return (
+        b"RIFF" + struct.pack("<I", 36 + data_size) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, _WAVE_FORMAT_PCM, channels, sample_rate,
+                                sample_rate * channels * 2, channels * 2, 16)
+        + b"data" + struct.pack("<I", data_size)
+    )
+
+
+def _to_pcm16(samples: np.ndarray) -> bytes:
+    return np.clip(np.round(samples * 32767), -32768, 32767).astype("<i2").tobytes()
+
+
+def encode_wav(samples: np.ndarray, sample_rate: int) -> bytes:
+    """Codifica muestras float32 (frames, canales) como WAV PCM de 16 bits."""
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    pcm = _to_pcm16(samples)
+    return _wav_header(samples.shape[1], sample_rate, len(pcm)) + pcm
+
+
+class WavWriter:
+    """Escribe un WAV PCM de 16 bits por bloques; la cabecera se completa al cerrar."""
+
+    def __init__(self, path: str, sample_rate: int, channels: int):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames = 0
+        self.file = open(path, "wb")
+        self.file.write(_wav_header(channels, sample_rate, 0))
+
+    def write(self, block: np.ndarray) -> None:
+        self.file.write(_to_pcm16(block))
+        self.frames += len(block)
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self.file.seek(0)
+        data_size = self.frames * self.channels * 2
+        self.file.write(_wav_header(self.channels, self.sample_rate, data_size))
+        self.file.close()
+
+
+def _biquad_power(
+    b: Tuple[float, float, float], a: Tuple[float, float, float], w: np.ndarray
+) -> np.ndarray:
+    z = np.exp(-1j * w)
+    h = (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+    return np.abs(h) ** 2
+
+
+def _k_weighting_power(frames: int, sample_rate: int) -> np.ndarray:
+    """|H(f)|² de la ponderación K (estantería alta + paso alto) en los bins de la rfft."""
+    w = 2 * np.pi * np.fft.rfftfreq(frames)
+    # Coeficientes de BS.1770 derivados del prototipo analógico para cualquier frecuencia
+    k = np.tan(np.pi * 1681.974450955533 / sample_rate)
+    vh, vb, q = 10 ** (3.999843853973347 / 20), 10 ** (3.999843853973347 / 40), 0.7071752369554196
+    a0 = 1 + k / q + k * k
+    shelf_b = (
+        (vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0
+    )
+    shelf_a = (1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0)
+    k = np.tan(np.pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    highpass_b = (1.0, -2.0, 1.0)
+    highpass_a = (1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0)
+    power = _biquad_power(shelf_b, shelf_a, w) * _biquad_power(highpass_b, highpass_a, w)
+    return np.asarray(power, dtype=np.float64)
+
+
+# Longitud del FIR de ponderación K: ~90 ms a 44,1 kHz,
+# resolución suficiente para el paso alto de 38 Hz
+K_WEIGHTING_TAPS = 4097
+
+
+def k_weighting_fir(sample_rate: int, taps: int = K_WEIGHTING_TAPS) -> np.ndarray:
+    """FIR de fase lineal con la magnitud de la ponderación K (muestreo en frecuencia)."""
+    grid = 8 * taps
+    magnitude = np.sqrt(_k_weighting_power(grid, sample_rate))
+    impulse = np.roll(np.fft.irfft(magnitude, n=grid), taps // 2)[:taps]
+    return impulse * np.blackman(taps)
+
+
+class LoudnessMeter:
+    """
+    Medidor de sonoridad integrada (BS.1770) que procesa el audio por
+    bloques: memoria acotada en pistas largas.
+
+    La ponderación K es un FIR aplicado por convolución FFT (overlap-save)
+    en vez del IIR de la norma, para que todo sean operaciones vectorizadas;
+    la energía por bloque es prácticamente la misma. Solo se guarda la
+    energía de cada tramo de 100 ms.
+    """
+
+    def __init__(self, sample_rate: int, channels: int, taps: int = K_WEIGHTING_TAPS):
+        self.sample_rate = sample_rate
+        self.fir = k_weighting_fir(sample_rate, taps)
+        self.hop = int(0.1 * sample_rate)
+        self._history = np.zeros((taps - 1, channels))
+        self._partial = np.zeros(0)
+        self._hops: List[float] = []
+        self._responses: Dict[int, np.ndarray] = {}
+
+    def process(self, block: np.ndarray) -> None:
+        if block.ndim == 1:
+            block = block[:, None]
+        if len(block) == 0:
+            return
+        x = np.concatenate([self._history, block])
+        self._history = x[len(x) - len(self._history):]
+        size = 1 << (len(x) - 1).bit_length()
+        if size not in self._responses:
+            self._responses[size] = np.fft.rfft(self.fir, n=size)[:, None]
+        spectrum = np.fft.rfft(x, n=size, axis=0) * self._responses[size]
+        weighted = np.fft.irfft(spectrum, n=size, axis=0)[len(self.fir) - 1 : len(x)]
+        energy = np.concatenate([self._partial, np.sum(weighted * weighted, axis=1)])
+        full = len(energy) // self.hop * self.hop
+        self._hops.extend(energy[:full].reshape(-1, self.hop).sum(axis=1).tolist())
+        self._partial = energy[full:]
+
+    @property
+    def hops(self) -> np.ndarray:
+        """Energía ponderada (suma de cuadrados de todos los canales) de cada tramo de 100 ms."""
+        return np.array(self._hops)
+
+    def integrated(self) -> float:
+        """Sonoridad integrada en LUFS (-inf si hay menos de 400 ms o todo es silencio)."""
+        return gated_loudness(self.hops, self.hop)
+
+
+def gated_loudness(hops: np.ndarray, hop: int) -> float:
+    """Sonoridad integrada a partir de las energías por tramo de 100 ms (`hop` muestras)."""
+    if len(hops) < 4:
+        return float("-inf")
+    # Bloques de 400 ms con solape del 75 %: 4 tramos consecutivos de 100 ms
+    power = (hops[:-3] + hops[1:-2] + hops[2:-1] + hops[3:]) / (4 * hop)
+    with np.errstate(divide="ignore"):
+        loudness = -0.691 + 10 * np.log10(power)
+    gated = power[loudness > -70]
+    if len(gated) == 0:
+        return float("-inf")
+    relative = -0.691 + 10 * np.log10(gated.mean()) - 10
+    gated = power[loudness > max(-70.0, relative)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+# Bloque que, con la historia del FIR, llena exactamente una FFT de 2^17 puntos
+LOUDNESS_BLOCK = (1 << 17) - (K_WEIGHTING_TAPS - 1)
+
+
+def integrated_loudness(
+    samples: np.ndarray, sample_rate: int, block_size: int = LOUDNESS_BLOCK
+) -> float:
+    """Sonoridad integrada en LUFS (BS.1770 con puertas de -70 LUFS y -10 LU)."""
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    meter = LoudnessMeter(sample_rate, samples.shape[1])
+    for start in range(0, len(samples), block_size):
+        meter.process(samples[start : start + block_size])
+    return meter.integrated()
+
+
+def normalize_loudness(
+    samples: np.ndarray, sample_rate: int, target_lufs: float = -14.0, peak_ceiling_db: float = -1.0
+) -> np.ndarray:
+    """Ganancia para llegar a `target_lufs`, recortada si el pico pasaría del techo."""
+    loudness = integrated_loudness(samples, sample_rate)
+    if not np.isfinite(loudness):
+        return samples
+    gain = 10 ** ((target_lufs - loudness) / 20)
+    peak = float(np.abs(samples).max())
+    if peak > 0:
+        gain = min(gain, 10 ** (peak_ceiling_db / 20) / peak)
+    return np.asarray(samples * np.float32(gain), dtype=np.float32)
+
+
+def apply_fades(
+    samples: np.ndarray, sample_rate: int, fade_in: float = 0.5, fade_out: float = 1.5
+) -> np.ndarray:
+    """Fundido de entrada y de salida lineales (para recortes que no empiezan en silencio)."""
+    out: np.ndarray = samples.copy()
+    n_in = min(len(out), int(fade_in * sample_rate))
+    n_out = min(len(out), int(fade_out * sample_rate))
+    if n_in:
+        out[:n_in] *= np.linspace(0, 1, n_in, dtype=np.float32)[:, None]
+    if n_out:
+        out[-n_out:] *= np.linspace(1, 0, n_out, dtype=np.float32)[:, None]
+    return out
+
+
+# Grados (semitonos sobre la tónica) de la progresión I-V-vi-IV
+_PROGRESSION = ((0, 4, 7), (7, 11, 14), (9, 12, 16), (5, 9, 12))
+
+
+def render_song(
+    title: str,
+    genre: str = "",
+    seconds: float = 180.0,
+    sample_rate: int = SAMPLE_RATE,
+    start: float = 0.0,
+) -> np.ndarray:
+    """
+    Canción de relleno determinista (misma entrada, mismo audio): acordes
+    sobre una tónica derivada del título, con un compás por acorde.
+
+    `start` permite sintetizar solo un tramo (`seconds` a partir de `start`)
+    sin generar lo anterior.
+    """
+    digest = hashlib.sha256(f"{title}|{genre}".encode("utf-8")).digest()
+    tonic = 110.0 * 2 ** (digest[0] % 12 / 12)
+    bar = 60.0 / (90 + digest[1] % 50) * 4
+    frames = int(seconds * sample_rate)
+    first = int(start * sample_rate)
+    t = (np.arange(first, first + frames, dtype=np.float64) / sample_rate).astype(np.float32)
+    chord = (t // bar).astype(np.int64) % len(_PROGRESSION)
+    phase_in_bar = (t % bar) / bar
+    envelope = np.exp(-3.0 * phase_in_bar).astype(np.float32)
+    mono = np.zeros(frames, dtype=np.float32)
+    for voice in range(3):
+        semitones = np.array([degrees[voice] for degrees in _PROGRESSION], dtype=np.float32)[chord]
+        mono += np.sin(2 * np.pi * tonic * 2 ** (semitones / 12) * t).astype(np.float32)
+    mono *= 0.25 * envelope
+    pan = 0.1 + 0.8 * digest[2] / 255
+    return np.stack([mono * (1 - pan) * 1.4, mono * pan * 1.4], axis=1).astype(np.float32)
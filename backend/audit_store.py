@@ -0,0 +1,278 @@
+"""
+Almacén de auditoría de compras y canciones generadas.
+
+SQLite en modo WAL, solo inserciones, con índices por email y timestamp.
+Las escrituras se acumulan en memoria y un flusher en segundo plano las
+inserta por lotes en un hilo, fuera del camino de la petición. Las consultas
+usan paginación por cursor (el id autoincremental) y filtros de tiempo.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("backend")
+
+# Tabla -> columnas de datos (además de `id`)
+TABLES: Dict[str, Tuple[str, ...]] = {
+    "purchases": ("email", "plan", "price", "timestamp"),
+    "songs": ("email", "title", "timestamp"),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS purchases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT NOT NULL,
+    plan TEXT NOT NULL,
+    price INTEGER,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_purchases_email ON purchases (email, id);
+CREATE INDEX IF NOT EXISTS idx_purchases_timestamp ON purchases (timestamp);
+CREATE TABLE IF NOT EXISTS songs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT NOT NULL,
+    title TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_songs_email ON songs (email, id);
+CREATE INDEX IF NOT EXISTS idx_songs_timestamp ON songs (timestamp);
+"""
+
+
+def utc_iso(value: Optional[datetime] = None) -> str:
+    """Timestamp ISO-8601 en UTC, el formato en que se guardan los eventos."""
+    value = value or datetime.now(timezone.utc)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat()
+
+
+class AuditStore:
+    """
+    Registro persistente de eventos de auditoría.
+
+    Args:
+        path: Ruta del fichero SQLite (":memory:" no se comparte entre conexiones)
+        batch_size: Eventos pendientes que fuerzan un volcado inmediato
+        flush_interval: Segundos máximos que un evento espera en memoria
+    """
+
+    def __init__(self, path: str, batch_size: int = 500, flush_interval: float = 0.5):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, List[Tuple[Any, ...]]] = {table: [] for table in TABLES}
+        self._writer: Optional[sqlite3.Connection] = None
+        self._reader: Optional[sqlite3.Connection] = None
+        self._read_lock = threading.Lock()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._flusher: Optional["asyncio.Task[None]"] = None
+
+    def open(self) -> None:
+        if self._writer is not None:
+            return
+        self._writer = sqlite3.connect(self.path, check_same_thread=False)
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.execute("PRAGMA synchronous=NORMAL")
+        self._writer.executescript(_SCHEMA)
+        # Bases anteriores al precio: las compras antiguas quedan con price NULL
+        columns = {row[1] for row in self._writer.execute("PRAGMA table_info(purchases)")}
+        if "price" not in columns:
+            self._writer.execute("ALTER TABLE purchases ADD COLUMN price INTEGER")
+        self._writer.commit()
+        self._reader = sqlite3.connect(self.path, check_same_thread=False)
+        self._reader.row_factory = sqlite3.Row
+
+    def close(self) -> None:
+        for conn in (self._writer, self._reader):
+            if conn is not None:
+                conn.close()
+        self._writer = self._reader = None
+
+    async def start(self) -> None:
+        """Abre la base de datos y arranca el volcado periódico."""
+        await asyncio.to_thread(self.open)
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_loop(), name="audit-flusher")
+
+    async def stop(self) -> None:
+        """Vuelca lo pendiente y cierra la base de datos."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+        self.close()
+
+    # --- Escritura ---
+
+    def record(self, table: str, row: Dict[str, Any]) -> None:
+        """Encola un evento; no toca el disco."""
+        self._pending[table].append(tuple(row[column] for column in TABLES[table]))
+        if self._wake is not None and self.pending() >= self.batch_size:
+            self._wake.set()
+
+    def record_purchase(
+        self, email: str, plan: str, price: Optional[int] = None, timestamp: Optional[str] = None
+    ) -> None:
+        """Registra una compra con el precio realmente cobrado."""
+        self.record(
+            "purchases",
+            {"email": email, "plan": plan, "price": price, "timestamp": timestamp or utc_iso()},
+        )
+
+    def record_song(self, email: str, title: str, timestamp: Optional[str] = None) -> None:
+        self.record("songs", {"email": email, "title": title, "timestamp": timestamp or utc_iso()})
+
+    def pending(self) -> int:
+        return sum(len(rows) for rows in self._pending.values())
+
+    async def flush(self) -> int:
+        """
+        Inserta todos los eventos pendientes en una transacción.
+
+        Si la escritura falla (p. ej. "database is locked") el lote vuelve al
+        principio de la cola pendiente y se reintenta en el siguiente volcado.
+        """
+        if not self.pending():
+            return 0
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            batch = {table: rows for table, rows in self._pending.items() if rows}
+            self._pending = {table: [] for table in TABLES}
+            if not batch:
+                return 0
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                # Los eventos registrados mientras tanto van detrás del lote fallido
+                for table, rows in batch.items():
+                    self._pending[table][:0] = rows
+                logger.error(
+                    f"Error al volcar auditoría ({self.pending()} eventos pendientes): {e}"
+                )
+                return 0
+            return sum(len(rows) for rows in batch.values())
+
+    def _write_batch(self, batch: Dict[str, List[Tuple[Any, ...]]]) -> None:
+        self.open()
+        assert self._writer is not None
+        with self._writer:
+            for table, rows in batch.items():
+                columns = TABLES[table]
+                self._writer.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) "
+                    f"VALUES ({', '.join('?' for _ in columns)})",
+                    rows,
+                )
+
+    async def _flush_loop(self) -> None:
+        assert self._wake is not None
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error al volcar auditoría: {e}", exc_info=True)
+
+    # --- Lectura ---
+
+    def _query(self, sql: str, params: Tuple[Any, ...] = ()) -> List[sqlite3.Row]:
+        self.open()
+        assert self._reader is not None
+        with self._read_lock:
+            return self._reader.execute(sql, params).fetchall()
+
+    async def query(self, sql: str, params: Tuple[Any, ...] = ()) -> List[sqlite3.Row]:
+        """Ejecuta una consulta de lectura tras volcar lo pendiente."""
+        await self.flush()
+        return await asyncio.to_thread(self._query, sql, params)
+
+    async def page(
+        self,
+        table: str,
+        cursor: Optional[int] = None,
+        limit: int = 100,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        email: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Página de eventos ordenados por id.
+
+        Args:
+            table: "purchases" o "songs"
+            cursor: Último id recibido; la página empieza justo después
+            limit: Tamaño máximo de la página
+            since: Timestamp ISO inclusivo
+            until: Timestamp ISO exclusivo
+            email: Filtra por usuario
+
+        Returns:
+            {"items": [...], "next_cursor": id o None si no hay más}
+        """
+        if table not in TABLES:
+            raise ValueError(f"Tabla de auditoría desconocida: {table}")
+        clauses = ["id > ?"]
+        params: List[Any] = [cursor or 0]
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        if email:
+            clauses.append("email = ?")
+            params.append(email)
+        params.append(limit + 1)
+        rows = await self.query(
+            f"SELECT id, {', '.join(TABLES[table])} FROM {table} "
+            f"WHERE {' AND '.join(clauses)} ORDER BY id LIMIT ?",
+            tuple(params),
+        )
+        items = [dict(row) for row in rows[:limit]]
+        next_cursor = items[-1]["id"] if len(rows) > limit else None
+        return {"items": items, "next_cursor": next_cursor}
+
+    async def latest(self, table: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Últimos eventos registrados, del más reciente al más antiguo."""
+        rows = await self.query(
+            f"SELECT id, {', '.join(TABLES[table])} FROM {table} ORDER BY id DESC LIMIT ?",
+            (limit,),
+        )
+        return [dict(row) for row in rows]
+
+    async def count(self, table: str) -> int:
+        rows = await self.query(f"SELECT COUNT(*) FROM {table}")
+        return int(rows[0][0])
+
+    async def purchases_by_plan(self) -> Dict[str, int]:
+        rows = await self.query("SELECT plan, COUNT(*) FROM purchases GROUP BY plan")
+        return {row[0]: int(row[1]) for row in rows}
+
+    async def purchase_totals(self) -> Dict[str, Tuple[int, int, int]]:
+        """
+        Por plan: (compras, suma de precios registrados, compras sin precio).
+
+        Las compras sin precio son anteriores a que se guardara en la fila.
+        """
+        rows = await self.query(
+            "SELECT plan, COUNT(*), COALESCE(SUM(price), 0), COUNT(*) - COUNT(price) "
+            "FROM purchases GROUP BY plan"
+        )
+        return {row[0]: (int(row[1]), int(row[2]), int(row[3])) for row in rows}
+
+    async def distinct_emails(self) -> List[str]:
+        rows = await self.query("SELECT email FROM purchases UNION SELECT email FROM songs")
+        return [row[0] for row in rows]
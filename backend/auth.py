@@ -0,0 +1,146 @@
+"""
+Autenticación JWT y dependencias FastAPI de usuario autenticado.
+
+`get_current_user` decodifica el bearer token una sola vez por petición
+(FastAPI cachea la dependencia dentro de la petición) y guarda los tokens ya
+verificados en un LRU acotado que descarta cada entrada al llegar su `exp`
+(o pasado AUTH_CACHE_TTL si el token no lleva `exp`).
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+import jwt
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from backend.config import AUTH_CACHE_SIZE, AUTH_CACHE_TTL, JWT_ALGORITHM, JWT_SECRET
+
+security = HTTPBearer()
+# Igual pero sin exigir el token: para rutas que también sirven a anónimos
+optional_security = HTTPBearer(auto_error=False)
+
+
+@dataclass(frozen=True)
+class Principal:
+    """
+    Usuario autenticado de la petición.
+    """
+
+    email: str
+    role: str
+    # None si el token no caduca (los tokens antiguos sin `exp` siguen siendo válidos)
+    exp: Optional[float] = None
+
+    @property
+    def is_admin(self) -> bool:
+        return self.role == "admin"
+
+
+def create_jwt_token(data: Dict[str, Any], expires_delta: int = 60 * 24) -> str:
+    to_encode = data.copy()
+    expire = datetime.utcnow() + timedelta(minutes=expires_delta)
+    to_encode.update({"exp": expire})
+    # Si no hay rol, asignar 'user' por defecto
+    if "role" not in to_encode:
+        to_encode["role"] = "user"
+    return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+
+def verify_jwt_token(token: str) -> Dict[str, Any]:
+    try:
+        payload: Dict[str, Any] = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        return payload
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expirado")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Token inválido")
+
+
+class TokenCache:
+    """
+    LRU acotado de tokens verificados.
+
+    Una entrada caducada se descarta al consultarla, así que un token nunca
+    se acepta desde la caché después de su `exp`. Los tokens sin `exp` se
+    guardan como mucho `ttl` segundos y después se vuelven a verificar.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[Principal, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[Principal]:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        principal, expires = entry
+        if expires <= time.time():
+            del self._entries[token]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return principal
+
+    def put(self, token: str, principal: Principal) -> None:
+        expires = principal.exp if principal.exp is not None else time.time() + self.ttl
+        self._entries[token] = (principal, expires)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+token_cache = TokenCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+) -> Principal:
+    """Dependencia: usuario autenticado a partir del bearer token."""
+    token = credentials.credentials
+    principal = token_cache.get(token)
+    if principal is not None:
+        return principal
+    payload = verify_jwt_token(token)
+    email = payload.get("sub")
+    if not email:
+        raise HTTPException(status_code=401, detail="No autenticado")
+    exp = payload.get("exp")
+    principal = Principal(
+        email=email, role=payload.get("role", "user"), exp=float(exp) if exp is not None else None
+    )
+    token_cache.put(token, principal)
+    return principal
+
+
+async def get_optional_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+) -> Optional[Principal]:
+    """Dependencia: usuario autenticado si la petición trae token, None si es anónima."""
+    if credentials is None:
+        return None
+    return await get_current_user(credentials)
+
+
+async def require_admin(principal: Principal = Depends(get_current_user)) -> Principal:
+    """Dependencia: igual que `get_current_user` pero exige rol admin."""
+    if not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Solo administradores")
+    return principal
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la mezcla voz + instrumental sobre una pista estéreo de 4 minutos
+
+Genera un instrumental a 44,1 kHz y una voz a 48 kHz (así la voz pasa por
+el remuestreo) como WAV temporales y mide:
+
+- etapas: tiempo de cada etapa sobre la pista entera, por bloques
+  (remuestreo, medida de sonoridad, limitador) y factor de tiempo real.
+- bloques: `mix_files` completo (leer del mmap, dos pasadas, escribir el
+  WAV) en un proceso nuevo por tamaño de bloque, con su pico de memoria
+  (ru_maxrss) y lo que crece sobre el pico tras importar. El último
+  tamaño es la pista entera en un bloque, como referencia sin acotar.
+- pool: tiempo total de `--jobs` mezclas en un pool de `--workers` procesos.
+
+Uso:
+    python -m backend.benchmarks.audio_mixing --seconds 240 \\
+        --blocks 16384 65536 262144 --jobs 4 --workers 2
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+from backend.audio import LoudnessMeter, encode_wav, render_song
+from backend.mixing import ArraySource, Limiter, MixSettings, ResampledSource, mix_files
+
+
+def _timed(run: Callable[[], Any]) -> float:
+    started = time.perf_counter()
+    run()
+    return time.perf_counter() - started
+
+
+def _stages(vocal: np.ndarray, instrumental: np.ndarray, block: int) -> List[Tuple[str, float]]:
+    frames = len(instrumental)
+    resampled = ResampledSource(ArraySource(vocal, 48000), 44100)
+
+    def resample() -> None:
+        for start in range(0, frames, block):
+            resampled.read(start, min(block, frames - start))
+
+    def loudness() -> None:
+        meter = LoudnessMeter(44100, 2)
+        for start in range(0, frames, block):
+            meter.process(instrumental[start : start + block])
+        meter.integrated()
+
+    def limit() -> None:
+        limiter = Limiter(44100, 2)
+        for start in range(0, frames, block):
+            limiter.process(instrumental[start : start + block] * 4)
+        limiter.flush()
+
+    return [
+        ("remuestreo 48k->44,1k", _timed(resample)),
+        ("sonoridad", _timed(loudness)),
+        ("limitador", _timed(limit)),
+    ]
+
+
+def _mix_in_child(vocal: str, instrumental: str, out: str, block: int) -> Dict[str, Any]:
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report = mix_files(vocal, instrumental, out, MixSettings(block_size=block))
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report["peak_mb"], report["growth_mb"] = peak / 1024, (peak - baseline) / 1024
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--seconds", type=float, default=240.0)
+    parser.add_argument("--blocks", type=int, nargs="+", default=[16384, 65536, 262144])
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    instrumental = render_song("Benchmark", "rock", args.seconds, 44100)
+    vocal = render_song("Voz", "pop", args.seconds, 48000) * 0.5
+    spawn = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        vocal_path, instrumental_path = os.path.join(tmp, "voz.wav"), os.path.join(tmp, "inst.wav")
+        with open(vocal_path, "wb") as f:
+            f.write(encode_wav(vocal, 48000))
+        with open(instrumental_path, "wb") as f:
+            f.write(encode_wav(instrumental, 44100))
+
+        print(f"Pista de {args.seconds:.0f} s estéreo; bloques de {args.blocks[0]} frames")
+        for name, elapsed in _stages(vocal, instrumental, args.blocks[0]):
+            print(f"{name:>22} {elapsed:7.2f} s {args.seconds / elapsed:7.1f}x tiempo real")
+
+        print(
+            f"\n{'bloque':>10} {'s':>7} {'x real':>7} {'pico MB':>8} {'+MB':>6}"
+            f" {'LUFS':>7} {'pico dBFS':>9}"
+        )
+        for block in args.blocks + [len(instrumental)]:
+            with ProcessPoolExecutor(1, mp_context=spawn) as pool:
+                out = os.path.join(tmp, f"mix-{block}.wav")
+                job = pool.submit(_mix_in_child, vocal_path, instrumental_path, out, block)
+                report = job.result()
+            print(
+                f"{block:>10} {report['elapsed']:>7.2f} {args.seconds / report['elapsed']:>7.1f}"
+                f" {report['peak_mb']:>8.0f} {report['growth_mb']:>6.0f}"
+                f" {report['output_lufs']:>7.2f} {report['peak_dbfs']:>9.2f}"
+            )
+
+        with ProcessPoolExecutor(args.workers, mp_context=spawn) as pool:
+            # Arranque de los procesos fuera de la medida
+            list(pool.map(abs, range(args.workers)))
+            started = time.perf_counter()
+            futures = [
+                pool.submit(
+                    mix_files, vocal_path, instrumental_path, os.path.join(tmp, f"job-{i}.wav")
+                )
+                for i in range(args.jobs)
+            ]
+            for future in futures:
+                future.result()
+            elapsed = time.perf_counter() - started
+        print(
+            f"\npool: {args.jobs} mezclas con {args.workers} procesos en {elapsed:.2f} s"
+            f" ({args.jobs * args.seconds / elapsed:.1f}x tiempo real; {os.cpu_count()} CPU)"
+        )
+
+
+if __name__ == "__main__":
+    main()
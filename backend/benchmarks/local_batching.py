@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark del micro-batching de letras locales en CPU
+
+Lanza N prompts concurrentes contra el modelo local compartido a través de
+`MicroBatcher` con distintos tamaños máximos de lote y mide el throughput
+(prompts/s y tokens generados/s) y la latencia por petición (p50/p95).
+Con lote 1 equivale a servir cada prompt por separado.
+
+Requiere `transformers` y `torch` (el modelo se descarga la primera vez).
+
+Uso:
+    python -m backend.benchmarks.local_batching --model gpt2 --requests 32 --batch-sizes 1 4 8 16
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Any, Dict, List
+
+from backend.local_ai import LocalTextModel, MicroBatcher
+
+PROMPTS = [
+    "Escribe el estribillo de una canción de amor",
+    "Verso de rap sobre la ciudad de noche",
+    "Balada triste sobre un tren que se va",
+    "Canción alegre para un cumpleaños",
+    "Letra de rock sobre la carretera",
+    "Bolero sobre el mar y la distancia",
+    "Canción infantil sobre los planetas",
+    "Reggaetón sobre el verano",
+]
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def _run(
+    model: LocalTextModel, batch_size: int, requests: int, max_wait_ms: float, new_tokens: int
+) -> Dict[str, Any]:
+    batcher = MicroBatcher(model, max_batch=batch_size, max_wait_ms=max_wait_ms)
+    pipe: Any = model.load()
+    tokenizer = pipe.tokenizer
+    latencies: List[float] = []
+    generated_tokens = 0
+
+    async def one(i: int) -> None:
+        nonlocal generated_tokens
+        started = time.perf_counter()
+        result = await batcher.submit(
+            PROMPTS[i % len(PROMPTS)],
+            max_new_tokens=new_tokens,
+            do_sample=False,
+            return_full_text=False,
+        )
+        latencies.append(time.perf_counter() - started)
+        generated_tokens += len(tokenizer(result[0]["generated_text"])["input_ids"])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    await batcher.stop()
+    return {
+        "batch": batch_size,
+        "seconds": elapsed,
+        "prompts_s": requests / elapsed,
+        "tokens_s": generated_tokens / elapsed,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p95_ms": _percentile(latencies, 0.95) * 1000,
+        "avg_batch": batcher.metrics()["avg_batch"],
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--model", default="gpt2")
+    parser.add_argument("--requests", type=int, default=32, help="prompts concurrentes por ronda")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    parser.add_argument("--new-tokens", type=int, default=32)
+    args = parser.parse_args()
+
+    model = LocalTextModel(args.model)
+    await model.aload()
+    print(f"Modelo {args.model} cargado en {model.load_seconds:.1f}s")
+    # Calentamiento: la primera inferencia paga inicializaciones de torch
+    await model.generate_batch(PROMPTS[:2], max_new_tokens=4, do_sample=False)
+
+    print(
+        f"{'lote':>5} {'seg':>7} {'prompts/s':>10} {'tokens/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'lote medio':>10}"
+    )
+    for batch_size in args.batch_sizes:
+        row = await _run(model, batch_size, args.requests, args.max_wait_ms, args.new_tokens)
+        print(
+            f"{row['batch']:>5} {row['seconds']:>7.2f} {row['prompts_s']:>10.2f} "
+            f"{row['tokens_s']:>9.1f} "
+            f"{row['p50_ms']:>8.0f} {row['p95_ms']:>8.0f} {row['avg_batch']:>10.1f}"
+        )
+    model.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los motores de inferencia local en CPU
+
+Carga el mismo modelo con cada motor de `backend.local_ai.ENGINES` (eager,
+int8, onnx) y genera una serie de prompts uno a uno, como llegarían a un
+nodo sin lotes. Reporta tiempo de carga, tokens generados/s, latencia por
+petición (p50/p95) y memoria residente tras cargar y tras generar.
+
+Cada motor corre en un proceso nuevo para que la RSS de uno no contamine
+la del siguiente. La RSS se separa en anónima (pesos copiados o
+convertidos, propia de cada proceso) y de archivo (safetensors mapeados y
+librerías, compartible entre procesos). Para onnx la exportación se hace
+antes en otro proceso y se mide la carga desde `LOCAL_AI_ONNX_DIR`, como en
+producción.
+
+Requiere `transformers` y `torch`; el motor onnx además `optimum-onnx` y
+`onnxruntime`.
+
+Uso:
+    python -m backend.benchmarks.local_engines --model gpt2 --engines eager int8 onnx --requests 16
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from backend.local_ai import ENGINES, LocalTextModel, rss_bytes
+
+PROMPTS = [
+    "Escribe el estribillo de una canción de amor",
+    "Verso de rap sobre la ciudad de noche",
+    "Balada triste sobre un tren que se va",
+    "Canción alegre para un cumpleaños",
+]
+
+
+def _rss_anon_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def _measure(engine: str, model_name: str, requests: int, new_tokens: int) -> Dict[str, Any]:
+    model = LocalTextModel(model_name, engine=engine)
+    await model.aload()
+    rss_loaded = rss_bytes()
+    pipe: Any = model.load()
+    tokenizer = pipe.tokenizer
+    # Calentamiento: la primera inferencia paga inicializaciones del motor
+    await model.generate(PROMPTS[0], max_new_tokens=4, do_sample=False)
+
+    latencies: List[float] = []
+    generated_tokens = 0
+    started = time.perf_counter()
+    for i in range(requests):
+        call_started = time.perf_counter()
+        result = await model.generate(
+            PROMPTS[i % len(PROMPTS)],
+            max_new_tokens=new_tokens,
+            min_new_tokens=new_tokens,
+            do_sample=False,
+            return_full_text=False,
+        )
+        latencies.append(time.perf_counter() - call_started)
+        generated_tokens += len(tokenizer(result[0]["generated_text"])["input_ids"])
+    elapsed = time.perf_counter() - started
+    model.shutdown()
+    return {
+        "engine": engine,
+        "load_s": model.load_seconds,
+        "tokens_s": generated_tokens / elapsed,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p95_ms": _percentile(latencies, 0.95) * 1000,
+        "rss_loaded_mb": rss_loaded / 2**20,
+        "rss_end_mb": rss_bytes() / 2**20,
+        "anon_end_mb": (_rss_anon_bytes() or 0) / 2**20,
+    }
+
+
+def _export(model_name: str) -> None:
+    LocalTextModel(model_name, engine="onnx").load()
+
+
+def _worker(engine: str, model_name: str, requests: int, new_tokens: int, out: Any) -> None:
+    try:
+        out.put(asyncio.run(_measure(engine, model_name, requests, new_tokens)))
+    except Exception as e:
+        out.put({"engine": engine, "error": f"{type(e).__name__}: {e}"})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--model", default="gpt2")
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument("--requests", type=int, default=16, help="prompts secuenciales por motor")
+    parser.add_argument("--new-tokens", type=int, default=32)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    if "onnx" in args.engines and not os.getenv("LOCAL_AI_ONNX_DIR"):
+        # Los procesos hijos leen la configuración del entorno al importarse
+        os.environ["LOCAL_AI_ONNX_DIR"] = tempfile.mkdtemp(prefix="onnx-")
+    if "onnx" in args.engines:
+        print(f"Exportando a ONNX en {os.environ['LOCAL_AI_ONNX_DIR']}...")
+        exporter = context.Process(target=_export, args=(args.model,))
+        exporter.start()
+        exporter.join()
+
+    print(
+        f"{'motor':>6} {'carga s':>8} {'tokens/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'RSS carga MB':>12} {'RSS fin MB':>10} {'anónima MB':>10}"
+    )
+    for engine in args.engines:
+        out = context.Queue()
+        process = context.Process(
+            target=_worker, args=(engine, args.model, args.requests, args.new_tokens, out)
+        )
+        process.start()
+        row = out.get()
+        process.join()
+        if "error" in row:
+            print(f"{engine:>6} error: {row['error']}")
+            continue
+        print(
+            f"{row['engine']:>6} {row['load_s']:>8.1f} {row['tokens_s']:>9.1f} "
+            f"{row['p50_ms']:>8.0f} "
+            f"{row['p95_ms']:>8.0f} {row['rss_loaded_mb']:>12.0f} {row['rss_end_mb']:>10.0f} "
+            f"{row['anon_end_mb']:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark de memoria por worker: modelo cargado en cada worker vs pre-fork
+
+Arranca N workers de dos formas y, después de que cada uno genere una vez
+(así todas las páginas de los pesos están en uso), mide su memoria:
+
+- independiente: procesos nuevos (spawn) que cargan cada uno el modelo,
+  como `uvicorn --workers N`.
+- prefork: el maestro carga el modelo con `backend.prefork.preload` y hace
+  fork; los workers comparten las páginas copy-on-write.
+
+Reporta por modo la USS media por worker (memoria propia, lo que crece con
+cada worker extra), la suma de PSS (coste real repartido, maestro incluido)
+y la suma de RSS (que cuenta las páginas compartidas varias veces). Solo
+Linux (lee /proc/<pid>/smaps_rollup).
+
+Uso:
+    python -m backend.benchmarks.prefork_memory --model gpt2 --workers 4 --engine eager
+"""
+
+import argparse
+import multiprocessing
+import os
+from typing import Any, Dict, List, Optional
+
+from backend.local_ai import ENGINES, LocalTextModel, process_memory
+from backend.prefork import preload
+
+
+def _worker(
+    model: Optional[LocalTextModel], model_name: str, engine: str, ready: Any, stop: Any
+) -> None:
+    if model is None:
+        model = LocalTextModel(model_name, engine=engine)
+    pipe = model.load()
+    pipe("Escribe el estribillo de una canción", max_new_tokens=8, do_sample=False)
+    ready.put(os.getpid())
+    stop.wait()
+
+
+def _measure(mode: str, model_name: str, engine: str, workers: int) -> Dict[str, Any]:
+    if mode == "prefork":
+        context: Any = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context("spawn")
+    model: Optional[LocalTextModel] = None
+    if mode == "prefork":
+        model = LocalTextModel(model_name, engine=engine)
+        preload(model)
+    ready, stop = context.Queue(), context.Event()
+    processes = [
+        context.Process(target=_worker, args=(model, model_name, engine, ready, stop))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    pids = [ready.get() for _ in processes]
+    usage: List[Dict[str, int]] = [process_memory(pid) for pid in pids]
+    master = process_memory() if mode == "prefork" else {}
+    stop.set()
+    for process in processes:
+        process.join()
+    return {
+        "mode": mode,
+        "uss_mb": sum(u["uss_bytes"] for u in usage) / len(usage) / 2**20,
+        "pss_total_mb": (sum(u["pss_bytes"] for u in usage) + master.get("pss_bytes", 0)) / 2**20,
+        "rss_total_mb": sum(u["rss_bytes"] for u in usage) / 2**20,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--model", default="gpt2")
+    parser.add_argument("--engine", default="eager", choices=list(ENGINES))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--modes", nargs="+", default=["independiente", "prefork"])
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers, motor {args.engine}")
+    print(f"{'modo':>14} {'USS/worker MB':>14} {'PSS total MB':>13} {'RSS total MB':>13}")
+    for mode in args.modes:
+        row = _measure(mode, args.model, args.engine, args.workers)
+        print(
+            f"{row['mode']:>14} {row['uss_mb']:>14.0f} {row['pss_total_mb']:>13.0f} "
+            f"{row['rss_total_mb']:>13.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
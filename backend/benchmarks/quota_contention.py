@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Benchmark de contención del libro de cuotas
+
+Lanza varios procesos (uno por worker de uvicorn simulado) que reservan y
+confirman canciones de un conjunto pequeño de usuarios a la vez. Comprueba
+que nunca se venden más canciones de las asignadas y mide el throughput.
+
+Uso:
+    python -m backend.benchmarks.quota_contention --backend redis --workers 1 2 4 8
+    python -m backend.benchmarks.quota_contention --backend memory # muestra la divergencia
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import random
+import time
+from typing import Any, Dict, List, Tuple
+
+from backend.quota import (
+    InMemoryQuotaLedger,
+    QuotaLedger,
+    RedisQuotaLedger,
+    new_reservation_id,
+)
+
+PLAN = "benchmark"
+
+
+def _users(count: int) -> List[str]:
+    return [f"bench{i}@example.com" for i in range(count)]
+
+
+async def _open(backend: str, redis_url: str) -> QuotaLedger:
+    if backend == "memory":
+        return InMemoryQuotaLedger()
+    return RedisQuotaLedger.from_url(redis_url)
+
+
+async def _assign_all(ledger: QuotaLedger, users: List[str], quota: int) -> None:
+    for email in users:
+        await ledger.assign(email, PLAN, quota)
+
+
+async def _worker_main(args: Dict[str, Any]) -> Tuple[int, int, float]:
+    ledger = await _open(args["backend"], args["redis_url"])
+    users = _users(args["users"])
+    if args["backend"] == "memory":
+        # Cada proceso tiene su propio saldo: así divergen varios workers
+        await _assign_all(ledger, users, args["quota"])
+    rng = random.Random()
+    granted = 0
+    refunded = 0
+    remaining_requests = args["requests"]
+
+    async def client() -> None:
+        nonlocal granted, refunded, remaining_requests
+        while remaining_requests > 0:
+            remaining_requests -= 1
+            email = rng.choice(users)
+            reservation_id = new_reservation_id()
+            if await ledger.reserve(email, reservation_id) is None:
+                continue
+            if rng.random() < args["refund_ratio"]:
+                await ledger.refund(email, reservation_id)
+                refunded += 1
+            else:
+                await ledger.commit(email, reservation_id)
+                granted += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args["concurrency"])))
+    elapsed = time.perf_counter() - start
+    await ledger.close()
+    return granted, refunded, elapsed
+
+
+def _worker_process(args: Dict[str, Any], results: Any) -> None:
+    results.put(asyncio.run(_worker_main(args)))
+
+
+async def _remaining_total(backend: str, redis_url: str, users: List[str]) -> int:
+    ledger = await _open(backend, redis_url)
+    total = 0
+    for email in users:
+        total += int((await ledger.get(email))["canciones_restantes"])
+    await ledger.close()
+    return total
+
+
+def run(args: argparse.Namespace, workers: int) -> Dict[str, Any]:
+    users = _users(args.users)
+    backend = args.backend
+    if backend == "redis":
+
+        async def reset() -> None:
+            ledger = await _open(backend, args.redis_url)
+            await _assign_all(ledger, users, args.quota)
+            await ledger.close()
+
+        asyncio.run(reset())
+
+    worker_args = {
+        "backend": backend,
+        "redis_url": args.redis_url,
+        "users": args.users,
+        "quota": args.quota,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "refund_ratio": args.refund_ratio,
+    }
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=_worker_process, args=(worker_args, results)) for _ in range(workers)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    wall = time.perf_counter() - start
+
+    granted = sum(o[0] for o in outcomes)
+    refunded = sum(o[1] for o in outcomes)
+    budget = args.users * args.quota
+    operations = workers * args.requests
+    report = {
+        "workers": workers,
+        "granted": granted,
+        "refunded": refunded,
+        "budget": budget,
+        "oversold": max(0, granted - budget),
+        "ops_per_second": operations / max(o[2] for o in outcomes),
+        "wall_seconds": wall,
+    }
+    if backend == "redis":
+        remaining = asyncio.run(_remaining_total(backend, args.redis_url, users))
+        report["consistent"] = remaining + granted == budget
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de contención del libro de cuotas")
+    parser.add_argument("--backend", choices=["redis", "memory"], default="redis")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--users", type=int, default=10, help="Usuarios que compiten")
+    parser.add_argument("--quota", type=int, default=500, help="Canciones por usuario")
+    parser.add_argument("--requests", type=int, default=2000, help="Intentos por worker")
+    parser.add_argument(
+        "--concurrency", type=int, default=32, help="Peticiones en vuelo por worker"
+    )
+    parser.add_argument("--refund-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+
+    print(
+        f"{'workers':>8} {'ops/s':>10} {'concedidas':>11} {'presupuesto':>12} {'de más':>7} "
+        f"{'coherente':>10}"
+    )
+    for workers in args.workers:
+        r = run(args, workers)
+        print(
+            f"{r['workers']:>8} {r['ops_per_second']:>10.0f} {r['granted']:>11} "
+            f"{r['budget']:>12} {r['oversold']:>7} {str(r.get('consistent', '-')):>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
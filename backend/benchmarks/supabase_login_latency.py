@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Benchmark de latencia del event loop durante logins concurrentes
+
+Levanta un sustituto local de los endpoints REST/auth de Supabase (con una
+latencia simulada) y lanza N logins a la vez desde un mismo event loop:
+
+- bloqueante: llamada síncrona dentro de la corrutina, como hacía el cliente
+  `supabase` creado al importar main.py
+- async: `SupabaseClient` con pool keep-alive
+
+Mientras tanto un latido mide cuánto se retrasa el event loop.
+
+Uso:
+    python -m backend.benchmarks.supabase_login_latency --logins 50 --latency-ms 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+from typing import Any, Dict, List
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+
+from backend.supabase_client import SupabaseClient
+
+
+def create_stand_in(latency: float) -> FastAPI:
+    """App que imita GoTrue y PostgREST con `latency` segundos por llamada."""
+    stand_in = FastAPI()
+
+    @stand_in.post("/auth/v1/token")
+    async def token(request: Request) -> Dict[str, Any]:
+        body = await request.json()
+        await asyncio.sleep(latency)
+        return {"access_token": "token", "token_type": "bearer", "user": {"email": body["email"]}}
+
+    @stand_in.post("/auth/v1/signup")
+    async def signup(request: Request) -> Dict[str, Any]:
+        body = await request.json()
+        await asyncio.sleep(latency)
+        return {"user": {"email": body["email"]}}
+
+    @stand_in.post("/rest/v1/{table}", status_code=201)
+    async def upsert(table: str, request: Request) -> None:
+        await request.json()
+        await asyncio.sleep(latency)
+
+    return stand_in
+
+
+def start_stand_in(port: int, latency: float) -> uvicorn.Server:
+    config = uvicorn.Config(create_stand_in(latency), port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def _measure(logins: int, login: Any) -> Dict[str, float]:
+    lags: List[float] = []
+    stop = asyncio.Event()
+
+    async def heartbeat() -> None:
+        interval = 0.005
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - start - interval)
+
+    async def timed_login(i: int) -> float:
+        start = time.perf_counter()
+        await login(f"user{i}@example.com")
+        return time.perf_counter() - start
+
+    beat = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0.02)
+    start = time.perf_counter()
+    durations = await asyncio.gather(*(timed_login(i) for i in range(logins)))
+    total = time.perf_counter() - start
+    stop.set()
+    await beat
+    return {
+        "total_s": total,
+        "login_p50_ms": statistics.median(durations) * 1000,
+        "login_p95_ms": _percentile(durations, 0.95) * 1000,
+        "lag_p99_ms": _percentile(lags, 0.99) * 1000,
+        "lag_max_ms": max(lags) * 1000,
+    }
+
+
+async def run_blocking(url: str, logins: int) -> Dict[str, float]:
+    client = httpx.Client(base_url=url)
+
+    async def login(email: str) -> None:
+        # Llamada síncrona dentro de una corrutina: bloquea el event loop
+        client.post(
+            "/auth/v1/token",
+            params={"grant_type": "password"},
+            json={"email": email, "password": "secreto"},
+        ).raise_for_status()
+
+    try:
+        return await _measure(logins, login)
+    finally:
+        client.close()
+
+
+async def run_async(url: str, logins: int) -> Dict[str, float]:
+    client = SupabaseClient(url, "anon-key", max_connections=logins)
+    await client.start()
+
+    async def login(email: str) -> None:
+        await client.sign_in_with_password(email, "secreto")
+
+    try:
+        return await _measure(logins, login)
+    finally:
+        await client.aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Latencia del event loop con logins concurrentes")
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument(
+        "--latency-ms", type=float, default=50.0, help="Latencia simulada de Supabase"
+    )
+    parser.add_argument("--port", type=int, default=54329)
+    args = parser.parse_args()
+
+    server = start_stand_in(args.port, args.latency_ms / 1000)
+    url = f"http://127.0.0.1:{args.port}"
+    print(
+        f"{'modo':<12} {'total s':>8} {'login p50':>10} {'login p95':>10} {'lag p99':>9} "
+        f"{'lag max':>9}"
+    )
+    for name, runner in (("bloqueante", run_blocking), ("async", run_async)):
+        r = asyncio.run(runner(url, args.logins))
+        print(
+            f"{name:<12} {r['total_s']:>8.2f} {r['login_p50_ms']:>8.1f}ms "
+            f"{r['login_p95_ms']:>8.1f}ms "
+            f"{r['lag_p99_ms']:>7.1f}ms {r['lag_max_ms']:>7.1f}ms"
+        )
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
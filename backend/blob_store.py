@@ -0,0 +1,643 @@
+"""
+Almacén de blobs direccionado por contenido (SHA-256) para audio, imágenes y
+muestras de voz.
+
+Un blob se identifica por el hash de sus bytes: guardar dos veces el mismo
+contenido no ocupa más espacio. El almacén local guarda cada blob en
+`<root>/objects/<sha[:2]>/<sha>` con un índice SQLite (WAL) de tamaño,
+tipo, último acceso, caducidad y fijado. Se respeta un presupuesto de disco:
+al pasarlo se borran primero los blobs caducados y después los menos usados,
+nunca los fijados (`pin`). Las lecturas se hacen con mmap o, para servir por
+HTTP, con la ruta del fichero (sendfile).
+
+Cada blob puede llevar anexos pequeños derivados de él (p. ej. los picos de
+la forma de onda de una canción), guardados a su lado como
+`<sha>.<nombre>` y borrados junto con el blob.
+
+Los blobs subidos por un usuario (muestras de voz, recetas de canciones)
+anotan a sus propietarios (`add_owner`); quien sirve los blobs decide con
+`owners` si uno es público o solo para ellos.
+
+`BlobStore` es la interfaz común; `InMemoryBlobStore` sirve de sustituto en
+pruebas y desarrollo y un almacén de objetos (S3, Supabase Storage) puede
+implementarla más adelante.
+"""
+
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+logger = logging.getLogger("backend")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    content_type TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    expires_at REAL,
+    pinned INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_blobs_access ON blobs (pinned, last_access);
+CREATE INDEX IF NOT EXISTS idx_blobs_expires ON blobs (expires_at);
+CREATE TABLE IF NOT EXISTS blob_owners (
+    sha256 TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    PRIMARY KEY (sha256, owner)
+);
+"""
+
+# Los accesos se anotan en el índice como mucho una vez por este intervalo
+_TOUCH_INTERVAL = 60.0
+
+
+@dataclass(frozen=True)
+class BlobMeta:
+    sha256: str
+    size: int
+    content_type: str
+    created_at: float
+    last_access: float
+    expires_at: Optional[float] = None
+    pinned: bool = False
+
+    def expired(self, now: float) -> bool:
+        return self.expires_at is not None and self.expires_at <= now and not self.pinned
+
+
+def sha256_file(path: str, chunk_size: int = 1 << 20) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class BlobStore:
+    """
+    Interfaz común de los almacenes de blobs.
+
+    `put`/`put_file` devuelven `(meta, duplicado)`; volver a guardar un blob
+    existente lo marca como usado, suma el fijado y amplía la caducidad.
+    """
+
+    name = "base"
+    # Carpeta para temporales que luego se mueven con `put_file` (mismo disco)
+    tmp_dir: str = tempfile.gettempdir()
+
+    async def start(self) -> None:
+        """Abre recursos (índice, conexiones)."""
+
+    async def close(self) -> None:
+        """Libera recursos."""
+
+    async def put(
+        self, data: bytes, content_type: str, pin: bool = False, ttl: Optional[float] = None
+    ) -> Tuple[BlobMeta, bool]:
+        raise NotImplementedError
+
+    async def put_file(
+        self,
+        path: str,
+        content_type: str,
+        sha256: Optional[str] = None,
+        pin: bool = False,
+        ttl: Optional[float] = None,
+    ) -> Tuple[BlobMeta, bool]:
+        """Guarda el contenido de `path` y se queda con el fichero (lo mueve o lo borra)."""
+        raise NotImplementedError
+
+    async def get(self, sha256: str) -> Optional[BlobMeta]:
+        """Metadatos del blob (None si no existe o caducó); cuenta como acceso."""
+        raise NotImplementedError
+
+    @contextmanager
+    def open(self, sha256: str) -> Iterator[Any]:
+        """Contenido del blob como buffer de solo lectura (mmap en el almacén local)."""
+        raise NotImplementedError
+        yield
+
+    def path(self, sha256: str) -> Optional[str]:
+        """Ruta local del blob para enviarlo con sendfile; None si el backend no tiene ficheros."""
+        return None
+
+    async def pin(self, sha256: str) -> bool:
+        raise NotImplementedError
+
+    async def unpin(self, sha256: str) -> bool:
+        raise NotImplementedError
+
+    async def put_sidecar(self, sha256: str, name: str, data: bytes) -> bool:
+        """Guarda un anexo del blob; False si el blob no existe."""
+        raise NotImplementedError
+
+    async def get_sidecar(self, sha256: str, name: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def add_owner(self, sha256: str, owner: str) -> bool:
+        """Anota a `owner` como propietario del blob; False si el blob no existe."""
+        raise NotImplementedError
+
+    async def owners(self, sha256: str) -> Set[str]:
+        """Propietarios anotados del blob (vacío si nadie lo subió como suyo)."""
+        raise NotImplementedError
+
+    async def delete(self, sha256: str) -> bool:
+        raise NotImplementedError
+
+    async def evict(self) -> int:
+        """Borra caducados y, si se pasa del presupuesto, los menos usados; devuelve los bytes."""
+        raise NotImplementedError
+
+    def metrics(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class InMemoryBlobStore(BlobStore):
+    """Sustituto en memoria con la misma política de presupuesto, caducidad y fijado."""
+
+    name = "memory"
+
+    def __init__(
+        self, max_bytes: int = 64 * 2**20, ttl: Optional[float] = None, clock: Any = time.time
+    ):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self._blobs: "OrderedDict[str, Tuple[BlobMeta, bytes]]" = OrderedDict()
+        self._sidecars: Dict[str, Dict[str, bytes]] = {}
+        self._owners: Dict[str, Set[str]] = {}
+        self._bytes = 0
+        self.stats = {"puts": 0, "duplicates": 0, "hits": 0, "misses": 0, "evictions": 0}
+
+    def _expiry(self, now: float, ttl: Optional[float]) -> Optional[float]:
+        ttl = self.ttl if ttl is None else ttl
+        return now + ttl if ttl else None
+
+    async def put(
+        self, data: bytes, content_type: str, pin: bool = False, ttl: Optional[float] = None
+    ) -> Tuple[BlobMeta, bool]:
+        sha256 = hashlib.sha256(data).hexdigest()
+        now = self.clock()
+        self.stats["puts"] += 1
+        current = self._blobs.get(sha256)
+        if current is not None:
+            meta, body = current
+            expires = self._expiry(now, ttl)
+            meta = replace(
+                meta,
+                last_access=now,
+                pinned=meta.pinned or pin,
+                expires_at=(
+                    None
+                    if meta.expires_at is None or expires is None
+                    else max(meta.expires_at, expires)
+                ),
+            )
+            self._blobs[sha256] = (meta, body)
+            self._blobs.move_to_end(sha256)
+            self.stats["duplicates"] += 1
+            return meta, True
+        meta = BlobMeta(sha256, len(data), content_type, now, now, self._expiry(now, ttl), pin)
+        self._blobs[sha256] = (meta, bytes(data))
+        self._bytes += len(data)
+        await self.evict()
+        return meta, False
+
+    async def put_file(
+        self,
+        path: str,
+        content_type: str,
+        sha256: Optional[str] = None,
+        pin: bool = False,
+        ttl: Optional[float] = None,
+    ) -> Tuple[BlobMeta, bool]:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.unlink(path)
+        return await self.put(data, content_type, pin, ttl)
+
+    async def get(self, sha256: str) -> Optional[BlobMeta]:
+        current = self._blobs.get(sha256)
+        if current is None or current[0].expired(self.clock()):
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        meta = replace(current[0], last_access=self.clock())
+        self._blobs[sha256] = (meta, current[1])
+        self._blobs.move_to_end(sha256)
+        return meta
+
+    @contextmanager
+    def open(self, sha256: str) -> Iterator[Any]:
+        current = self._blobs.get(sha256)
+        if current is None:
+            raise KeyError(sha256)
+        yield memoryview(current[1])
+
+    async def _set_pin(self, sha256: str, pinned: bool) -> bool:
+        current = self._blobs.get(sha256)
+        if current is None:
+            return False
+        self._blobs[sha256] = (replace(current[0], pinned=pinned), current[1])
+        return True
+
+    async def pin(self, sha256: str) -> bool:
+        return await self._set_pin(sha256, True)
+
+    async def unpin(self, sha256: str) -> bool:
+        return await self._set_pin(sha256, False)
+
+    async def put_sidecar(self, sha256: str, name: str, data: bytes) -> bool:
+        if sha256 not in self._blobs:
+            return False
+        self._sidecars.setdefault(sha256, {})[name] = bytes(data)
+        return True
+
+    async def get_sidecar(self, sha256: str, name: str) -> Optional[bytes]:
+        return self._sidecars.get(sha256, {}).get(name)
+
+    async def add_owner(self, sha256: str, owner: str) -> bool:
+        if sha256 not in self._blobs:
+            return False
+        self._owners.setdefault(sha256, set()).add(owner)
+        return True
+
+    async def owners(self, sha256: str) -> Set[str]:
+        return set(self._owners.get(sha256, ()))
+
+    async def delete(self, sha256: str) -> bool:
+        current = self._blobs.pop(sha256, None)
+        if current is None:
+            return False
+        self._sidecars.pop(sha256, None)
+        self._owners.pop(sha256, None)
+        self._bytes -= current[0].size
+        return True
+
+    async def evict(self) -> int:
+        now = self.clock()
+        freed = 0
+        # OrderedDict en orden de uso: primero caducados, luego los más antiguos
+        victims = [sha for sha, (meta, _) in self._blobs.items() if meta.expired(now)]
+        over = self._bytes - sum(self._blobs[sha][0].size for sha in victims) - self.max_bytes
+        for sha, (meta, _) in self._blobs.items():
+            if over <= 0:
+                break
+            if not meta.pinned and sha not in victims:
+                victims.append(sha)
+                over -= meta.size
+        for sha in victims:
+            freed += self._blobs[sha][0].size
+            await self.delete(sha)
+            self.stats["evictions"] += 1
+        return freed
+
+    def metrics(self) -> Dict[str, Any]:
+        pinned = sum(1 for meta, _ in self._blobs.values() if meta.pinned)
+        return {
+            "backend": self.name,
+            **self.stats,
+            "blobs": len(self._blobs),
+            "bytes": self._bytes,
+            "pinned": pinned,
+        }
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Blobs en el sistema de archivos local con índice SQLite.
+
+    Args:
+        root: Carpeta raíz (`objects/`, `tmp/` e `index.db`)
+        max_bytes: Presupuesto de disco de los blobs
+        ttl: Segundos de vida por defecto (None = sin caducidad)
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        root: str,
+        max_bytes: int = 5 * 2**30,
+        ttl: Optional[float] = None,
+        clock: Any = time.time,
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.tmp_dir = os.path.join(root, "tmp")
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.stats = {"puts": 0, "duplicates": 0, "hits": 0, "misses": 0, "evictions": 0}
+
+    def _open(self) -> None:
+        if self._db is not None:
+            return
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        db = sqlite3.connect(os.path.join(self.root, "index.db"), check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(_SCHEMA)
+        self._bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        self._db = db
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._open()
+        assert self._db is not None
+        return self._db
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self._open)
+
+    async def close(self) -> None:
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
+
+    def _object_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "objects", sha256[:2], sha256)
+
+    def _row(self, sha256: str) -> Optional[BlobMeta]:
+        row = self.db.execute(
+            "SELECT sha256, size, content_type, created_at, last_access, expires_at, pinned"
+            " FROM blobs WHERE sha256 = ?",
+            (sha256,),
+        ).fetchone()
+        if row is None:
+            return None
+        sha256, size, content_type, created_at, last_access, expires_at, pinned = row
+        return BlobMeta(
+            sha256, size, content_type, created_at, last_access, expires_at, bool(pinned)
+        )
+
+    def _expiry(self, now: float, ttl: Optional[float]) -> Optional[float]:
+        ttl = self.ttl if ttl is None else ttl
+        return now + ttl if ttl else None
+
+    def _store(
+        self,
+        source: str,
+        sha256: str,
+        size: int,
+        content_type: str,
+        pin: bool,
+        ttl: Optional[float],
+    ) -> Tuple[BlobMeta, bool]:
+        now = self.clock()
+        expires = self._expiry(now, ttl)
+        target = self._object_path(sha256)
+        with self._lock:
+            self.stats["puts"] += 1
+            current = self._row(sha256)
+            if current is not None and os.path.exists(target):
+                os.unlink(source)
+                self.db.execute(
+                    "UPDATE blobs SET last_access = ?, pinned = MAX(pinned, ?),"
+                    " expires_at = CASE WHEN expires_at IS NULL OR ? IS NULL THEN NULL"
+                    " ELSE MAX(expires_at, ?) END WHERE sha256 = ?",
+                    (now, int(pin), expires, expires, sha256),
+                )
+                self.db.commit()
+                self.stats["duplicates"] += 1
+                meta = self._row(sha256)
+                assert meta is not None
+                return meta, True
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(source, target)
+            self.db.execute(
+                "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (sha256, size, content_type, now, now, expires, int(pin)),
+            )
+            self.db.commit()
+            self._bytes += size - (current.size if current is not None else 0)
+        self._evict()
+        return BlobMeta(sha256, size, content_type, now, now, expires, pin), False
+
+    def _write_temp(self, data: bytes) -> str:
+        self.db  # crea las carpetas si hace falta
+        fd, path = tempfile.mkstemp(dir=self.tmp_dir, prefix=".blob-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return path
+
+    async def put(
+        self, data: bytes, content_type: str, pin: bool = False, ttl: Optional[float] = None
+    ) -> Tuple[BlobMeta, bool]:
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = await asyncio.to_thread(self._write_temp, data)
+        return await asyncio.to_thread(self._store, path, sha256, len(data), content_type, pin, ttl)
+
+    async def put_file(
+        self,
+        path: str,
+        content_type: str,
+        sha256: Optional[str] = None,
+        pin: bool = False,
+        ttl: Optional[float] = None,
+    ) -> Tuple[BlobMeta, bool]:
+        def store() -> Tuple[BlobMeta, bool]:
+            digest = sha256 or sha256_file(path)
+            source = path
+            if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.tmp_dir):
+                # Fuera de tmp_dir puede estar en otro disco: copiar en vez de renombrar
+                source = self._write_temp(b"")
+                shutil.move(path, source)
+            return self._store(source, digest, os.path.getsize(source), content_type, pin, ttl)
+
+        return await asyncio.to_thread(store)
+
+    def _get(self, sha256: str) -> Optional[BlobMeta]:
+        now = self.clock()
+        with self._lock:
+            meta = self._row(sha256)
+            if meta is None or meta.expired(now) or not os.path.exists(self._object_path(sha256)):
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            if now - meta.last_access >= _TOUCH_INTERVAL:
+                self.db.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ?", (now, sha256))
+                self.db.commit()
+                meta = replace(meta, last_access=now)
+            return meta
+
+    async def get(self, sha256: str) -> Optional[BlobMeta]:
+        return await asyncio.to_thread(self._get, sha256)
+
+    @contextmanager
+    def open(self, sha256: str) -> Iterator[Any]:
+        with open(self._object_path(sha256), "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield mapped
+            finally:
+                mapped.close()
+
+    def path(self, sha256: str) -> Optional[str]:
+        path = self._object_path(sha256)
+        return path if os.path.exists(path) else None
+
+    def _set_pin(self, sha256: str, pinned: bool) -> bool:
+        with self._lock:
+            changed = self.db.execute(
+                "UPDATE blobs SET pinned = ? WHERE sha256 = ?", (int(pinned), sha256)
+            ).rowcount
+            self.db.commit()
+        return changed > 0
+
+    async def pin(self, sha256: str) -> bool:
+        return await asyncio.to_thread(self._set_pin, sha256, True)
+
+    async def unpin(self, sha256: str) -> bool:
+        return await asyncio.to_thread(self._set_pin, sha256, False)
+
+    def _sidecar_path(self, sha256: str, name: str) -> str:
+        if not name.isalnum():
+            raise ValueError(f"Nombre de anexo no válido: {name}")
+        return f"{self._object_path(sha256)}.{name}"
+
+    async def put_sidecar(self, sha256: str, name: str, data: bytes) -> bool:
+        def put() -> bool:
+            path = self._sidecar_path(sha256, name)
+            if not os.path.exists(self._object_path(sha256)):
+                return False
+            temp = self._write_temp(data)
+            os.replace(temp, path)
+            return True
+
+        return await asyncio.to_thread(put)
+
+    async def get_sidecar(self, sha256: str, name: str) -> Optional[bytes]:
+        def get() -> Optional[bytes]:
+            try:
+                with open(self._sidecar_path(sha256, name), "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                return None
+
+        return await asyncio.to_thread(get)
+
+    async def add_owner(self, sha256: str, owner: str) -> bool:
+        def add() -> bool:
+            with self._lock:
+                if self._row(sha256) is None:
+                    return False
+                self.db.execute(
+                    "INSERT OR IGNORE INTO blob_owners VALUES (?, ?)", (sha256, owner)
+                )
+                self.db.commit()
+            return True
+
+        return await asyncio.to_thread(add)
+
+    async def owners(self, sha256: str) -> Set[str]:
+        def owners() -> Set[str]:
+            with self._lock:
+                rows = self.db.execute(
+                    "SELECT owner FROM blob_owners WHERE sha256 = ?", (sha256,)
+                ).fetchall()
+            return {owner for (owner,) in rows}
+
+        return await asyncio.to_thread(owners)
+
+    def _delete(self, sha256: str) -> bool:
+        meta = self._row(sha256)
+        if meta is None:
+            return False
+        self.db.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+        self.db.execute("DELETE FROM blob_owners WHERE sha256 = ?", (sha256,))
+        path = self._object_path(sha256)
+        directory, prefix = os.path.split(path)
+        for name in os.listdir(directory) if os.path.isdir(directory) else []:
+            if name == prefix or name.startswith(prefix + "."):
+                try:
+                    os.unlink(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+        self._bytes -= meta.size
+        return True
+
+    async def delete(self, sha256: str) -> bool:
+        def delete() -> bool:
+            with self._lock:
+                deleted = self._delete(sha256)
+                self.db.commit()
+            return deleted
+
+        return await asyncio.to_thread(delete)
+
+    def _evict(self) -> int:
+        now = self.clock()
+        freed = 0
+        with self._lock:
+            expired = self.db.execute(
+                "SELECT sha256, size FROM blobs"
+                " WHERE pinned = 0 AND expires_at IS NOT NULL AND expires_at <= ?",
+                (now,),
+            ).fetchall()
+            victims = list(expired)
+            over = self._bytes - sum(size for _, size in victims) - self.max_bytes
+            if over > 0:
+                chosen = {sha for sha, _ in victims}
+                for sha, size in self.db.execute(
+                    "SELECT sha256, size FROM blobs WHERE pinned = 0 ORDER BY last_access"
+                ):
+                    if over <= 0:
+                        break
+                    if sha not in chosen:
+                        victims.append((sha, size))
+                        over -= size
+            for sha, size in victims:
+                if self._delete(sha):
+                    freed += size
+                    self.stats["evictions"] += 1
+            if victims:
+                self.db.commit()
+        if freed:
+            logger.info(f"Blob store: {len(victims)} blobs expulsados ({freed} bytes)")
+        return freed
+
+    async def evict(self) -> int:
+        return await asyncio.to_thread(self._evict)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            blobs, pinned = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(pinned), 0) FROM blobs"
+            ).fetchone()
+        return {
+            "backend": self.name,
+            **self.stats,
+            "blobs": blobs,
+            "bytes": self._bytes,
+            "pinned": pinned,
+        }
+
+
+def create_blob_store(
+    backend: str, root: str, max_bytes: int, ttl: Optional[float] = None
+) -> BlobStore:
+    """Crea el almacén configurado: `local` (disco + SQLite) o `memory`."""
+    if backend == "memory":
+        return InMemoryBlobStore(max_bytes, ttl)
+    if backend == "local":
+        return LocalBlobStore(root, max_bytes, ttl)
+    raise ValueError(f"Backend de blobs desconocido: {backend}")
@@ -3,7 +3,135 @@ import os
 # Configuración de variables de entorno
 SUPABASE_URL = os.getenv("SUPABASE_URL", "YOUR_SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY", "YOUR_SUPABASE_KEY")
+# Timeout por llamada (segundos) y tamaño del pool HTTP hacia Supabase
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "100"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "20"))
+# Write-behind de /save-song-data: filas por upsert y espera máxima (segundos)
+SONG_UPSERT_BATCH_SIZE = int(os.getenv("SONG_UPSERT_BATCH_SIZE", "100"))
+SONG_UPSERT_MAX_DELAY = float(os.getenv("SONG_UPSERT_MAX_DELAY", "0.2"))
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY")
+# Cliente OpenAI compartido: timeout (segundos), tamaño del pool y llamadas en
+# vuelo por modelo (OPENAI_MODEL_LIMITS="gpt-3.5-turbo=8,dall-e-2=2")
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_IN_FLIGHT = int(os.getenv("OPENAI_MAX_IN_FLIGHT", "8"))
+OPENAI_MODEL_LIMITS = {
+    model.strip(): int(limit)
+    for model, _, limit in (
+        item.partition("=") for item in os.getenv("OPENAI_MODEL_LIMITS", "").split(",")
+    )
+    if model.strip() and limit
+}
+# Cliente Suno: timeout por intento (segundos), pool, reintentos con backoff
+# exponencial y circuit breaker (fallos seguidos para abrir, segundos abierto)
+SUNO_TIMEOUT = float(os.getenv("SUNO_TIMEOUT", "30"))
+SUNO_MAX_CONNECTIONS = int(os.getenv("SUNO_MAX_CONNECTIONS", "20"))
+SUNO_MAX_RETRIES = int(os.getenv("SUNO_MAX_RETRIES", "3"))
+SUNO_BACKOFF_BASE = float(os.getenv("SUNO_BACKOFF_BASE", "0.5"))
+SUNO_BACKOFF_MAX = float(os.getenv("SUNO_BACKOFF_MAX", "8"))
+SUNO_BREAKER_THRESHOLD = int(os.getenv("SUNO_BREAKER_THRESHOLD", "5"))
+SUNO_BREAKER_RESET = float(os.getenv("SUNO_BREAKER_RESET", "30"))
+# Seguimiento de generaciones: sondeo adaptativo por lotes (segundos) y webhook.
+# SUNO_CALLBACK_URL es la URL pública de /ai/suno/callback (vacía = solo sondeo)
+SUNO_POLL_MIN_INTERVAL = float(os.getenv("SUNO_POLL_MIN_INTERVAL", "2"))
+SUNO_POLL_MAX_INTERVAL = float(os.getenv("SUNO_POLL_MAX_INTERVAL", "30"))
+SUNO_POLL_BATCH_SIZE = int(os.getenv("SUNO_POLL_BATCH_SIZE", "50"))
+SUNO_TASK_TIMEOUT = float(os.getenv("SUNO_TASK_TIMEOUT", "900"))
+SUNO_CALLBACK_URL = os.getenv("SUNO_CALLBACK_URL", "")
+SUNO_WEBHOOK_SECRET = os.getenv("SUNO_WEBHOOK_SECRET", "")
+# Modelo local (transformers): nombre, hilos de inferencia y carga al arrancar
+LOCAL_AI_MODEL = os.getenv("LOCAL_AI_MODEL", "gpt2")
+LOCAL_AI_WORKERS = int(os.getenv("LOCAL_AI_WORKERS", "1"))
+LOCAL_AI_PRELOAD = os.getenv("LOCAL_AI_PRELOAD", "0") == "1"
+# Streams locales (SSE): hilos propios, aparte del executor de /generate-text, y
+# segundos que la generación espera a un cliente que no lee antes de cortarse
+LOCAL_AI_STREAM_WORKERS = int(os.getenv("LOCAL_AI_STREAM_WORKERS", "1"))
+LOCAL_AI_STREAM_STALL_TIMEOUT = float(os.getenv("LOCAL_AI_STREAM_STALL_TIMEOUT", "30"))
+# Micro-batching de letras locales: prompts por lote y espera máxima (ms)
+LOCAL_AI_MAX_BATCH = int(os.getenv("LOCAL_AI_MAX_BATCH", "8"))
+LOCAL_AI_MAX_WAIT_MS = float(os.getenv("LOCAL_AI_MAX_WAIT_MS", "10"))
+# Motor de inferencia local: eager (PyTorch), int8 (cuantización dinámica) u onnx (ONNX Runtime).
+# LOCAL_AI_ONNX_DIR guarda la exportación ONNX para no repetirla en cada arranque.
+LOCAL_AI_ENGINE = os.getenv("LOCAL_AI_ENGINE", "eager")
+LOCAL_AI_ONNX_DIR = os.getenv("LOCAL_AI_ONNX_DIR", "")
+LOCAL_AI_THREADS = int(os.getenv("LOCAL_AI_THREADS", "0"))
+# Lanzador pre-fork (python -m backend.prefork): workers que comparten el modelo cargado
+PREFORK_WORKERS = int(os.getenv("PREFORK_WORKERS", "2"))
+# Arte de álbum local: LRU en memoria (entradas y bytes) y procesos de render
+ALBUM_ART_CACHE_ITEMS = int(os.getenv("ALBUM_ART_CACHE_ITEMS", "256"))
+ALBUM_ART_CACHE_MAX_BYTES = int(os.getenv("ALBUM_ART_CACHE_MAX_BYTES", str(64 * 2**20)))
+ALBUM_ART_WORKERS = int(os.getenv("ALBUM_ART_WORKERS", "2"))
+# Anchos de las variantes de portada (miniaturas); además siempre está el tamaño original
+ALBUM_ART_VARIANT_WIDTHS = [
+    int(w) for w in os.getenv("ALBUM_ART_VARIANT_WIDTHS", "128,256,512").split(",") if w.strip()
+]
+# Almacén de blobs por SHA-256 (audio, muestras de voz): "local" (disco + índice SQLite) o "memory".
+# Al pasar BLOB_MAX_BYTES se expulsan los caducados (BLOB_TTL, 0 = sin caducidad)
+# y los menos usados no fijados.
+BLOB_BACKEND = os.getenv("BLOB_BACKEND", "local")
+BLOB_ROOT = os.getenv("BLOB_ROOT", "blobs")
+BLOB_MAX_BYTES = int(os.getenv("BLOB_MAX_BYTES", str(5 * 2**30)))
+BLOB_TTL = float(os.getenv("BLOB_TTL", "0")) or None
+# Decodificación de formatos no WAV (MP3, OGG...) para el pipeline de audio
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+# Picos de la forma de onda: muestras por pico del nivel más fino,
+# niveles (cada uno 4x más grueso) y bits (8 o 16)
+WAVEFORM_SAMPLES_PER_PEAK = int(os.getenv("WAVEFORM_SAMPLES_PER_PEAK", "256"))
+WAVEFORM_LEVELS = int(os.getenv("WAVEFORM_LEVELS", "4"))
+WAVEFORM_BITS = int(os.getenv("WAVEFORM_BITS", "8"))
+# Canciones: duración del audio local de relleno y tamaño máximo del audio descargado de Suno
+LOCAL_SONG_SECONDS = float(os.getenv("LOCAL_SONG_SECONDS", "180"))
+SONG_AUDIO_MAX_BYTES = int(os.getenv("SONG_AUDIO_MAX_BYTES", str(100 * 2**20)))
+# Modo previa primero de /create-song: solo se genera al momento una previa corta normalizada en
+# sonoridad; el máster completo se genera al pedirlo (POST /songs/{id}/master)
+SONG_PREVIEW_FIRST = os.getenv("SONG_PREVIEW_FIRST", "1") == "1"
+SONG_PREVIEW_SECONDS = float(os.getenv("SONG_PREVIEW_SECONDS", "30"))
+SONG_PREVIEW_SAMPLE_RATE = int(os.getenv("SONG_PREVIEW_SAMPLE_RATE", "22050"))
+SONG_PREVIEW_LUFS = float(os.getenv("SONG_PREVIEW_LUFS", "-14"))
+# Mezcla voz + instrumental de las canciones con voz clonada: procesos del pool, frames por bloque,
+# sonoridad objetivo del máster, techo del limitador y nivel de la voz sobre el instrumental (LU)
+MIX_WORKERS = int(os.getenv("MIX_WORKERS", "1"))
+MIX_BLOCK_FRAMES = int(os.getenv("MIX_BLOCK_FRAMES", "65536"))
+MIX_TARGET_LUFS = float(os.getenv("MIX_TARGET_LUFS", "-14"))
+MIX_CEILING_DB = float(os.getenv("MIX_CEILING_DB", "-1"))
+MIX_VOCAL_LEVEL_DB = float(os.getenv("MIX_VOCAL_LEVEL_DB", "1"))
+# Tamaño máximo por archivo de las muestras de voz subidas (se guardan en el almacén de blobs)
+VOICE_UPLOAD_MAX_BYTES = int(os.getenv("VOICE_UPLOAD_MAX_BYTES", str(25 * 2**20)))
+# Audio servido en /audio/{archivo}; con MEDIA_ACCEL_REDIRECT (p. ej. /_media/audio/) lo envía nginx
+MEDIA_AUDIO_DIR = os.getenv("MEDIA_AUDIO_DIR", "media/audio")
+MEDIA_ACCEL_REDIRECT = os.getenv("MEDIA_ACCEL_REDIRECT", "")
+# Caché de prompts: LRU en memoria + SQLite en disco (PROMPT_CACHE_PATH vacío = solo memoria).
+# Las URLs de imagen de OpenAI caducan a la hora, de ahí su TTL más corto.
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "1") == "1"
+PROMPT_CACHE_PATH = os.getenv("PROMPT_CACHE_PATH", "prompt_cache.db")
+PROMPT_CACHE_MEMORY_SIZE = int(os.getenv("PROMPT_CACHE_MEMORY_SIZE", "1024"))
+PROMPT_CACHE_DISK_MAX_BYTES = int(os.getenv("PROMPT_CACHE_DISK_MAX_BYTES", str(64 * 1024 * 1024)))
+PROMPT_CACHE_TTL = float(os.getenv("PROMPT_CACHE_TTL", str(7 * 24 * 3600)))
+PROMPT_CACHE_IMAGE_TTL = float(os.getenv("PROMPT_CACHE_IMAGE_TTL", "3000"))
+
+# Configuración JWT
+JWT_SECRET = os.getenv("JWT_SECRET", "supersecretkey")
+JWT_ALGORITHM = "HS256"
+# Tokens verificados que se mantienen en caché
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+# Segundos que se cachea un token sin `exp` antes de volver a verificarlo
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
 
 # Configuración adicional
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+# Libro de cuotas: "redis", "memory" o "auto" (Redis si está disponible)
+QUOTA_BACKEND = os.getenv("QUOTA_BACKEND", "auto")
+# Reservas de cuota sin confirmar ni devolver (worker caído) que se devuelven pasado este tiempo
+QUOTA_RESERVATION_TTL = float(os.getenv("QUOTA_RESERVATION_TTL", "3600"))
+QUOTA_REAP_INTERVAL = float(os.getenv("QUOTA_REAP_INTERVAL", "60"))
+
+# Cola de generación de canciones
+SONG_JOB_CONCURRENCY = int(os.getenv("SONG_JOB_CONCURRENCY", "4"))
+SONG_JOB_QUEUE_SIZE = int(os.getenv("SONG_JOB_QUEUE_SIZE", "100"))
+SONG_JOB_RESULT_TTL = int(os.getenv("SONG_JOB_RESULT_TTL", "3600"))
+
+# Auditoría de compras y canciones (SQLite en modo WAL)
+AUDIT_DB_PATH = os.getenv("AUDIT_DB_PATH", "audit.db")
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "0.5"))
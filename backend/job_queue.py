@@ -0,0 +1,231 @@
+"""
+Cola de trabajos en proceso para la generación de canciones.
+
+Los endpoints encolan el trabajo y responden de inmediato; un grupo acotado
+de workers asyncio lo procesa en segundo plano y el cliente consulta el
+estado en `/jobs/{id}`.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("backend")
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+DiscardHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class JobStatus:
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """La cola alcanzó su capacidad máxima y no acepta más trabajos."""
+
+
+@dataclass
+class Job:
+    """
+    Trabajo de generación encolado.
+    """
+
+    id: str
+    owner: str
+    payload: Dict[str, Any]
+    status: str = JobStatus.PENDING
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.COMPLETED, JobStatus.FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == JobStatus.COMPLETED:
+            data["result"] = self.result
+        if self.status == JobStatus.FAILED:
+            data["error"] = self.error
+        return data
+
+
+class SongJobQueue:
+    """
+    Cola acotada de trabajos con un pool fijo de workers asyncio.
+
+    Args:
+        handler: Corrutina que recibe el payload y devuelve el resultado
+        concurrency: Número de workers que procesan trabajos en paralelo
+        max_queue_size: Trabajos pendientes admitidos antes de rechazar
+        result_ttl: Segundos que se conservan los trabajos terminados
+        on_discard: Corrutina que recibe el payload de cada trabajo pendiente
+            que se descarta al parar (p. ej. para devolver su cuota)
+    """
+
+    def __init__(
+        self,
+        handler: JobHandler,
+        concurrency: int = 4,
+        max_queue_size: int = 100,
+        result_ttl: float = 3600,
+        on_discard: Optional[DiscardHandler] = None,
+    ):
+        self.handler = handler
+        self.on_discard = on_discard
+        self.concurrency = max(1, concurrency)
+        self.max_queue_size = max(1, max_queue_size)
+        self.result_ttl = result_ttl
+        self._jobs: Dict[str, Job] = {}
+        self._finished: Deque[Tuple[float, str]] = deque()
+        self._queue: Optional["asyncio.Queue[Job]"] = None
+        self._workers: List["asyncio.Task[None]"] = []
+        self._running = 0
+        self._stats: Dict[str, float] = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "wait_seconds": 0.0,
+            "run_seconds": 0.0,
+        }
+
+    @property
+    def started(self) -> bool:
+        return bool(self._workers)
+
+    async def start(self) -> None:
+        """Arranca los workers en el event loop actual."""
+        if self.started:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"song-job-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+        logger.info(f"Cola de trabajos iniciada con {self.concurrency} workers")
+
+    async def stop(self) -> None:
+        """
+        Cancela los workers. Los trabajos pendientes se marcan como fallidos y
+        se entregan a `on_discard`.
+        """
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        queue, self._queue = self._queue, None
+        while queue is not None and not queue.empty():
+            job = queue.get_nowait()
+            job.status = JobStatus.FAILED
+            job.error = "Trabajo cancelado"
+            job.finished_at = time.time()
+            self._stats["failed"] += 1
+            job.done.set()
+            if self.on_discard is not None:
+                try:
+                    await self.on_discard(job.payload)
+                except Exception as e:
+                    logger.error(f"Error al descartar el trabajo {job.id}: {e}", exc_info=True)
+
+    def submit(self, owner: str, payload: Dict[str, Any]) -> Job:
+        """
+        Encola un trabajo sin bloquear.
+
+        Raises:
+            QueueFullError: Si la cola está llena
+            RuntimeError: Si la cola no se ha iniciado
+        """
+        if self._queue is None:
+            raise RuntimeError("La cola de trabajos no está iniciada")
+        self._prune()
+        job = Job(id=uuid.uuid4().hex, owner=owner, payload=payload)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._stats["rejected"] += 1
+            raise QueueFullError("Cola de generación llena, inténtalo más tarde")
+        self._jobs[job.id] = job
+        self._stats["submitted"] += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def wait(self, job: Job, timeout: Optional[float] = None) -> Job:
+        """Espera a que el trabajo termine (con o sin error)."""
+        await asyncio.wait_for(job.done.wait(), timeout)
+        return job
+
+    def metrics(self) -> Dict[str, Any]:
+        """Profundidad de la cola, ocupación de workers y contadores acumulados."""
+        finished = self._stats["completed"] + self._stats["failed"]
+        started = finished + self._running
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_size": self.max_queue_size,
+            "concurrency": self.concurrency,
+            "running": self._running,
+            "submitted": int(self._stats["submitted"]),
+            "completed": int(self._stats["completed"]),
+            "failed": int(self._stats["failed"]),
+            "rejected": int(self._stats["rejected"]),
+            "tracked_jobs": len(self._jobs),
+            "avg_wait_seconds": self._stats["wait_seconds"] / started if started else 0.0,
+            "avg_run_seconds": self._stats["run_seconds"] / finished if finished else 0.0,
+        }
+
+    async def _worker(self) -> None:
+        assert self._queue is not None
+        queue = self._queue
+        while True:
+            job = await queue.get()
+            self._running += 1
+            job.status = JobStatus.RUNNING
+            job.started_at = time.time()
+            self._stats["wait_seconds"] += job.started_at - job.created_at
+            try:
+                job.result = await self.handler(job.payload)
+                job.status = JobStatus.COMPLETED
+                self._stats["completed"] += 1
+            except asyncio.CancelledError:
+                job.status = JobStatus.FAILED
+                job.error = "Trabajo cancelado"
+                self._stats["failed"] += 1
+                raise
+            except Exception as e:
+                logger.error(f"Error en trabajo {job.id}: {e}", exc_info=True)
+                job.status = JobStatus.FAILED
+                job.error = str(e)
+                self._stats["failed"] += 1
+            finally:
+                job.finished_at = time.time()
+                self._stats["run_seconds"] += job.finished_at - job.started_at
+                self._finished.append((job.finished_at, job.id))
+                self._running -= 1
+                job.done.set()
+                queue.task_done()
+
+    def _prune(self) -> None:
+        """Olvida los trabajos terminados cuyo resultado ya caducó."""
+        limit = time.time() - self.result_ttl
+        while self._finished and self._finished[0][0] < limit:
+            _, job_id = self._finished.popleft()
+            self._jobs.pop(job_id, None)
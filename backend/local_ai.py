@@ -1,26 +1,598 @@
-from transformers import pipeline
-from PIL import Image, ImageDraw, ImageFont
+import asyncio
+import concurrent.futures
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from backend.album_art import RenderedImage, album_art_cache
+from backend.config import LOCAL_AI_MODEL, LOCAL_AI_WORKERS
+from backend.config import LOCAL_AI_MAX_BATCH, LOCAL_AI_MAX_WAIT_MS
+from backend.config import LOCAL_AI_STREAM_STALL_TIMEOUT, LOCAL_AI_STREAM_WORKERS
+from backend.config import LOCAL_AI_ENGINE, LOCAL_AI_ONNX_DIR, LOCAL_AI_THREADS
+
+logger = logging.getLogger("backend")
+
+PipelineFactory = Callable[[str, str], Callable[..., Any]]
+
+
+def _fix_padding(pipe: Any) -> Callable[..., Any]:
+    tokenizer = getattr(pipe, "tokenizer", None)
+    if tokenizer is not None and tokenizer.pad_token is None:
+        # gpt2 no trae token de relleno; los modelos decoder rellenan por la izquierda
+        tokenizer.pad_token = tokenizer.eos_token
+        tokenizer.padding_side = "left"
+        pipe.model.generation_config.pad_token_id = tokenizer.eos_token_id
+    padded: Callable[..., Any] = pipe
+    return padded
+
+
+def _set_torch_threads() -> None:
+    if LOCAL_AI_THREADS > 0:
+        import torch
+
+        torch.set_num_threads(LOCAL_AI_THREADS)
+
+
+def _transformers_pipeline(task: str, model: str) -> Callable[..., Any]:
+    # Import diferido: transformers/torch tardan segundos en importarse
+    from transformers import pipeline
+
+    _set_torch_threads()
+    return _fix_padding(pipeline(task, model=model))
+
+
+def _conv1d_to_linear(module: Any) -> int:
+    """
+    Sustituye las capas `Conv1D` de transformers (GPT-2) por `nn.Linear`
+    equivalentes para que la cuantización dinámica las alcance. Devuelve
+    cuántas capas cambió.
+    """
+    import torch
+    from transformers.pytorch_utils import Conv1D
+
+    replaced = 0
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            # Conv1D guarda el peso como (entrada, salida); Linear como (salida, entrada)
+            n_in, n_out = child.weight.shape
+            linear = torch.nn.Linear(n_in, n_out, device="meta")
+            # Vista traspuesta sin copia: la cuantización lee de ella y la descarta
+            linear.weight = torch.nn.Parameter(child.weight.detach().t(), requires_grad=False)
+            linear.bias = torch.nn.Parameter(child.bias.detach(), requires_grad=False)
+            setattr(module, name, linear)
+            replaced += 1
+        else:
+            replaced += _conv1d_to_linear(child)
+    return replaced
+
+
+def _int8_pipeline(task: str, model: str) -> Callable[..., Any]:
+    """Pipeline PyTorch con las capas lineales cuantizadas a int8 (pesos) en carga."""
+    import torch
+    from torch.ao.quantization import quantize_dynamic
+    from transformers import pipeline
+
+    _set_torch_threads()
+    pipe = pipeline(task, model=model)
+    _conv1d_to_linear(pipe.model)
+    # lm_head comparte pesos con los embeddings: se deja en float para no duplicarlos
+    layers = {
+        name
+        for name, child in pipe.model.named_modules()
+        if isinstance(child, torch.nn.Linear) and name != "lm_head"
+    }
+    # inplace: sin copia profunda del modelo en float durante la conversión
+    quantize_dynamic(pipe.model.eval(), layers, dtype=torch.qint8, inplace=True)
+    return _fix_padding(pipe)
+
+
+def _onnx_pipeline(task: str, model: str) -> Callable[..., Any]:
+    """Pipeline sobre una exportación ONNX del mismo modelo, ejecutada con ONNX Runtime."""
+    import onnxruntime
+    from optimum.onnxruntime import ORTModelForCausalLM
+    from transformers import AutoTokenizer, pipeline
+
+    options = onnxruntime.SessionOptions()
+    if LOCAL_AI_THREADS > 0:
+        options.intra_op_num_threads = LOCAL_AI_THREADS
+    exported = bool(LOCAL_AI_ONNX_DIR) and os.path.exists(
+        os.path.join(LOCAL_AI_ONNX_DIR, "config.json")
+    )
+    source = LOCAL_AI_ONNX_DIR if exported else model
+    ort_model = ORTModelForCausalLM.from_pretrained(
+        source, export=not exported, session_options=options
+    )
+    if LOCAL_AI_ONNX_DIR and not exported:
+        ort_model.save_pretrained(LOCAL_AI_ONNX_DIR)
+    tokenizer = AutoTokenizer.from_pretrained(model)
+    return _fix_padding(pipeline(task, model=ort_model, tokenizer=tokenizer))
+
+
+# Motores de inferencia disponibles (LOCAL_AI_ENGINE)
+ENGINES: Dict[str, PipelineFactory] = {
+    "eager": _transformers_pipeline,
+    "int8": _int8_pipeline,
+    "onnx": _onnx_pipeline,
+}
+
+
+def rss_bytes() -> int:
+    """Memoria residente actual del proceso, en bytes."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        # Fuera de Linux solo hay pico de RSS (KB en Linux, bytes en macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def process_memory(pid: Any = "self") -> Dict[str, int]:
+    """
+    RSS, PSS y USS (páginas privadas) de un proceso, en bytes, según
+    /proc/<pid>/smaps_rollup. La USS es lo que liberaría matar el proceso:
+    con workers pre-fork las páginas del modelo compartidas no cuentan.
+    Vacío fuera de Linux.
+    """
+    fields: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as rollup:
+            for line in rollup:
+                name, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    fields[name] = int(value.split()[0]) * 1024
+    except OSError:
+        return {}
+    return {
+        "rss_bytes": fields.get("Rss", 0),
+        "pss_bytes": fields.get("Pss", 0),
+        "uss_bytes": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+class StreamCancelled(Exception):
+    """El consumidor del stream se fue; corta la generación en curso."""
+
+
+class StreamStalled(Exception):
+    """El consumidor dejó de leer más de `stall_timeout` segundos."""
+
+
+class AsyncTextStreamer:
+    """
+    Streamer de transformers (interfaz `put`/`end`) que entrega texto a una corrutina.
+
+    `generate` lo llama desde el hilo de inferencia con cada token nuevo; el
+    texto decodificado se pasa al event loop por una cola acotada, de modo
+    que si el cliente no lee, el hilo espera (backpressure). Al cancelarlo,
+    el siguiente `put` lanza `StreamCancelled` y la generación se detiene.
+    Si la cola sigue llena más de `stall_timeout` segundos se cancela solo y
+    marca `stalled`, para no retener el hilo con un cliente que no lee.
+
+    Args:
+        tokenizer: Tokenizer del modelo
+        loop: Event loop del consumidor
+        max_pending: Fragmentos máximos pendientes de leer
+        stall_timeout: Segundos máximos esperando a que haya hueco en la cola
+    """
+
+    def __init__(
+        self,
+        tokenizer: Any,
+        loop: asyncio.AbstractEventLoop,
+        max_pending: int = 16,
+        stall_timeout: Optional[float] = None,
+    ):
+        self.tokenizer = tokenizer
+        self.loop = loop
+        self.queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue(maxsize=max_pending)
+        self.stall_timeout = stall_timeout
+        self.stalled = False
+        self.cancelled = threading.Event()
+        self._skip_prompt = True
+        self._ids: List[int] = []
+        self._sent = 0
+        self._closed = False
+
+    def put(self, value: Any) -> None:
+        if self.cancelled.is_set():
+            raise StreamCancelled()
+        ids = value.reshape(-1).tolist() if hasattr(value, "reshape") else list(value)
+        if self._skip_prompt:
+            # La primera llamada trae los tokens del prompt
+            self._skip_prompt = False
+            return
+        self._ids.extend(ids)
+        self._flush(final=False)
+
+    def end(self) -> None:
+        self._flush(final=True)
+
+    def _flush(self, final: bool) -> None:
+        text = self.tokenizer.decode(self._ids, skip_special_tokens=True)
+        # Un carácter multibyte a medias se decodifica como U+FFFD: esperar al siguiente token
+        if not final and text.endswith("\ufffd"):
+            return
+        chunk, self._sent = text[self._sent :], len(text)
+        if chunk:
+            self._push(chunk)
+
+    def _push(self, item: Optional[str]) -> None:
+        future = asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop)
+        started = time.monotonic()
+        while True:
+            try:
+                future.result(timeout=0.1)
+                return
+            except concurrent.futures.TimeoutError:
+                waited = time.monotonic() - started
+                if self.stall_timeout is not None and waited > self.stall_timeout:
+                    self.stalled = True
+                    self.cancelled.set()
+                if self.cancelled.is_set():
+                    future.cancel()
+                    raise StreamCancelled()
+
+    def close(self) -> None:
+        """Marca el fin del stream para el consumidor (desde el hilo de inferencia)."""
+        if self._closed or self.cancelled.is_set():
+            return
+        self._closed = True
+        try:
+            self._push(None)
+        except StreamCancelled:
+            pass
+
+
+class LocalTextModel:
+    """
+    Modelo de generación de texto local, cargado una sola vez y compartido.
+
+    La carga es perezosa y protegida con un lock (o anticipada con `aload`
+    desde el lifespan), y la inferencia corre en un executor propio para no
+    bloquear el event loop. Los streams usan otro executor: su ritmo lo marca
+    el cliente, y en el de inferencia retrasarían a los lotes de `generate`.
+
+    Args:
+        model_name: Modelo de Hugging Face
+        task: Tarea del pipeline
+        workers: Hilos del executor de inferencia
+        factory: Construye el pipeline a partir de (task, model)
+        engine: Motor de `ENGINES` si no se pasa `factory` (eager, int8, onnx)
+        stream_workers: Streams que generan a la vez (el resto espera turno)
+        stall_timeout: Segundos que un stream espera a un cliente que no lee
+    """
+
+    def __init__(
+        self,
+        model_name: str = "gpt2",
+        task: str = "text-generation",
+        workers: int = 1,
+        factory: Optional[PipelineFactory] = None,
+        engine: str = "eager",
+        stream_workers: int = 1,
+        stall_timeout: Optional[float] = 30.0,
+    ):
+        if factory is None and engine not in ENGINES:
+            raise ValueError(
+                f"Motor de inferencia desconocido: {engine} (opciones: {', '.join(ENGINES)})"
+            )
+        self.model_name = model_name
+        self.task = task
+        self.workers = max(1, workers)
+        self.stream_workers = max(1, stream_workers)
+        self.stall_timeout = stall_timeout
+        self.engine = engine
+        self._factory = factory or ENGINES[engine]
+        self._pipeline: Optional[Callable[..., Any]] = None
+        self._load_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stream_executor: Optional[ThreadPoolExecutor] = None
+        self._latencies: Deque[float] = deque(maxlen=512)
+        self.load_seconds: Optional[float] = None
+        self.load_rss_delta: Optional[int] = None
+        self.stats = {
+            "calls": 0,
+            "errors": 0,
+            "prompts": 0,
+            "streams_cancelled": 0,
+            "streams_stalled": 0,
+        }
+
+    @property
+    def loaded(self) -> bool:
+        return self._pipeline is not None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="local-ai")
+        return self._executor
+
+    @property
+    def stream_executor(self) -> ThreadPoolExecutor:
+        if self._stream_executor is None:
+            self._stream_executor = ThreadPoolExecutor(
+                self.stream_workers, thread_name_prefix="local-ai-stream"
+            )
+        return self._stream_executor
+
+    def load(self) -> Callable[..., Any]:
+        """Carga el pipeline si aún no lo está (bloqueante, seguro entre hilos)."""
+        if self._pipeline is not None:
+            return self._pipeline
+        with self._load_lock:
+            if self._pipeline is None:
+                rss_before = rss_bytes()
+                started = time.perf_counter()
+                self._pipeline = self._factory(self.task, self.model_name)
+                self.load_seconds = time.perf_counter() - started
+                self.load_rss_delta = rss_bytes() - rss_before
+                logger.info(
+                    f"Modelo local {self.model_name} ({self.engine}) "
+                    f"cargado en {self.load_seconds:.2f}s "
+                    f"(+{self.load_rss_delta / 2**20:.0f} MB)"
+                )
+        return self._pipeline
+
+    async def aload(self) -> None:
+        """Carga el modelo en el executor (p. ej. al arrancar la app)."""
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.load)
+
+    def _run(self, prompt: Any, kwargs: Dict[str, Any]) -> Any:
+        pipe = self.load()
+        started = time.perf_counter()
+        try:
+            return pipe(prompt, **kwargs)
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self.stats["calls"] += 1
+            self.stats["prompts"] += len(prompt) if isinstance(prompt, list) else 1
+            self._latencies.append(time.perf_counter() - started)
+
+    async def generate(self, prompt: str, **kwargs: Any) -> Any:
+        """Ejecuta el pipeline en el executor de inferencia."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self._run, prompt, kwargs
+        )
+
+    async def generate_batch(self, prompts: List[str], **kwargs: Any) -> List[Any]:
+        """Genera para varios prompts en una sola llamada (rellenados al mismo largo)."""
+        kwargs.setdefault("batch_size", len(prompts))
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self._run, list(prompts), kwargs
+        )
+
+    def _run_streaming(
+        self, pipe: Any, prompt: str, streamer: AsyncTextStreamer, kwargs: Dict[str, Any]
+    ) -> None:
+        started = time.perf_counter()
+        try:
+            inputs = pipe.tokenizer(prompt, return_tensors="pt")
+            pipe.model.generate(**inputs, streamer=streamer, **kwargs)
+        except StreamCancelled:
+            self.stats["streams_stalled" if streamer.stalled else "streams_cancelled"] += 1
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            streamer.close()
+            self.stats["calls"] += 1
+            self.stats["prompts"] += 1
+            self._latencies.append(time.perf_counter() - started)
+
+    async def stream(self, prompt: str, **kwargs: Any) -> AsyncGenerator[str, None]:
+        """
+        Genera en el executor de streams y entrega el texto a medida que sale.
+        Cerrar el generador (p. ej. si el cliente se desconecta) corta la generación.
+
+        Raises:
+            StreamStalled: Si el consumidor dejó de leer y la generación se cortó
+        """
+        loop = asyncio.get_running_loop()
+        # El pipeline de transformers lleva su tokenizer; el tipo Callable no lo refleja
+        pipe: Any = self._pipeline or await loop.run_in_executor(self.executor, self.load)
+        streamer = AsyncTextStreamer(pipe.tokenizer, loop, stall_timeout=self.stall_timeout)
+        generation = loop.run_in_executor(
+            self.stream_executor, self._run_streaming, pipe, prompt, streamer, kwargs
+        )
+        get: Optional["asyncio.Future[Optional[str]]"] = None
+        try:
+            while True:
+                if not streamer.queue.empty():
+                    chunk = streamer.queue.get_nowait()
+                elif generation.done():
+                    # Terminó sin cerrar el stream: propaga su error, si lo hubo
+                    await generation
+                    if streamer.stalled:
+                        raise StreamStalled("Generación cortada: el cliente dejó de leer el stream")
+                    return
+                else:
+                    get = asyncio.ensure_future(streamer.queue.get())
+                    waiting: Set["asyncio.Future[Any]"] = {get, generation}
+                    await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                    if not get.done():
+                        get.cancel()
+                        continue
+                    chunk = get.result()
+                if chunk is None:
+                    break
+                yield chunk
+            await generation
+        finally:
+            streamer.cancelled.set()
+            if get is not None:
+                get.cancel()
+
+    def metrics(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            "model": self.model_name,
+            "engine": self.engine,
+            "pid": os.getpid(),
+            "loaded": self.loaded,
+            "load_seconds": self.load_seconds,
+            "load_rss_delta_bytes": self.load_rss_delta,
+            "rss_bytes": rss_bytes(),
+            **process_memory(),
+            **self.stats,
+            "latency_p50": percentile(0.50),
+            "latency_p95": percentile(0.95),
+            "latency_avg": sum(latencies) / len(latencies) if latencies else None,
+        }
+
+    def shutdown(self) -> None:
+        for executor in (self._executor, self._stream_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._stream_executor = None
+
+
+class MicroBatcher:
+    """
+    Agrupa prompts concurrentes en llamadas por lotes al modelo local.
+
+    Un único colector toma el primer prompt en cola y espera hasta
+    `max_wait_ms` (o hasta juntar `max_batch`) a que lleguen más con los
+    mismos parámetros de generación; lanza un solo `generate_batch` y reparte
+    cada resultado a la corrutina que lo pidió. Mientras un lote se ejecuta,
+    el siguiente se va llenando.
+
+    Args:
+        model: Modelo local compartido
+        max_batch: Prompts máximos por lote
+        max_wait_ms: Espera máxima para completar un lote, en milisegundos
+    """
+
+    def __init__(self, model: LocalTextModel, max_batch: int = 8, max_wait_ms: float = 10.0):
+        self.model = model
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+        self._pending: Dict[Tuple[Any, ...], List[Tuple[str, "asyncio.Future[Any]"]]] = {}
+        self._arrived: Optional[asyncio.Event] = None
+        self._collector: Optional["asyncio.Task[None]"] = None
+        self.stats = {"batches": 0, "prompts": 0, "max_batch_seen": 0}
+
+    async def stop(self) -> None:
+        if self._collector is not None:
+            self._collector.cancel()
+            await asyncio.gather(self._collector, return_exceptions=True)
+            self._collector = None
+        for items in self._pending.values():
+            for _, future in items:
+                if not future.done():
+                    future.cancel()
+        self._pending.clear()
+
+    async def submit(self, prompt: str, **kwargs: Any) -> Any:
+        """Encola un prompt y espera su resultado (el mismo que `generate`)."""
+        if self._collector is None or self._collector.done():
+            self._arrived = asyncio.Event()
+            self._collector = asyncio.create_task(self._collect(), name="local-ai-batcher")
+        assert self._arrived is not None
+        future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+        key = tuple(sorted(kwargs.items()))
+        self._pending.setdefault(key, []).append((prompt, future))
+        self._arrived.set()
+        return await future
+
+    def _take(self) -> Tuple[Tuple[Any, ...], List[Tuple[str, "asyncio.Future[Any]"]]]:
+        # El grupo más antiguo primero; los prompts cancelados no se generan
+        key = next(iter(self._pending))
+        items = [item for item in self._pending[key] if not item[1].done()]
+        batch, rest = items[: self.max_batch], items[self.max_batch :]
+        if rest:
+            self._pending[key] = rest
+        else:
+            del self._pending[key]
+        return key, batch
+
+    def _full(self) -> bool:
+        return any(len(items) >= self.max_batch for items in self._pending.values())
+
+    async def _collect(self) -> None:
+        assert self._arrived is not None
+        while True:
+            if not self._pending:
+                self._arrived.clear()
+                await self._arrived.wait()
+            deadline = time.monotonic() + self.max_wait
+            while not self._full():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            key, batch = self._take()
+            if not batch:
+                continue
+            self.stats["batches"] += 1
+            self.stats["prompts"] += len(batch)
+            self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(batch))
+            try:
+                results = await self.model.generate_batch([p for p, _ in batch], **dict(key))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def metrics(self) -> Dict[str, Any]:
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "avg_batch": self.stats["prompts"] / batches if batches else 0.0,
+            "queued": sum(len(items) for items in self._pending.values()),
+        }
+
+
+# Modelo compartido por todo el proceso
+text_model = LocalTextModel(
+    LOCAL_AI_MODEL,
+    workers=LOCAL_AI_WORKERS,
+    engine=LOCAL_AI_ENGINE,
+    stream_workers=LOCAL_AI_STREAM_WORKERS,
+    stall_timeout=LOCAL_AI_STREAM_STALL_TIMEOUT,
+)
+lyrics_batcher = MicroBatcher(text_model, LOCAL_AI_MAX_BATCH, LOCAL_AI_MAX_WAIT_MS)
 
 
 # Generación de texto con Hugging Face
 async def generate_song_lyrics_local(prompt: str):
     try:
-        generator = pipeline("text-generation", model="gpt2")
-        result = generator(prompt, max_length=200, num_return_sequences=1)
+        result = await lyrics_batcher.submit(prompt, max_length=200, num_return_sequences=1)
         return result[0]["generated_text"]
     except Exception as e:
         raise Exception(f"Error al generar letras: {str(e)}")
 
 
 # Generación de arte de álbum con PIL
-async def generate_album_art_local(description: str):
+async def generate_album_art_local(
+    description: str, style: str = "", size: int = 600
+) -> RenderedImage:
+    """Portada PNG en memoria, cacheada por hash de (descripción, estilo, tamaño)."""
     try:
-        # Crear una imagen básica con texto
-        img = Image.new("RGB", (600, 600), color=(73, 109, 137))
-        draw = ImageDraw.Draw(img)
-        font = ImageFont.load_default()
-        draw.text((10, 10), description, fill=(255, 255, 0), font=font)
-        img.save("album_art.png")
-        return "album_art.png"
+        return await album_art_cache.get_or_render(description, style, size)
     except Exception as e:
         raise Exception(f"Error al generar arte de álbum: {str(e)}")
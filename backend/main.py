@@ -1,59 +1,152 @@
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-import jwt
-from datetime import datetime, timedelta, timezone
-# Configuración JWT
-JWT_SECRET = os.getenv("JWT_SECRET", "supersecretkey")
-JWT_ALGORITHM = "HS256"
-security = HTTPBearer()
-
-def create_jwt_token(data: dict, expires_delta: int = 60*24):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=expires_delta)
-    to_encode.update({"exp": expire})
-    # Si no hay rol, asignar 'user' por defecto
-    if "role" not in to_encode:
-        to_encode["role"] = "user"
-    return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
-
-def verify_jwt_token(token: str):
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expirado")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Token inválido")
-from fastapi import FastAPI, HTTPException, UploadFile, Request
+from fastapi import FastAPI, HTTPException, Request, Depends, Query
 from pydantic import Field
-from typing import Callable, Awaitable, Any
-from fastapi.responses import JSONResponse
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
 import logging
 from pydantic import BaseModel, ValidationError
-from supabase import create_client
 import asyncio
-from backend.ai_integration import AIIntegration
-from backend.routes.ai_routes import router as ai_router
+from backend.ai_integration import AIIntegration, close_async_clients, get_prompt_cache
+from backend.routes.ai_routes import router as ai_router, suno_tasks
+from backend.local_ai import generate_album_art_local, lyrics_batcher, text_model
+from backend.album_art import RenderedImage, album_art_cache
+from backend.media import MediaFileResponse, etag_matches, resolve_media_path
+from backend.single_flight import SingleFlight
+from backend.uploads import StoredUpload, UploadError, UploadStore
+from backend.blob_store import BlobStore, create_blob_store
+from backend.mixing import MixSettings, Mixer
+from backend.song_audio import SongAudio, SongRecipe
+from backend.streaming import sse_response, sse_tokens, stream_stats
+from backend.job_queue import Job, JobStatus, QueueFullError, SongJobQueue
+from backend.aggregates import InMemorySalesAggregates, SalesAggregates, create_sales_aggregates
+from backend.audit_store import AuditStore, utc_iso
+from backend.supabase_client import SupabaseClient, SupabaseError
+from backend.write_behind import UpsertBuffer
+from backend.quota import (
+    InMemoryQuotaLedger, QuotaLedger, ReservationReaper, create_quota_ledger, new_reservation_id
+)
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from urllib.parse import quote
 
+from backend.auth import (
+    Principal, create_jwt_token, get_current_user, get_optional_user, require_admin
+)
+from datetime import datetime
 
-# Configuración centralizada de Supabase y otras credenciales
-from backend.config import SUPABASE_URL, SUPABASE_KEY
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Configuración centralizada de Supabase y otras credenciales
+from backend.config import SUPABASE_URL, SUPABASE_KEY, OPENAI_API_KEY
+from backend.config import SONG_JOB_CONCURRENCY, SONG_JOB_QUEUE_SIZE, SONG_JOB_RESULT_TTL
+from backend.config import QUOTA_BACKEND, REDIS_URL, QUOTA_RESERVATION_TTL, QUOTA_REAP_INTERVAL
+from backend.config import LOCAL_AI_PRELOAD
+from backend.config import AUDIT_DB_PATH, AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL
+
+from backend.config import SUPABASE_TIMEOUT, SUPABASE_MAX_CONNECTIONS, SUPABASE_MAX_KEEPALIVE
+from backend.config import SONG_UPSERT_BATCH_SIZE, SONG_UPSERT_MAX_DELAY
+from backend.config import VOICE_UPLOAD_MAX_BYTES
+from backend.config import BLOB_BACKEND, BLOB_ROOT, BLOB_MAX_BYTES, BLOB_TTL
+from backend.config import LOCAL_SONG_SECONDS, SONG_AUDIO_MAX_BYTES
+from backend.config import (
+    SONG_PREVIEW_FIRST, SONG_PREVIEW_SECONDS, SONG_PREVIEW_SAMPLE_RATE, SONG_PREVIEW_LUFS
+)
+from backend.config import WAVEFORM_SAMPLES_PER_PEAK, WAVEFORM_LEVELS, WAVEFORM_BITS
+from backend.config import (
+    MIX_WORKERS, MIX_BLOCK_FRAMES, MIX_TARGET_LUFS, MIX_CEILING_DB, MIX_VOCAL_LEVEL_DB
+)
+from backend.config import MEDIA_ACCEL_REDIRECT, MEDIA_AUDIO_DIR
+
+# Cliente asíncrono con pool keep-alive; se conecta en el lifespan
+supabase = SupabaseClient(
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    timeout=SUPABASE_TIMEOUT,
+    max_connections=SUPABASE_MAX_CONNECTIONS,
+    max_keepalive=SUPABASE_MAX_KEEPALIVE,
+)
+# Upserts de canciones agrupados y fusionados por id
+song_upserts = UpsertBuffer(
+    supabase, "songs", key="id", max_batch=SONG_UPSERT_BATCH_SIZE, max_delay=SONG_UPSERT_MAX_DELAY
+)
+# Blobs por SHA-256 (audio, muestras de voz, portadas) con presupuesto de disco
+blob_store: BlobStore = create_blob_store(BLOB_BACKEND, BLOB_ROOT, BLOB_MAX_BYTES, BLOB_TTL)
+# Las portadas se guardan en el mismo almacén para servirlas desde cualquier worker
+album_art_cache.blobs = blob_store
+# Muestras de voz por hash de contenido; los resultados se reutilizan entre subidas idénticas
+voice_uploads = UploadStore(blob_store, VOICE_UPLOAD_MAX_BYTES)
+# Audio de las canciones y etapa posterior a la generación (picos de la forma de onda);
+# las canciones con voz clonada se mezclan en un pool de procesos
+song_audio = SongAudio(
+    blob_store,
+    SONG_AUDIO_MAX_BYTES,
+    WAVEFORM_SAMPLES_PER_PEAK,
+    WAVEFORM_LEVELS,
+    WAVEFORM_BITS,
+    preview_seconds=SONG_PREVIEW_SECONDS,
+    preview_sample_rate=SONG_PREVIEW_SAMPLE_RATE,
+    preview_lufs=SONG_PREVIEW_LUFS,
+    mixer=Mixer(MIX_WORKERS),
+    mix=MixSettings(
+        vocal_level_db=MIX_VOCAL_LEVEL_DB,
+        target_lufs=MIX_TARGET_LUFS,
+        ceiling_db=MIX_CEILING_DB,
+        block_size=MIX_BLOCK_FRAMES,
+    ),
+)
+suno_tasks.on_complete = song_audio.on_suno_complete
+_voice_results: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_voice_flights = SingleFlight()
 
 # (Preparado para integración Suno)
 SUNO_API_KEY = os.getenv("SUNO_API_KEY", "YOUR_SUNO_API_KEY")
 
 
-
 # Configuración de CORS para permitir solo el frontend Next.js
 origins = [
     "http://localhost:3000",  # Next.js local
     "https://tu-dominio-vercel.app"  # Producción, reemplaza por tu dominio real
 ]
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Conecta Supabase, cuotas y auditoría y arranca los workers de generación."""
+    global quota_ledger, sales_stats
+    await supabase.start()
+    await song_upserts.start()
+    quota_ledger = await create_quota_ledger(QUOTA_BACKEND, REDIS_URL)
+    await quota_reaper.start(quota_ledger)
+    await audit_store.start()
+    await blob_store.start()
+    sales_stats = create_sales_aggregates(quota_ledger)
+    await sales_stats.load(audit_store, PLANES)
+    await song_jobs.start()
+    await suno_tasks.start()
+    if LOCAL_AI_PRELOAD:
+        await text_model.aload()
+    try:
+        yield
+    finally:
+        await suno_tasks.stop()
+        await lyrics_batcher.stop()
+        await song_jobs.stop()
+        await audit_store.stop()
+        await song_audio.close()
+        await blob_store.close()
+        await quota_reaper.stop()
+        await quota_ledger.close()
+        await song_upserts.stop()
+        await supabase.aclose()
+        await close_async_clients()
+        text_model.shutdown()
+        album_art_cache.shutdown()
+        prompt_cache = get_prompt_cache()
+        if prompt_cache is not None:
+            prompt_cache.close()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -70,20 +163,16 @@ logging.basicConfig(
         logging.StreamHandler()
     ]
 )
-logger = logging.getLogger("backend")
-    ]
-)
 logger = logging.getLogger("backend")
 
 # Incluir rutas
 app.include_router(ai_router, prefix="/ai")
 
 # Inicializar cliente de AI Integration
-ai_client = AIIntegration(api_key="YOUR_API_KEY")
+ai_client = AIIntegration(api_key=OPENAI_API_KEY)
 
 
 # --- Monetización y control de canciones ---
-from typing import Optional
 
 # Simulación de planes y precios
 PLANES = {
@@ -92,35 +181,30 @@ PLANES = {
 }
 
 
-from typing import Dict, List, Any, Optional, Callable, Awaitable, TypeVar, cast
-USERS_DB: Dict[str, Dict[str, Any]] = {}
-# Auditoría en memoria
-PURCHASE_HISTORY: List[Dict[str, Any]] = []  # [{'email': ..., 'plan': ..., 'timestamp': ...}]
-SONG_HISTORY: List[Dict[str, Any]] = []      # [{'email': ..., 'title': ..., 'timestamp': ...}]
+# Saldo de canciones por usuario; en el arranque se sustituye por el libro configurado
+quota_ledger: QuotaLedger = InMemoryQuotaLedger()
+# Devuelve las reservas que ningún worker cerró (caídas a mitad de una generación)
+quota_reaper = ReservationReaper(QUOTA_RESERVATION_TTL, QUOTA_REAP_INTERVAL)
+# Auditoría persistente de compras y canciones
+audit_store = AuditStore(
+    AUDIT_DB_PATH, batch_size=AUDIT_BATCH_SIZE, flush_interval=AUDIT_FLUSH_INTERVAL
+)
+# Totales para los endpoints de administración, actualizados con cada evento;
+# en el arranque se comparten en Redis si el libro de cuotas está allí
+sales_stats: SalesAggregates = InMemorySalesAggregates()
 
-def get_user(email: str) -> Dict[str, Any]:
-    if email not in USERS_DB:
-        USERS_DB[email] = {"plan": None, "canciones_restantes": 0}
-    return USERS_DB[email]
 
-def can_create_song(email: str) -> bool:
-    user: Dict[str, Any] = get_user(email)
-    return int(user.get("canciones_restantes", 0)) > 0
+async def get_user(email: str) -> Dict[str, Any]:
+    return await quota_ledger.get(email)
 
-def decrement_song(email: str) -> None:
-    user: Dict[str, Any] = get_user(email)
-    if int(user.get("canciones_restantes", 0)) > 0:
-        user["canciones_restantes"] -= 1
 
-def assign_plan(email: str, plan: str) -> bool:
+async def assign_plan(email: str, plan: str) -> bool:
     if plan in PLANES:
-        USERS_DB[email] = {"plan": plan, "canciones_restantes": PLANES[plan]["canciones"]}
-        # Registrar compra en historial
-        PURCHASE_HISTORY.append({
-            "email": email,
-            "plan": plan,
-            "timestamp": datetime.now(timezone.utc).isoformat()
-        })
+        await quota_ledger.assign(email, plan, PLANES[plan]["canciones"])
+        # Registrar compra en historial con el precio cobrado
+        price = PLANES[plan]["precio"]
+        audit_store.record_purchase(email, plan, price)
+        await sales_stats.record_purchase(email, plan, price)
         return True
     return False
 
@@ -132,6 +216,9 @@ class SongCreationFormValues(BaseModel):
     title: str = Field(..., description="Título de la canción")
     description: str = Field(..., description="Descripción o tema de la canción")
     genre: str = Field(..., description="Género musical")
+    voice_sample_id: Optional[str] = Field(
+        None, description="sampleId devuelto por /generate-cloned-voice para cantar con esa voz"
+    )
 
     @classmethod
     def validate_data(cls, data: dict[str, Any]) -> "SongCreationFormValues":
@@ -174,6 +261,8 @@ async def add_error_handling(request: Request, call_next: Callable[[Request], Aw
         return JSONResponse(
             status_code=500, content={"detail": "Internal Server Error"}
         )
+
+
 # Endpoint de health check
 @app.get("/health", tags=["infra"])
 async def health_check():
@@ -184,64 +273,280 @@ async def health_check():
 # Endpoints
 
 
-@app.post("/create-song", response_model=dict)
-async def create_song(form_data: SongCreationFormValues) -> Dict[str, Any]:
+async def _generate_song(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Genera la canción de un trabajo encolado (simulado).
+    Confirma la reserva de cuota al terminar o la devuelve si falla.
+    En modo previa solo se genera la previa; el máster espera a que se pida.
+    """
+    try:
+        # Simulación de generación de canción con IA: audio de relleno determinista
+        song_id = await song_audio.register(
+            SongRecipe(
+                payload["title"],
+                payload.get("genre", ""),
+                LOCAL_SONG_SECONDS,
+                vocal=payload.get("voice_sample_id"),
+                owner=payload["email"],
+            )
+        )
+        if payload.get("preview", SONG_PREVIEW_FIRST):
+            audio = await song_audio.preview(song_id)
+        else:
+            audio = await song_audio.master(song_id)
+        assert audio is not None
+    except BaseException:
+        await quota_ledger.refund(payload["email"], payload["reservation_id"])
+        raise
+    await quota_ledger.commit(payload["email"], payload["reservation_id"])
+    # Registrar generación de canción en historial solo si terminó bien
+    audit_store.record_song(payload["email"], payload["title"])
+    await sales_stats.record_song(payload["email"])
+    return {
+        "success": True,
+        "lyrics": "Esta es una letra generada por IA para tu canción.",
+        **audio,
+        "canciones_restantes": payload["canciones_restantes"],
+    }
+
+
+# Cola de generación: create-song encola y /jobs/{id} expone el estado
+async def _discard_song(payload: Dict[str, Any]) -> None:
+    """Devuelve la cuota de un trabajo que no llegó a ejecutarse (la cola se paró)."""
+    await quota_ledger.refund(payload["email"], payload["reservation_id"])
+
+
+song_jobs = SongJobQueue(
+    _generate_song,
+    concurrency=SONG_JOB_CONCURRENCY,
+    max_queue_size=SONG_JOB_QUEUE_SIZE,
+    result_ttl=SONG_JOB_RESULT_TTL,
+    on_discard=_discard_song,
+)
+
+
+@app.post("/create-song", response_model=dict, status_code=202)
+async def create_song(
+    form_data: SongCreationFormValues,
+    wait: bool = False,
+    preview: Optional[bool] = None,
+    principal: Principal = Depends(get_current_user),
+) -> Any:
     """
     Crea una canción usando IA a partir de los datos del formulario.
     - Valida y sanitiza los datos recibidos.
-    - Devuelve letra y audio generado (simulado).
+    - Encola la generación y responde 202 con el id del trabajo.
+    - Con `wait=true` espera al resultado y devuelve letra y audio (simulado).
+    - Con `preview=true` (por defecto si SONG_PREVIEW_FIRST) solo genera una
+      previa de SONG_PREVIEW_SECONDS; el máster se pide en `master_url`.
+    - Con `voice_sample_id` mezcla la voz clonada sobre el instrumental.
     """
     validated = SongCreationFormValues.validate_data(form_data.model_dump())
-    # Obtener usuario autenticado por JWT
-    from fastapi import Depends
-    from fastapi.security import HTTPAuthorizationCredentials
-    request: Optional[Any] = None
-    import inspect
-    for frame in inspect.stack():
-        if "request" in frame.frame.f_locals:
-            request = frame.frame.f_locals["request"]
-            break
-    token: Optional[str] = None
-    if request and hasattr(request, "headers") and "authorization" in request.headers:
-        token = request.headers["authorization"].split()[1]
-    email: Optional[str] = None
-    if token:
-        payload = verify_jwt_token(token)
-        email = payload.get("sub") if payload else None
-    if not email:
-        raise HTTPException(status_code=401, detail="No autenticado")
-    if not can_create_song(email):
+    email = principal.email
+    # Solo las muestras de voz que subió el propio usuario
+    if validated.voice_sample_id is not None and not await song_audio.is_voice_sample(
+        validated.voice_sample_id, email
+    ):
+        raise HTTPException(status_code=404, detail="Muestra de voz no encontrada")
+    reservation_id = new_reservation_id()
+    restantes = await quota_ledger.reserve(email, reservation_id)
+    if restantes is None:
         raise HTTPException(status_code=402, detail="No tienes canciones disponibles. Compra un paquete.")
-    decrement_song(email)
-    # Registrar generación de canción en historial
-    SONG_HISTORY.append({
-        "email": email,
-        "title": validated.title,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    })
-    # Simulación de generación de canción con IA
-    await asyncio.sleep(3)
+    try:
+        job = song_jobs.submit(email, {
+            **validated.model_dump(),
+            "email": email,
+            "reservation_id": reservation_id,
+            "canciones_restantes": restantes,
+            "preview": SONG_PREVIEW_FIRST if preview is None else preview,
+        })
+    except QueueFullError as e:
+        await quota_ledger.refund(email, reservation_id)
+        raise HTTPException(status_code=503, detail=str(e))
+    if wait:
+        await song_jobs.wait(job)
+        if job.status == JobStatus.FAILED:
+            raise HTTPException(status_code=500, detail=job.error)
+        return JSONResponse(status_code=200, content=job.result)
     return {
         "success": True,
-        "lyrics": "Esta es una letra generada por IA para tu canción.",
-        "audio": "/audio/placeholder.mp3",
-        "canciones_restantes": get_user(email)["canciones_restantes"]
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+    }
+
+
+def _text_stream(prompt: str, max_tokens: int, engine: str, use_cache: bool = True) -> Any:
+    """Generador de fragmentos de texto del motor elegido (OpenAI o modelo local)."""
+    if engine == "local":
+        return text_model.stream(prompt, max_new_tokens=max_tokens, do_sample=True)
+    return ai_client.astream_text(prompt, max_tokens=max_tokens, use_cache=use_cache)
+
+
+def _lyrics_prompt(song: SongCreationFormValues) -> str:
+    return (
+        f"Escribe la letra de una canción de {song.genre} titulada "
+        f"\"{song.title}\" sobre: {song.description}"
+    )
+
+
+@app.post("/create-song/stream")
+async def create_song_stream(
+    form_data: SongCreationFormValues,
+    engine: str = Query("openai", pattern="^(openai|local)$"),
+    principal: Principal = Depends(get_current_user),
+) -> Any:
+    """
+    Variante de /create-song que envía la letra token a token por SSE.
+    - La cuota se reserva al empezar y se confirma al terminar el stream.
+    - Si la generación falla o el cliente se desconecta, se devuelve.
+    """
+    validated = SongCreationFormValues.validate_data(form_data.model_dump())
+    email = principal.email
+    reservation_id = new_reservation_id()
+    restantes = await quota_ledger.reserve(email, reservation_id)
+    if restantes is None:
+        raise HTTPException(
+            status_code=402, detail="No tienes canciones disponibles. Compra un paquete."
+        )
+
+    async def complete(lyrics: str) -> Dict[str, Any]:
+        await quota_ledger.commit(email, reservation_id)
+        audit_store.record_song(email, validated.title)
+        await sales_stats.record_song(email)
+        return {
+            "success": True,
+            "lyrics": lyrics,
+            "audio": "/audio/placeholder.mp3",
+            "canciones_restantes": restantes,
+        }
+
+    async def abort() -> None:
+        await quota_ledger.refund(email, reservation_id)
+
+    tokens = _text_stream(_lyrics_prompt(validated), 300, engine)
+    return sse_response(sse_tokens(tokens, on_complete=complete, on_abort=abort))
+
+
+# --- Seguimiento de trabajos de generación ---
+
+@app.get("/jobs/metrics", tags=["infra"])
+async def jobs_metrics() -> Dict[str, Any]:
+    """Profundidad de la cola y contadores de los workers de generación."""
+    return song_jobs.metrics()
+
+
+@app.get("/songs/metrics", tags=["infra"])
+async def songs_metrics() -> Dict[str, Any]:
+    """Audios guardados, descargas de Suno y picos calculados."""
+    return song_audio.metrics()
+
+
+@app.post("/songs/{song_id}/master")
+async def get_song_master(
+    song_id: str, principal: Principal = Depends(get_current_user)
+) -> Dict[str, Any]:
+    """
+    Máster completo de una canción creada en modo previa. Se genera la
+    primera vez que se pide; las siguientes devuelven el mismo blob.
+    Solo para el usuario que creó la canción (o un admin): a los demás se
+    responde 404, igual que si no existiera.
+    """
+    recipe = await song_audio.recipe(song_id) if len(song_id) == 64 else None
+    if recipe is None or (recipe.owner != principal.email and not principal.is_admin):
+        raise HTTPException(status_code=404, detail="Canción no encontrada")
+    master = await song_audio.master(song_id)
+    if master is None:
+        raise HTTPException(status_code=404, detail="Canción no encontrada")
+    return master
+
+
+@app.get("/songs/{sha256}/waveform")
+async def get_song_waveform(
+    sha256: str,
+    request: Request,
+    width: Optional[int] = Query(None, ge=1, le=100_000),
+    fmt: str = Query("json", alias="format", pattern="^(json|dat)$"),
+) -> Response:
+    """
+    Picos (mínimo, máximo) de la forma de onda, en formato de audiowaveform.
+    - `width`: ancho en píxeles; se elige el nivel más grueso con al menos
+      ese número de picos.
+    - `format=dat` devuelve el binario compacto en lugar de JSON.
+    """
+    waveform = await song_audio.waveform(sha256) if len(sha256) == 64 else None
+    if waveform is None:
+        raise HTTPException(status_code=404, detail="Forma de onda no disponible")
+    level = waveform.level_for(width)
+    headers = {
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{sha256}-{level}-{fmt}"',
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    if fmt == "dat":
+        return Response(
+            waveform.to_dat(level), media_type="application/octet-stream", headers=headers
+        )
+    return JSONResponse(waveform.to_json(level), headers=headers)
+
+
+@app.get("/local-ai/metrics", tags=["infra"])
+async def local_ai_metrics() -> Dict[str, Any]:
+    """Tiempo de carga, memoria residente, latencia y lotes del modelo local."""
+    return {
+        **text_model.metrics(),
+        "batching": lyrics_batcher.metrics(),
+        "album_art": album_art_cache.metrics(),
     }
+
+
+def _get_owned_job(job_id: str, principal: Principal) -> Job:
+    job = song_jobs.get(job_id)
+    if job is None or job.owner != principal.email:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+
+@app.get("/jobs/{job_id}", tags=["Jobs"])
+async def get_job(job_id: str, principal: Principal = Depends(get_current_user)) -> Dict[str, Any]:
+    """Devuelve el estado del trabajo y, si terminó, su resultado."""
+    return _get_owned_job(job_id, principal).to_dict()
+
+
+@app.get("/jobs/{job_id}/result", tags=["Jobs"])
+async def get_job_result(job_id: str, principal: Principal = Depends(get_current_user)) -> Any:
+    """Devuelve el resultado del trabajo; 202 mientras siga en curso."""
+    job = _get_owned_job(job_id, principal)
+    if not job.finished:
+        return JSONResponse(status_code=202, content=job.to_dict())
+    if job.status == JobStatus.FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
+    return job.result
+
+
 # Endpoint para comprar paquete
 @app.post("/comprar-paquete", tags=["Pagos"])
-from fastapi import Depends
-@app.post("/comprar-paquete", tags=["Pagos"])
-def comprar_paquete(plan: str, credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
-    payload = verify_jwt_token(credentials.credentials)
-    email = payload.get("sub")
-    if not email:
-        raise HTTPException(status_code=401, detail="No autenticado")
-    if assign_plan(email, plan):
-        return {"success": True, "plan": plan, "canciones_restantes": get_user(email)["canciones_restantes"]}
+async def comprar_paquete(
+    plan: str, principal: Principal = Depends(get_current_user)
+) -> Dict[str, Any]:
+    email = principal.email
+    if await assign_plan(email, plan):
+        user = await get_user(email)
+        return {"success": True, "plan": plan, "canciones_restantes": user["canciones_restantes"]}
     else:
         raise HTTPException(status_code=400, detail="Plan inválido")
 
 
+def _supabase_http_error(e: SupabaseError) -> HTTPException:
+    """Traduce un error de Supabase a la respuesta HTTP del backend."""
+    if e.status_code == 504:
+        return HTTPException(status_code=504, detail=e.message)
+    if 400 <= e.status_code < 500:
+        return HTTPException(status_code=400, detail=e.message)
+    return HTTPException(status_code=502, detail=e.message)
+
+
 @app.post("/register-user", response_model=dict)
 async def register_user(credentials: UserCredentials) -> Dict[str, Any]:
     """
@@ -251,17 +556,14 @@ async def register_user(credentials: UserCredentials) -> Dict[str, Any]:
     """
     try:
         validated = UserCredentials.validate_data(credentials.model_dump())
-        response = supabase.auth.sign_up(
-            {"email": validated.email, "password": validated.password}
-        )
-        error: Optional[Any] = response.__dict__.get("error")
-        user: Optional[Any] = response.__dict__.get("user")
-        if error:
-            detail: str = error["message"] if isinstance(error, dict) and "message" in error else str(error)
-            raise HTTPException(status_code=400, detail=detail)
+        user = await supabase.sign_up(validated.email, validated.password)
         return {"success": True, "user": user}
+    except SupabaseError as e:
+        raise _supabase_http_error(e)
     except ValidationError as ve:
         raise HTTPException(status_code=422, detail=ve.errors())
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -275,115 +577,103 @@ async def login_user(credentials: UserCredentials) -> Dict[str, Any]:
     """
     try:
         validated = UserCredentials.validate_data(credentials.model_dump())
-        response = supabase.auth.sign_in_with_password(
-            {"email": validated.email, "password": validated.password}
-        )
-        error: Optional[Any] = response.__dict__.get("error")
-        user: Optional[Any] = response.__dict__.get("user")
-        if error:
-            detail: str = error["message"] if isinstance(error, dict) and "message" in error else str(error)
-            raise HTTPException(status_code=400, detail=detail)
+        session = await supabase.sign_in_with_password(validated.email, validated.password)
+        user: Optional[Dict[str, Any]] = session.get("user") if session else None
         # Generar token JWT al hacer login
-        user_email: Optional[str] = None
-        if user:
-            if isinstance(user, dict):
-                user_email = user.get("email")
-            else:
-                user_email = getattr(user, "email", None)
+        user_email: Optional[str] = user.get("email") if user else None
         if not user_email:
             raise HTTPException(status_code=400, detail="Usuario inválido")
         # Ejemplo: si el email es admin@, asignar rol admin
         role: str = "admin" if user_email.startswith("admin@") else "user"
         token: str = create_jwt_token({"sub": user_email, "role": role})
         return {"success": True, "user": user, "token": token, "role": role}
-# Endpoint protegido de ejemplo
-from fastapi import Depends
-
-@app.get("/protected", tags=["Seguridad"])
-def protected_route(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
-    try:
-        payload = verify_jwt_token(credentials.credentials)
-        return {"message": f"Acceso permitido para {payload['sub']}", "role": payload.get("role", "user")}
+    except SupabaseError as e:
+        raise _supabase_http_error(e)
     except ValidationError as ve:
         raise HTTPException(status_code=422, detail=ve.errors())
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Endpoint solo para admin
-# Endpoint solo para admin
 
-# Decorador para endpoints admin
-from functools import wraps
-from fastapi import Request
-F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
-def admin_required(func: F) -> F:
-    @wraps(func)
-    async def wrapper(*args: Any, **kwargs: Any) -> Any:
-        request: Optional[Request] = kwargs.get('request')
-        credentials: Optional[HTTPAuthorizationCredentials] = kwargs.get('credentials')
-        if not credentials:
-            # Buscar en args
-            for arg in args:
-                if isinstance(arg, HTTPAuthorizationCredentials):
-                    credentials = arg
-        if not credentials:
-            raise HTTPException(status_code=401, detail="No autenticado")
-        payload: Dict[str, Any] = verify_jwt_token(credentials.credentials)
-        if payload.get("role") != "admin":
-            raise HTTPException(status_code=403, detail="Solo administradores")
-        return await func(*args, **kwargs)
-    return cast(F, wrapper)
+# Endpoint protegido de ejemplo
+@app.get("/protected", tags=["Seguridad"])
+async def protected_route(principal: Principal = Depends(get_current_user)) -> Dict[str, Any]:
+    return {"message": f"Acceso permitido para {principal.email}", "role": principal.role}
+
 
+# Endpoint solo para admin
 @app.get("/admin-only", tags=["Seguridad"])
-@admin_required
-async def admin_only(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
-    payload = verify_jwt_token(credentials.credentials)
-    return {"message": f"Acceso admin permitido para {payload['sub']}"}
+async def admin_only(principal: Principal = Depends(require_admin)) -> Dict[str, Any]:
+    return {"message": f"Acceso admin permitido para {principal.email}"}
 
 # --- Endpoints de administración y auditoría ---
 
+
 @app.get("/admin/ventas", tags=["Admin"])
-@admin_required
-async def admin_ventas(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
-    """Devuelve el total de ventas y detalle de compras."""
-    total_ventas = sum(PLANES[compra['plan']]['precio'] for compra in PURCHASE_HISTORY)
+async def admin_ventas(principal: Principal = Depends(require_admin)) -> Dict[str, Any]:
+    """Devuelve el total de ventas, el desglose por plan y las compras más recientes."""
     return {
-        "total_ventas": total_ventas,
-        "compras": PURCHASE_HISTORY
+        **await sales_stats.sales(),
+        "compras": await audit_store.latest("purchases")
     }
 
+
 @app.get("/admin/canciones", tags=["Admin"])
-@admin_required
-async def admin_canciones(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
-    """Devuelve el total de canciones generadas y detalle."""
+async def admin_canciones(principal: Principal = Depends(require_admin)) -> Dict[str, Any]:
+    """Devuelve el total de canciones generadas y las más recientes."""
     return {
-        "total_canciones": len(SONG_HISTORY),
-        "canciones": SONG_HISTORY
+        "total_canciones": await sales_stats.total_songs(),
+        "canciones": await audit_store.latest("songs")
     }
 
+
 @app.get("/admin/usuarios", tags=["Admin"])
-@admin_required
-async def admin_usuarios(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
+async def admin_usuarios(principal: Principal = Depends(require_admin)) -> Dict[str, Any]:
     """Devuelve la lista de usuarios activos (que han comprado o generado canciones)."""
-    usuarios_compras = {c['email'] for c in PURCHASE_HISTORY}
-    usuarios_canciones = {c['email'] for c in SONG_HISTORY}
-    usuarios = list(usuarios_compras.union(usuarios_canciones))
-    return {"usuarios_activos": usuarios, "total": len(usuarios)}
+    usuarios = await sales_stats.active_users()
+    return {"usuarios_activos": list(usuarios), "total": len(usuarios)}
 
-@app.get("/admin/historial-compras", tags=["Admin"])
-@admin_required
-async def admin_historial_compras(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
-    """Devuelve el historial completo de compras."""
-    return {"historial_compras": PURCHASE_HISTORY}
 
-@app.get("/admin/historial-canciones", tags=["Admin"])
-@admin_required
-async def admin_historial_canciones(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
-    """Devuelve el historial completo de canciones generadas."""
-    return {"historial_canciones": SONG_HISTORY}
+def _history_filters(
+    desde: Optional[datetime], hasta: Optional[datetime]
+) -> Dict[str, Optional[str]]:
+    if desde and hasta and desde >= hasta:
+        raise HTTPException(status_code=400, detail="'desde' debe ser anterior a 'hasta'")
+    return {"since": utc_iso(desde) if desde else None, "until": utc_iso(hasta) if hasta else None}
 
 
-from pydantic import Field
+@app.get("/admin/historial-compras", tags=["Admin"])
+async def admin_historial_compras(
+    cursor: Optional[int] = Query(None, ge=0, description="Id de la última compra recibida"),
+    limit: int = Query(100, ge=1, le=1000),
+    desde: Optional[datetime] = Query(None, description="Desde (inclusivo)"),
+    hasta: Optional[datetime] = Query(None, description="Hasta (exclusivo)"),
+    email: Optional[str] = None,
+    principal: Principal = Depends(require_admin),
+) -> Dict[str, Any]:
+    """Devuelve el historial de compras paginado por cursor."""
+    page = await audit_store.page(
+        "purchases", cursor=cursor, limit=limit, email=email, **_history_filters(desde, hasta)
+    )
+    return {"historial_compras": page["items"], "next_cursor": page["next_cursor"]}
+
+
+@app.get("/admin/historial-canciones", tags=["Admin"])
+async def admin_historial_canciones(
+    cursor: Optional[int] = Query(None, ge=0, description="Id de la última canción recibida"),
+    limit: int = Query(100, ge=1, le=1000),
+    desde: Optional[datetime] = Query(None, description="Desde (inclusivo)"),
+    hasta: Optional[datetime] = Query(None, description="Hasta (exclusivo)"),
+    email: Optional[str] = None,
+    principal: Principal = Depends(require_admin),
+) -> Dict[str, Any]:
+    """Devuelve el historial de canciones generadas paginado por cursor."""
+    page = await audit_store.page(
+        "songs", cursor=cursor, limit=limit, email=email, **_history_filters(desde, hasta)
+    )
+    return {"historial_canciones": page["items"], "next_cursor": page["next_cursor"]}
 
 
 class SongData(BaseModel):
@@ -399,20 +689,21 @@ class SongData(BaseModel):
 
 
 @app.post("/save-song-data", response_model=dict)
-async def save_song_data(song: SongData):
+async def save_song_data(song: SongData, wait: bool = False) -> Dict[str, Any]:
     """
     Guarda los datos de una canción en Supabase.
     - Valida y sanitiza los datos recibidos.
-    - Maneja errores y devuelve confirmación.
+    - Encola el upsert; varias revisiones del mismo id se fusionan en una.
+    - Con `wait=true` responde cuando la fila está escrita en Supabase.
     """
     try:
         validated = song.model_dump()
-        response = supabase.table("songs").upsert(validated).execute()
-        error = response.__dict__.get("error")
-        if error:
-            detail = error.get("message") if isinstance(error, dict) else str(error)
-            raise HTTPException(status_code=400, detail=detail)
-        return {"success": True}
+        ack = song_upserts.submit(validated, wait=wait)
+        if ack is not None:
+            await ack
+        return {"success": True, "durable": ack is not None}
+    except SupabaseError as e:
+        raise _supabase_http_error(e)
     except ValidationError as ve:
         raise HTTPException(status_code=422, detail=ve.errors())
     except Exception as e:
@@ -420,33 +711,187 @@ async def save_song_data(song: SongData):
 
 
 @app.post("/generate-album-art")
-async def generate_album_art(description: str, style: str):
+async def generate_album_art(
+    description: str, style: str, size: int = Query(600, ge=64, le=2048)
+) -> Dict[str, Any]:
+    """
+    Genera la portada con PIL y devuelve su URL direccionada por contenido.
+    - La misma (descripción, estilo, tamaño) devuelve siempre la misma URL.
+    - El render corre en un pool de procesos, se cachea en memoria y se guarda
+      en el almacén de blobs.
+    """
     try:
-        # Simulación de generación de arte de álbum
+        image = await generate_album_art_local(description, style, size)
         return {
             "success": True,
-            "imageUrl": "https://placehold.co/600x600/333/FFF?text=Album+Art",
+            "imageUrl": f"/album-art/{image.key}.{image.extension}",
+            "etag": image.etag,
+            "variants": album_art_cache.variant_urls(image.key, size),
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/generate-cloned-voice")
-async def generate_cloned_voice(audioFile: UploadFile):
-    try:
-        # Simulación de generación de voz clonada
-        return {
-            "success": True,
-            "audioUrl": "https://placehold.co/audio/placeholder.mp3",
+def _image_response(image: Optional[RenderedImage], request: Request) -> Response:
+    if image is None:
+        raise HTTPException(status_code=404, detail="Portada no encontrada")
+    # La URL incluye el hash del contenido: se puede cachear para siempre
+    headers = {"ETag": image.etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag_matches(request.headers.get("if-none-match"), image.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(image.data, media_type=image.content_type, headers=headers)
+
+
+@app.get("/album-art/{key}.png")
+async def get_album_art(key: str, request: Request) -> Response:
+    """Sirve una portada (memoria o almacén de blobs) con ETag; su contenido no cambia nunca."""
+    return _image_response(await album_art_cache.get_by_key(key), request)
+
+
+@app.get("/album-art/{key}/{width:int}.{fmt}")
+async def get_album_art_variant(key: str, width: int, fmt: str, request: Request) -> Response:
+    """Miniatura o tamaño intermedio (png, webp o avif), generado al pedirlo por primera vez."""
+    return _image_response(await album_art_cache.get_variant(key, width, fmt), request)
+
+
+@app.api_route("/audio/{filename}", methods=["GET", "HEAD"])
+async def get_audio(filename: str) -> Response:
+    """
+    Sirve un audio desde disco sin cargarlo en memoria.
+    - Range/206 para que el reproductor pueda saltar a cualquier punto.
+    - ETag e If-None-Match (304); envío zero-copy si el servidor lo soporta.
+    """
+    path = await asyncio.to_thread(resolve_media_path, MEDIA_AUDIO_DIR, filename)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Audio no encontrado")
+    headers = {"Cache-Control": "public, max-age=86400"}
+    if MEDIA_ACCEL_REDIRECT:
+        # nginx (location internal) hace el sendfile y resuelve Range y condicionales
+        headers["X-Accel-Redirect"] = MEDIA_ACCEL_REDIRECT.rstrip("/") + "/" + quote(filename)
+        return Response(headers=headers)
+    stat_result = await asyncio.to_thread(os.stat, path)
+    return MediaFileResponse(path, headers=headers, stat_result=stat_result)
+
+
+@app.get("/blobs/metrics", tags=["infra"])
+async def blobs_metrics() -> Dict[str, Any]:
+    """Blobs y bytes en el almacén, aciertos, duplicados y expulsiones."""
+    return blob_store.metrics()
+
+
+# Tipos de blob que se sirven a cualquiera (audio renderizado y portadas)
+_PUBLIC_BLOB_TYPES = ("audio/", "image/")
+
+
+@app.api_route("/blobs/{sha256}", methods=["GET", "HEAD"])
+async def get_blob(
+    sha256: str,
+    request: Request,
+    principal: Optional[Principal] = Depends(get_optional_user),
+) -> Response:
+    """
+    Sirve un blob por su SHA-256: el contenido nunca cambia, así que la
+    respuesta es inmutable y el ETag es el propio hash.
+
+    El audio y las imágenes generados son públicos. Lo que sube o crea un
+    usuario (muestras de voz, recetas de canciones) y cualquier otro tipo
+    solo se sirve a sus propietarios (o a un admin); para los demás no existe.
+    """
+    meta = await blob_store.get(sha256) if len(sha256) == 64 else None
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Blob no encontrado")
+    owners = await blob_store.owners(sha256)
+    public = not owners and meta.content_type.startswith(_PUBLIC_BLOB_TYPES)
+    if not public and not (
+        principal is not None and (principal.is_admin or principal.email in owners)
+    ):
+        raise HTTPException(status_code=404, detail="Blob no encontrado")
+    cache = "public" if public else "private"
+    headers = {"Cache-Control": f"{cache}, max-age=31536000, immutable", "ETag": f'"{sha256}"'}
+    path = blob_store.path(sha256)
+    if path is not None:
+        return MediaFileResponse(path, media_type=meta.content_type, headers=headers)
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    with blob_store.open(sha256) as data:
+        return Response(bytes(data), media_type=meta.content_type, headers=headers)
+
+
+# Firmas de los formatos de audio aceptados como muestra de voz
+_AUDIO_SIGNATURES = (
+    (b"RIFF", "wav"), (b"ID3", "mp3"), (b"\xff\xfb", "mp3"), (b"OggS", "ogg"), (b"fLaC", "flac")
+)
+
+
+def _sniff_audio(header: bytes) -> str:
+    for signature, fmt in _AUDIO_SIGNATURES:
+        if header.startswith(signature):
+            return fmt
+    if header[4:8] == b"ftyp":
+        return "m4a"
+    return "desconocido"
+
+
+async def _clone_voice(sample: StoredUpload) -> Dict[str, Any]:
+    """Procesa una muestra de voz (simulado); se ejecuta una vez por contenido."""
+    with sample.mmap() as data:
+        fmt = _sniff_audio(bytes(data[:12]))
+    return {
+        "audioUrl": "https://placehold.co/audio/placeholder.mp3",
+        "sampleId": sample.sha256,
+        "format": fmt,
+        "size": sample.size,
+    }
+
+
+@app.post(
+    "/generate-cloned-voice",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {"audioFile": {"type": "string", "format": "binary"}},
+                        "required": ["audioFile"],
+                    }
+                }
+            },
         }
+    },
+)
+async def generate_cloned_voice(
+    request: Request, principal: Principal = Depends(get_current_user)
+) -> Dict[str, Any]:
+    """
+    Recibe la muestra de voz (`audioFile`) por streaming.
+    - Rechaza con 413 en cuanto el tamaño supera VOICE_UPLOAD_MAX_BYTES.
+    - Una muestra idéntica a otra ya procesada reutiliza su resultado.
+    - La muestra queda a nombre del usuario: solo él puede usarla en /create-song.
+    """
+    try:
+        sample = await voice_uploads.ingest_request(request, field="audioFile")
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    await sample.store.add_owner(sample.sha256, principal.email)
+    try:
+        result = _voice_results.get(sample.sha256)
+        deduplicated = result is not None
+        if result is None:
+            result = await _voice_flights.do(sample.sha256, lambda: _clone_voice(sample))
+            _voice_results[sample.sha256] = result
+            while len(_voice_results) > 1024:
+                _voice_results.popitem(last=False)
+        return {"success": True, **result, "deduplicated": deduplicated}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/generate-text")
-async def generate_text(prompt: str):
+async def generate_text(prompt: str, use_cache: bool = True) -> Dict[str, Any]:
     try:
-        result = ai_client.generate_text(prompt)
+        result = await ai_client.agenerate_text(prompt, use_cache=use_cache)
         if not result["success"]:
             raise HTTPException(status_code=500, detail=result["error"])
         return result
@@ -454,10 +899,27 @@ async def generate_text(prompt: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/generate-text/stream")
+async def generate_text_stream(
+    prompt: str,
+    max_tokens: int = 100,
+    engine: str = Query("openai", pattern="^(openai|local)$"),
+    use_cache: bool = True,
+) -> StreamingResponse:
+    """Como /generate-text, pero emite los tokens por SSE a medida que se generan."""
+    return sse_response(sse_tokens(_text_stream(prompt, max_tokens, engine, use_cache)))
+
+
+@app.get("/streaming/metrics", tags=["infra"])
+async def streaming_metrics() -> Dict[str, Any]:
+    """Tiempo hasta el primer token (p50/p95) y streams completados o cortados."""
+    return stream_stats.metrics()
+
+
 @app.post("/generate-image")
-async def generate_image(description: str):
+async def generate_image(description: str, use_cache: bool = True) -> Dict[str, Any]:
     try:
-        result = ai_client.generate_image(description)
+        result = await ai_client.agenerate_image(description, use_cache=use_cache)
         if not result["success"]:
             raise HTTPException(status_code=500, detail=result["error"])
         return result
@@ -0,0 +1,97 @@
+"""
+Servido de archivos de audio e imágenes grandes sin cargarlos en memoria.
+
+`MediaFileResponse` amplía la `FileResponse` de Starlette (que ya resuelve
+Range/206, If-Range y HEAD leyendo por trozos) con:
+
+- 304 Not Modified cuando If-None-Match coincide con el ETag.
+- Envío zero-copy (`os.sendfile` en el servidor) si el servidor ASGI
+  anuncia la extensión `http.response.zerocopy`; con `pathsend` (p. ej.
+  Granian) ya lo hace Starlette para respuestas completas.
+
+Detrás de nginx se puede delegar el envío entero con `X-Accel-Redirect`
+(MEDIA_ACCEL_REDIRECT): nginx sirve el fichero con sendfile y resuelve
+Range él mismo.
+"""
+
+import asyncio
+import os
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+ZEROCOPY = "http.response.zerocopy"
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True si la cabecera If-None-Match incluye el ETag (comparación débil)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in tags)
+
+
+def resolve_media_path(root: str, name: str) -> Optional[str]:
+    """Ruta de `name` dentro de `root`, o None si no existe o intenta salir de `root`."""
+    base = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(base, name))
+    if os.path.commonpath([base, path]) != base or not os.path.isfile(path):
+        return None
+    return path
+
+
+class MediaFileResponse(FileResponse):
+    """FileResponse con respuestas condicionales (304) y envío zero-copy."""
+
+    _zerocopy = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.stat_result is None:
+            self.stat_result = await asyncio.to_thread(os.stat, self.path)
+            self.set_stat_headers(self.stat_result)
+        request_headers = Headers(scope=scope)
+        if scope["type"] == "http" and etag_matches(
+            request_headers.get("if-none-match"), self.headers["etag"]
+        ):
+            headers = MutableHeaders(raw=list(self.raw_headers))
+            for name in ("content-length", "content-type", "accept-ranges"):
+                del headers[name]
+            await send({"type": "http.response.start", "status": 304, "headers": headers.raw})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        self._zerocopy = ZEROCOPY in scope.get("extensions", {})
+        await super().__call__(scope, receive, send)
+
+    async def _sendfile(self, send: Send, offset: int, count: int) -> None:
+        file = await asyncio.to_thread(open, self.path, "rb")
+        try:
+            await send({
+                "type": ZEROCOPY, "file": file, "offset": offset, "count": count,
+                "more_body": False,
+            })
+        finally:
+            file.close()
+
+    async def _handle_simple(self, send: Send, send_header_only: bool, send_pathsend: bool) -> None:
+        if not self._zerocopy or send_header_only or send_pathsend:
+            return await super()._handle_simple(send, send_header_only, send_pathsend)
+        assert self.stat_result is not None
+        await send({
+            "type": "http.response.start", "status": self.status_code, "headers": self.raw_headers,
+        })
+        await self._sendfile(send, 0, self.stat_result.st_size)
+
+    async def _handle_single_range(
+        self, send: Send, start: int, end: int, file_size: int, send_header_only: bool
+    ) -> None:
+        if not self._zerocopy or send_header_only:
+            return await super()._handle_single_range(send, start, end, file_size, send_header_only)
+        headers = MutableHeaders(raw=list(self.raw_headers))
+        headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+        headers["content-length"] = str(end - start)
+        await send({"type": "http.response.start", "status": 206, "headers": headers.raw})
+        await self._sendfile(send, start, end - start)
@@ -0,0 +1,458 @@
+"""
+Mezcla de voz e instrumental con NumPy, por bloques de tamaño fijo.
+
+Etapas, todas vectorizadas:
+
+- Remuestreo polifásico con sinc enventanado (`ResampledSource`): cada
+  muestra de salida es el producto de los pesos de su fase por las
+  muestras vecinas; por fase se calcula de una vez para todo el bloque
+  sobre una vista deslizante (`sliding_window_view`).
+- Ganancias: se mide la sonoridad integrada (BS.1770) de cada pista y se
+  deja la voz `vocal_level_db` LU por encima del instrumental; la mezcla
+  se lleva a `target_lufs` (su sonoridad se calcula exacta, ver
+  `stage_gains`).
+- Limitador con anticipación (`Limiter`): mínimo deslizante de la
+  ganancia necesaria (van Herk/Gil-Werman) y media móvil, sin bucles por
+  muestra. Garantiza que ningún pico pasa del techo.
+
+Las pistas se leen por bloques (`AudioSource.read`), directamente del mmap
+del WAV, y la salida se escribe por bloques, así que la memoria no depende
+de la duración. Hay dos pasadas: una para medir y otra para mezclar.
+`Mixer` ejecuta la mezcla en un pool de procesos para no ocupar el event
+loop ni el GIL del servidor.
+"""
+
+import asyncio
+import mmap
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from fractions import Fraction
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, Union
+
+import numpy as np
+
+from backend.audio import (
+    LoudnessMeter, WavWriter, decode_with_ffmpeg, gated_loudness, pcm_to_float, wav_layout
+)
+from backend.blob_store import BlobMeta, BlobStore
+
+
+class AudioSource:
+    """Pista leída por bloques; fuera de sus límites devuelve silencio."""
+
+    sample_rate: int
+    channels: int
+    frames: int
+
+    def _read(self, start: int, stop: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def read(self, start: int, count: int) -> np.ndarray:
+        """`count` frames float32 (count, canales) desde `start` (puede ser negativo)."""
+        out = np.zeros((count, self.channels), dtype=np.float32)
+        lo, hi = max(start, 0), min(start + count, self.frames)
+        if hi > lo:
+            out[lo - start : hi - start] = self._read(lo, hi)
+        return out
+
+
+class ArraySource(AudioSource):
+    def __init__(self, samples: np.ndarray, sample_rate: int):
+        self.samples = samples if samples.ndim == 2 else samples[:, None]
+        self.sample_rate = sample_rate
+        self.channels = self.samples.shape[1]
+        self.frames = len(self.samples)
+
+    def _read(self, start: int, stop: int) -> np.ndarray:
+        return self.samples[start:stop]
+
+
+class WavSource(AudioSource):
+    """WAV leído desde un buffer (mmap): solo se convierte a float el bloque pedido."""
+
+    def __init__(self, buffer: Any):
+        self.layout = wav_layout(buffer)
+        self.raw = np.frombuffer(
+            buffer,
+            dtype=np.uint8,
+            count=self.layout.data_end - self.layout.data_start,
+            offset=self.layout.data_start,
+        )
+        self.sample_rate = self.layout.sample_rate
+        self.channels = self.layout.channels
+        self.frames = self.layout.frames
+
+    def _read(self, start: int, stop: int) -> np.ndarray:
+        size = self.layout.frame_bytes
+        return pcm_to_float(self.raw[start * size : stop * size], self.layout)
+
+
+def open_source(buffer: Any) -> AudioSource:
+    """WAV por bloques desde el buffer; otros formatos se decodifican enteros con ffmpeg."""
+    if bytes(buffer[:4]) == b"RIFF":
+        return WavSource(buffer)
+    return ArraySource(*decode_with_ffmpeg(buffer))
+
+
+class ResampledSource(AudioSource):
+    """
+    Remuestreo polifásico con sinc enventanado (Hann) de `taps` coeficientes.
+
+    Con frecuencias en relación racional M/L (48000 -> 44100 es 160/147) la
+    salida n cae siempre en una de L fases: los pesos de cada fase se
+    calculan una vez y cada bloque son L productos matriz-vector sobre una
+    vista deslizante de la entrada, sin copiarla. Al reducir la frecuencia
+    se baja el corte para no crear aliasing.
+    """
+
+    def __init__(self, source: AudioSource, sample_rate: int, taps: int = 32):
+        ratio = Fraction(source.sample_rate, sample_rate)
+        self.source = source
+        self.sample_rate = sample_rate
+        self.channels = source.channels
+        self.step, self.phases = ratio.numerator, ratio.denominator
+        self.frames = -(-source.frames * self.phases // self.step)
+        self.half = max(1, taps // 2)
+        cutoff = min(1.0, 1 / float(ratio))
+        offsets = np.arange(-self.half + 1, self.half + 1)
+        # distance[p, k]: distancia entre una salida de la fase p
+        # y su k-ésima muestra vecina de entrada
+        distance = np.arange(self.phases)[:, None] / self.phases - offsets[None, :]
+        window = 0.5 * (1 + np.cos(np.pi * distance / self.half))
+        weights = cutoff * np.sinc(cutoff * distance) * window
+        self.weights = weights.astype(np.float32)
+
+    def read(self, start: int, count: int) -> np.ndarray:
+        out = np.empty((count, self.channels), dtype=np.float32)
+        if count == 0:
+            return out
+        first = start * self.step // self.phases
+        last = (start + count - 1) * self.step // self.phases
+        window = self.source.read(first - self.half + 1, last - first + 2 * self.half)
+        # rows[r]: (canales, taps) con las muestras vecinas de la entrada first + r
+        rows = np.lib.stride_tricks.sliding_window_view(window, 2 * self.half, axis=0)
+        for i in range(min(self.phases, count)):
+            position = (start + i) * self.step
+            base, phase = divmod(position, self.phases)
+            selected = rows[base - first :: self.step][: len(range(i, count, self.phases))]
+            out[i :: self.phases] = selected @ self.weights[phase]
+        return out
+
+
+def resample_to(source: AudioSource, sample_rate: int) -> AudioSource:
+    return source if source.sample_rate == sample_rate else ResampledSource(source, sample_rate)
+
+
+def match_channels(block: np.ndarray, channels: int) -> np.ndarray:
+    """Mono a estéreo duplicando, a mono promediando."""
+    if block.shape[1] == channels:
+        return block
+    if channels == 1:
+        return np.asarray(block.mean(axis=1, keepdims=True), dtype=block.dtype)
+    if block.shape[1] == 1:
+        return np.repeat(block, channels, axis=1)
+    return block[:, :channels]
+
+
+def sliding_min(values: np.ndarray, window: int) -> np.ndarray:
+    """Mínimo de cada ventana `values[i:i+window]` en O(n) (van Herk/Gil-Werman)."""
+    if window <= 1:
+        return np.array(values, dtype=np.float64)
+    out_len = len(values) - window + 1
+    pad = (-len(values)) % window
+    blocks = np.concatenate([values, np.full(pad, np.inf)]).reshape(-1, window)
+    prefix = np.minimum.accumulate(blocks, axis=1).ravel()
+    suffix = np.minimum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    return np.minimum(suffix[:out_len], prefix[window - 1 : window - 1 + out_len])
+
+
+class Limiter:
+    """
+    Limitador de picos con anticipación, por bloques.
+
+    La ganancia necesaria por muestra (techo / pico) se mantiene al mínimo
+    durante `lookahead + hold` y se suaviza con una media de `lookahead`
+    muestras; con la señal retrasada `lookahead - 1` muestras, la ganancia
+    aplicada nunca supera la necesaria. La salida va retrasada: `flush()`
+    devuelve las últimas muestras.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        channels: int,
+        ceiling_db: float = -1.0,
+        lookahead_ms: float = 5.0,
+        hold_ms: float = 50.0,
+    ):
+        self.channels = channels
+        self.ceiling = 10 ** (ceiling_db / 20)
+        self.attack = max(1, int(lookahead_ms * sample_rate / 1000))
+        self.window = self.attack + int(hold_ms * sample_rate / 1000)
+        self.delay = self.attack - 1
+        self._required = np.ones(self.window - 1)
+        self._held = np.ones(self.attack - 1)
+        self._delayed = np.zeros((self.delay, channels), dtype=np.float32)
+        self._skip = self.delay
+        self.min_gain = 1.0
+
+    @staticmethod
+    def _carry(values: np.ndarray, size: int) -> np.ndarray:
+        return values[len(values) - size :] if size else values[:0]
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        peak = np.abs(block).max(axis=1) if len(block) else np.zeros(0)
+        required = np.minimum(1.0, self.ceiling / np.maximum(peak, 1e-12))
+        extended = np.concatenate([self._required, required])
+        self._required = self._carry(extended, self.window - 1)
+        held = np.concatenate([self._held, sliding_min(extended, self.window)])
+        self._held = self._carry(held, self.attack - 1)
+        total = np.concatenate([[0.0], np.cumsum(held)])
+        gain = (total[self.attack :] - total[: -self.attack]) / self.attack
+        signal = np.concatenate([self._delayed, block.astype(np.float32, copy=False)])
+        self._delayed = self._carry(signal, self.delay)
+        out = signal[: len(block)] * gain[:, None].astype(np.float32)
+        if len(gain):
+            self.min_gain = min(self.min_gain, float(gain.min()))
+        if self._skip:
+            drop = min(self._skip, len(out))
+            out, self._skip = out[drop:], self._skip - drop
+        return np.asarray(out, dtype=np.float32)
+
+    def flush(self) -> np.ndarray:
+        return self.process(np.zeros((self.delay, self.channels), dtype=np.float32))
+
+
+@dataclass(frozen=True)
+class MixSettings:
+    sample_rate: int = 44100
+    channels: int = 2
+    # LU de la voz por encima del instrumental
+    vocal_level_db: float = 1.0
+    target_lufs: float = -14.0
+    ceiling_db: float = -1.0
+    block_size: int = 1 << 16
+    # Segundo de la voz que coincide con el inicio del instrumental (previas)
+    vocal_offset: float = 0.0
+    fade_in: float = 0.0
+    fade_out: float = 0.0
+
+
+def _db(value: float) -> float:
+    return 10 ** (value / 20)
+
+
+def stage_gains(
+    instrumental: np.ndarray, vocal: np.ndarray, summed: np.ndarray, hop: int, settings: MixSettings
+) -> Tuple[float, float]:
+    """
+    Ganancias (dB) de instrumental y voz a partir de las energías ponderadas
+    por tramo de cada pista y de su suma sin ganancias.
+
+    La ponderación K es lineal, así que la energía de la mezcla con
+    ganancias a, b es a²·I + b²·V + a·b·(S - I - V) tramo a tramo: la
+    sonoridad de la mezcla se calcula exacta (incluida la correlación entre
+    pistas) sin otra pasada. El limitador solo baja los picos que queden
+    por encima del techo.
+    """
+    instrumental_lufs, vocal_lufs = gated_loudness(instrumental, hop), gated_loudness(vocal, hop)
+    relative = 0.0
+    if np.isfinite(instrumental_lufs) and np.isfinite(vocal_lufs):
+        relative = instrumental_lufs + settings.vocal_level_db - vocal_lufs
+    scale = _db(relative)
+    mixed = instrumental + scale**2 * vocal + scale * (summed - instrumental - vocal)
+    mixed_lufs = gated_loudness(np.maximum(mixed, 0.0), hop)
+    if not np.isfinite(mixed_lufs):
+        return 0.0, 0.0
+    normalize = settings.target_lufs - mixed_lufs
+    return float(normalize), float(relative + normalize)
+
+
+def _fades(start: int, count: int, frames: int, settings: MixSettings) -> Optional[np.ndarray]:
+    fade_in = int(settings.fade_in * settings.sample_rate)
+    fade_out = int(settings.fade_out * settings.sample_rate)
+    if not (fade_in and start < fade_in) and not (fade_out and start + count > frames - fade_out):
+        return None
+    index = np.arange(start, start + count, dtype=np.float32)
+    envelope = np.ones(count, dtype=np.float32)
+    if fade_in:
+        envelope = np.minimum(envelope, index / fade_in)
+    if fade_out:
+        envelope = np.minimum(envelope, (frames - index) / fade_out)
+    return np.clip(envelope, 0, 1)[:, None]
+
+
+def mix(
+    vocal: AudioSource,
+    instrumental: AudioSource,
+    write: Callable[[np.ndarray], None],
+    settings: MixSettings = MixSettings(),
+) -> Dict[str, Any]:
+    """
+    Mezcla la voz sobre el instrumental (la duración es la del instrumental)
+    y entrega la salida por bloques a `write`.
+
+    Returns:
+        Informe con sonoridades medidas, ganancias y reducción máxima del limitador
+    """
+    started = time.perf_counter()
+    rate, channels, size = settings.sample_rate, settings.channels, settings.block_size
+    vocal, instrumental = resample_to(vocal, rate), resample_to(instrumental, rate)
+    frames = instrumental.frames
+    offset = int(round(settings.vocal_offset * rate))
+
+    def blocks() -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        for start in range(0, frames, size):
+            count = min(size, frames - start)
+            inst_block = match_channels(instrumental.read(start, count), channels)
+            vocal_block = match_channels(vocal.read(start + offset, count), channels)
+            # Los fundidos se aplican a cada pista para que la medida de la pasada 1 ya los incluya
+            envelope = _fades(start, count, frames, settings)
+            if envelope is not None:
+                inst_block, vocal_block = inst_block * envelope, vocal_block * envelope
+            yield inst_block, vocal_block
+
+    # Pasada 1: energía ponderada de cada pista y de su suma
+    meters = [LoudnessMeter(rate, channels) for _ in range(3)]
+    for inst_block, vocal_block in blocks():
+        meters[0].process(inst_block)
+        meters[1].process(vocal_block)
+        meters[2].process(inst_block + vocal_block)
+    inst_hops, vocal_hops, summed_hops = (meter.hops for meter in meters)
+    inst_gain, vocal_gain = stage_gains(inst_hops, vocal_hops, summed_hops, meters[0].hop, settings)
+
+    # Pasada 2: ganancias, limitador y escritura
+    limiter = Limiter(rate, channels, settings.ceiling_db)
+    output_meter = LoudnessMeter(rate, channels)
+    peak = 0.0
+    for inst_block, vocal_block in blocks():
+        mixed = inst_block * np.float32(_db(inst_gain)) + vocal_block * np.float32(_db(vocal_gain))
+        out = limiter.process(mixed)
+        output_meter.process(out)
+        peak = max(peak, float(np.abs(out).max()) if len(out) else 0.0)
+        write(out)
+    tail = limiter.flush()
+    output_meter.process(tail)
+    peak = max(peak, float(np.abs(tail).max()) if len(tail) else 0.0)
+    write(tail)
+    return {
+        "frames": frames,
+        "sample_rate": rate,
+        "seconds": round(frames / rate, 3),
+        "instrumental_lufs": round(gated_loudness(inst_hops, meters[0].hop), 2),
+        "vocal_lufs": round(gated_loudness(vocal_hops, meters[0].hop), 2),
+        "instrumental_gain_db": round(inst_gain, 2),
+        "vocal_gain_db": round(vocal_gain, 2),
+        "output_lufs": round(output_meter.integrated(), 2),
+        "peak_dbfs": round(float(20 * np.log10(peak)), 2) if peak > 0 else float("-inf"),
+        "limiter_reduction_db": round(float(-20 * np.log10(limiter.min_gain)), 2),
+        "elapsed": round(time.perf_counter() - started, 3),
+    }
+
+
+Input = Union[str, bytes]
+
+
+def _open_input(value: Input, stack: Any) -> AudioSource:
+    if isinstance(value, str):
+        f = stack.enter_context(open(value, "rb"))
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Los arrays de WavSource apuntan al mmap: se cierra al final (o con el proceso)
+        stack.callback(lambda: _close_quietly(mapped))
+        return open_source(mapped)
+    return open_source(value)
+
+
+def _close_quietly(mapped: mmap.mmap) -> None:
+    try:
+        mapped.close()
+    except BufferError:
+        pass
+
+
+def mix_files(
+    vocal: Input, instrumental: Input, out_path: str, settings: MixSettings = MixSettings()
+) -> Dict[str, Any]:
+    """
+    Mezcla dos audios (ruta, mapeada en memoria, o bytes) a un WAV de 16 bits
+    en `out_path`. Función de nivel de módulo: se ejecuta en el pool.
+    """
+    from contextlib import ExitStack
+
+    with ExitStack() as stack:
+        vocal_source = _open_input(vocal, stack)
+        instrumental_source = _open_input(instrumental, stack)
+        writer = WavWriter(out_path, settings.sample_rate, settings.channels)
+        stack.callback(writer.close)
+        return mix(vocal_source, instrumental_source, writer.write, settings)
+
+
+class Mixer:
+    """
+    Mezclas en un pool de procesos sobre blobs del almacén.
+
+    Args:
+        workers: Procesos del pool
+        executor: Executor a usar en lugar del pool propio
+    """
+
+    def __init__(self, workers: int = 1, executor: Optional[Executor] = None):
+        self.workers = max(1, workers)
+        self._executor = executor
+        self._owns_executor = executor is None
+        self.stats = {"mixes": 0, "seconds_mixed": 0.0, "elapsed": 0.0}
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            # spawn: el proceso del servidor ya tiene hilos (uvicorn, torch) y fork no es seguro
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    @staticmethod
+    def _input(blobs: BlobStore, sha256: str) -> Input:
+        path = blobs.path(sha256)
+        if path is not None:
+            return path
+        with blobs.open(sha256) as data:
+            return bytes(data)
+
+    async def mix(
+        self, blobs: BlobStore, vocal: str, instrumental: str, settings: MixSettings = MixSettings()
+    ) -> Tuple[BlobMeta, Dict[str, Any]]:
+        """Mezcla dos blobs y guarda el resultado como blob nuevo (WAV)."""
+        os.makedirs(blobs.tmp_dir, exist_ok=True)
+        fd, out_path = tempfile.mkstemp(dir=blobs.tmp_dir, prefix=".mix-")
+        os.close(fd)
+        try:
+            loop = asyncio.get_running_loop()
+            report = await loop.run_in_executor(
+                self.executor,
+                mix_files,
+                self._input(blobs, vocal),
+                self._input(blobs, instrumental),
+                out_path,
+                settings,
+            )
+            meta, _ = await blobs.put_file(out_path, "audio/wav")
+        finally:
+            if os.path.exists(out_path):
+                os.unlink(out_path)
+        self.stats["mixes"] += 1
+        self.stats["seconds_mixed"] += report["seconds"]
+        self.stats["elapsed"] += report["elapsed"]
+        return meta, report
+
+    def metrics(self) -> Dict[str, Any]:
+        return {**self.stats, "workers": self.workers}
+
+    def shutdown(self) -> None:
+        if self._executor is not None and self._owns_executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Lanzador pre-fork: carga el modelo local una sola vez y lo comparte entre workers.
+
+Con `uvicorn --workers N` cada worker importa `backend.local_ai` y carga su
+propia copia de los pesos, así que la memoria crece con N. Aquí el proceso
+maestro carga el modelo (transformers copia los tensores a memoria anónima
+del proceso), congela el heap de Python con `gc.freeze()` y después hace
+fork de los workers: heredan las páginas de los pesos compartidas
+copy-on-write y, mientras nadie las escriba, cada worker solo paga su
+memoria propia (USS). `gc.freeze()` evita que el recolector toque los
+objetos heredados y fuerce copias de sus páginas. El maestro no sirve peticiones; vigila a los
+workers, los reinicia si mueren y les reenvía SIGTERM/SIGINT.
+
+El maestro no ejecuta inferencia antes del fork: el pool de hilos de
+torch/OpenMP no sobrevive a un fork, así que cada worker lo crea al
+generar por primera vez.
+
+Uso:
+    python -m backend.prefork --workers 4 --host 0.0.0.0 --port 8000
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+from typing import Any, Dict, Optional
+
+from backend.config import PREFORK_WORKERS
+from backend.local_ai import LocalTextModel, process_memory, text_model
+
+logger = logging.getLogger("backend")
+
+
+def touch_weights(pipe: Any) -> int:
+    """
+    Lee todas las páginas de los pesos en el maestro para que estén residentes
+    antes del fork: los workers las heredan ya cargadas y compartidas
+    copy-on-write en lugar de que alguna página pendiente se materialice por
+    separado en cada worker. Usa NumPy para no arrancar el pool de hilos de
+    torch antes del fork.
+    """
+    import numpy
+
+    model = getattr(pipe, "model", None)
+    if model is None or not hasattr(model, "parameters"):
+        return 0
+    touched = 0
+    for tensor in [*model.parameters(), *model.buffers()]:
+        try:
+            array = tensor.detach().numpy()
+        except (RuntimeError, TypeError):
+            # Tensores cuantizados o en otro dispositivo: ya son memoria propia
+            continue
+        numpy.add.reduce(array, axis=None)
+        touched += array.nbytes
+    return touched
+
+
+def preload(model: LocalTextModel) -> None:
+    """Carga el modelo, trae sus pesos a memoria y congela el heap antes del fork."""
+    touched = touch_weights(model.load())
+    logger.info(f"{touched / 2**20:.0f} MB de pesos en memoria compartida")
+    gc.collect()
+    # Los objetos congelados no se recorren en las recolecciones de los
+    # workers, así que sus páginas no se escriben (y no se copian)
+    gc.freeze()
+
+
+class PreforkServer:
+    """
+    Maestro que comparte un socket y un modelo precargado con N workers.
+
+    Args:
+        app: Aplicación ASGI en formato "modulo:atributo"
+        host: Dirección de escucha
+        port: Puerto de escucha
+        workers: Número de procesos worker
+        model: Modelo a cargar antes del fork
+    """
+
+    def __init__(
+        self,
+        app: str = "backend.main:app",
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        workers: int = PREFORK_WORKERS,
+        model: LocalTextModel = text_model,
+    ):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.model = model
+        self.children: Dict[int, int] = {}
+        self._socket: Optional[socket.socket] = None
+        self._stopping = False
+
+    def bind(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        self._socket = sock
+        return sock
+
+    def _serve(self) -> None:
+        import uvicorn
+
+        assert self._socket is not None
+        # El worker instala sus propios manejadores de señales en uvicorn
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        config = uvicorn.Config(self.app, lifespan="on", log_level="info")
+        uvicorn.Server(config).run(sockets=[self._socket])
+
+    def spawn(self, slot: int) -> int:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._serve()
+            except BaseException:
+                logger.exception(f"Worker {slot} terminó con error")
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = slot
+        logger.info(f"Worker {slot} arrancado (pid {pid})")
+        return pid
+
+    def _signal_children(self, signum: int) -> None:
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _handle_stop(self, signum: int, frame: object) -> None:
+        self._stopping = True
+        self._signal_children(signal.SIGTERM)
+
+    def memory(self) -> Dict[int, Dict[str, int]]:
+        """Memoria (RSS/PSS/USS) de cada worker, por pid."""
+        return {pid: process_memory(pid) for pid in self.children}
+
+    def run(self) -> None:
+        self.bind()
+        started = time.perf_counter()
+        preload(self.model)
+        logger.info(
+            f"Modelo {self.model.model_name} precargado en {time.perf_counter() - started:.1f}s; "
+            f"lanzando {self.workers} workers en {self.host}:{self.port}"
+        )
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        for slot in range(self.workers):
+            self.spawn(slot)
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            if pid not in self.children:
+                continue
+            slot = self.children.pop(pid)
+            if self._stopping:
+                continue
+            logger.warning(f"Worker {slot} (pid {pid}) terminó con estado {status}; reiniciando")
+            # Evita un bucle de reinicios si el worker falla al arrancar
+            time.sleep(1)
+            self.spawn(slot)
+        if self._socket is not None:
+            self._socket.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--app", default="backend.main:app")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=PREFORK_WORKERS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    PreforkServer(args.app, args.host, args.port, args.workers).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Caché de resultados de generación (texto e imágenes) en dos niveles.
+
+Nivel 1: LRU en memoria del proceso. Nivel 2: SQLite en disco, compartido
+entre reinicios y workers. La clave es un hash del prompt normalizado, el
+modelo y los parámetros; cada entrada caduca por TTL y el disco se limita
+por tamaño total, expulsando primero lo menos usado. El tamaño se calcula
+en la propia base de datos dentro de la transacción de escritura, así que
+el límite vale para todos los workers que comparten el fichero.
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS prompt_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_prompt_cache_access ON prompt_cache (last_access);
+CREATE INDEX IF NOT EXISTS idx_prompt_cache_expires ON prompt_cache (expires_at);
+"""
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normaliza Unicode, mayúsculas y espacios para que prompts equivalentes coincidan."""
+    return " ".join(unicodedata.normalize("NFKC", prompt).casefold().split())
+
+
+def cache_key(kind: str, model: str, prompt: str, **params: Any) -> str:
+    payload = json.dumps(
+        {"kind": kind, "model": model, "prompt": normalize_prompt(prompt), "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PromptCache:
+    """
+    Caché LRU en memoria respaldada por SQLite.
+
+    Args:
+        path: Fichero SQLite del nivel en disco (None para usar solo memoria)
+        memory_size: Entradas máximas en memoria
+        disk_max_bytes: Tamaño máximo de los valores guardados en disco
+        ttl: Segundos de vida por defecto de una entrada
+    """
+
+    def __init__(
+        self,
+        path: Optional[str],
+        memory_size: int = 1024,
+        disk_max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 7 * 24 * 3600,
+    ):
+        self.path = path
+        self.memory_size = max(1, memory_size)
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "bypassed": 0,
+            "evictions": 0,
+        }
+
+    # --- Memoria ---
+
+    def _memory_get(self, key: str, now: float) -> Optional[Any]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= now:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_set(self, key: str, value: Any, expires_at: float) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    # --- Disco ---
+
+    def _open(self) -> sqlite3.Connection:
+        if self._conn is None:
+            assert self.path is not None
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            conn.execute("DELETE FROM prompt_cache WHERE expires_at <= ?", (time.time(),))
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            conn = self._open()
+            row = conn.execute(
+                "SELECT value, expires_at FROM prompt_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                conn.execute("DELETE FROM prompt_cache WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE prompt_cache SET last_access = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return row[1], json.loads(row[0])
+
+    @staticmethod
+    def _disk_size(conn: sqlite3.Connection) -> int:
+        return int(conn.execute("SELECT COALESCE(SUM(size), 0) FROM prompt_cache").fetchone()[0])
+
+    def _disk_set(self, key: str, value: Any, expires_at: float, now: float) -> None:
+        encoded = json.dumps(value, ensure_ascii=False)
+        size = len(encoded.encode("utf-8"))
+        with self._lock:
+            conn = self._open()
+            # La inserción toma el bloqueo de escritura: el tamaño que ve la
+            # expulsión incluye lo escrito por otros procesos y no cambia debajo
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO prompt_cache "
+                    "(key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, encoded, size, expires_at, now),
+                )
+                self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        total = self._disk_size(conn)
+        if total <= self.disk_max_bytes:
+            return
+        expired = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM prompt_cache WHERE expires_at <= ?",
+            (now,),
+        ).fetchone()
+        conn.execute("DELETE FROM prompt_cache WHERE expires_at <= ?", (now,))
+        total -= int(expired[1])
+        self.stats["evictions"] += int(expired[0])
+        # Menos usadas primero hasta volver por debajo del límite
+        for key, size in conn.execute(
+            "SELECT key, size FROM prompt_cache ORDER BY last_access"
+        ).fetchall():
+            if total <= self.disk_max_bytes:
+                break
+            conn.execute("DELETE FROM prompt_cache WHERE key = ?", (key,))
+            total -= int(size)
+            self.stats["evictions"] += 1
+
+    # --- API ---
+
+    def get_sync(self, key: str) -> Optional[Any]:
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return value
+        entry = self._disk_get(key, now) if self.path else None
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["disk_hits"] += 1
+        self._memory_set(key, entry[1], entry[0])
+        return entry[1]
+
+    def set_sync(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        self.stats["sets"] += 1
+        self._memory_set(key, value, expires_at)
+        if self.path:
+            self._disk_set(key, value, expires_at, now)
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Busca en memoria y, si falla, en disco desde un hilo."""
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return value
+        entry = await asyncio.to_thread(self._disk_get, key, now) if self.path else None
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        # La memoria solo se toca desde el event loop
+        self.stats["disk_hits"] += 1
+        self._memory_set(key, entry[1], entry[0])
+        return entry[1]
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        self.stats["sets"] += 1
+        self._memory_set(key, value, expires_at)
+        if self.path:
+            await asyncio.to_thread(self._disk_set, key, value, expires_at, now)
+
+    def record_bypass(self) -> None:
+        self.stats["bypassed"] += 1
+
+    def disk_bytes(self) -> int:
+        """Tamaño actual del nivel en disco, sumando lo escrito por todos los procesos."""
+        if not self.path:
+            return 0
+        with self._lock:
+            return self._disk_size(self._open())
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        return {
+            **self.stats,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_bytes": self.disk_bytes(),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
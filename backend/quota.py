@@ -0,0 +1,302 @@
+"""
+Libro de cuotas de canciones por usuario.
+
+La cuota se consume en dos fases: `reserve` descuenta una canción y deja una
+reserva abierta; al terminar la generación se confirma con `commit` o se
+devuelve con `refund`. Con Redis cada operación es un único script Lua
+(un round-trip atómico), así que varios workers de uvicorn comparten el mismo
+saldo sin carreras. Sin Redis se usa un libro en memoria para un solo proceso.
+
+Una reserva que nadie cierra (el worker murió a mitad de la generación) la
+devuelve `ReservationReaper` cuando supera QUOTA_RESERVATION_TTL.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - redis es opcional en modo memoria
+    aioredis = None  # type: ignore[assignment]
+
+logger = logging.getLogger("backend")
+
+_RESERVE_SCRIPT = """
+local remaining = tonumber(redis.call('HGET', KEYS[1], 'remaining') or '0')
+if remaining <= 0 then
+    return -1
+end
+redis.call('HINCRBY', KEYS[1], 'remaining', -1)
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+return remaining - 1
+"""
+
+# El saldo asignado descuenta las reservas abiertas:
+# si luego se devuelven, no se pasa de lo comprado
+_ASSIGN_SCRIPT = """
+local remaining = tonumber(ARGV[2]) - redis.call('HLEN', KEYS[2])
+redis.call('HSET', KEYS[1], 'plan', ARGV[1], 'remaining', remaining)
+return remaining
+"""
+
+_REFUND_SCRIPT = """
+if redis.call('HDEL', KEYS[2], ARGV[1]) == 1 then
+    return redis.call('HINCRBY', KEYS[1], 'remaining', 1)
+end
+return -1
+"""
+
+
+def new_reservation_id() -> str:
+    return uuid.uuid4().hex
+
+
+class QuotaLedger:
+    """
+    Interfaz común de los libros de cuotas.
+
+    Todas las operaciones son idempotentes por `reservation_id`: confirmar o
+    devolver dos veces la misma reserva no altera el saldo.
+    """
+
+    name = "base"
+
+    async def get(self, email: str) -> Dict[str, Any]:
+        """Devuelve `{"plan": ..., "canciones_restantes": ...}` del usuario."""
+        raise NotImplementedError
+
+    async def assign(self, email: str, plan: str, canciones: int) -> int:
+        """
+        Asigna un plan y fija el saldo de canciones, descontadas las reservas
+        abiertas: al devolverlas el saldo vuelve a `canciones`, no lo supera.
+
+        Returns:
+            Saldo disponible tras la asignación
+        """
+        raise NotImplementedError
+
+    async def reserve(self, email: str, reservation_id: str) -> Optional[int]:
+        """
+        Descuenta una canción de forma atómica.
+
+        Returns:
+            Canciones restantes tras la reserva, o None si no hay saldo
+        """
+        raise NotImplementedError
+
+    async def commit(self, email: str, reservation_id: str) -> bool:
+        """Cierra la reserva; la canción queda consumida."""
+        raise NotImplementedError
+
+    async def refund(self, email: str, reservation_id: str) -> Optional[int]:
+        """
+        Devuelve la canción de una reserva abierta.
+
+        Returns:
+            Saldo tras la devolución, o None si la reserva no existía
+        """
+        raise NotImplementedError
+
+    async def reap(self, max_age: float) -> int:
+        """
+        Devuelve las reservas abiertas con más de `max_age` segundos.
+
+        Returns:
+            Número de reservas devueltas
+        """
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        return None
+
+
+class InMemoryQuotaLedger(QuotaLedger):
+    """
+    Libro en memoria del proceso; válido solo con un worker.
+
+    Ninguna operación cede el event loop entre la lectura y la escritura del
+    saldo, por lo que son atómicas frente a otras corrutinas.
+    """
+
+    name = "memory"
+
+    def __init__(self) -> None:
+        self._users: Dict[str, Dict[str, Any]] = {}
+        self._reservations: Dict[str, Dict[str, float]] = {}
+
+    def _user(self, email: str) -> Dict[str, Any]:
+        if email not in self._users:
+            self._users[email] = {"plan": None, "canciones_restantes": 0}
+        return self._users[email]
+
+    async def get(self, email: str) -> Dict[str, Any]:
+        user = self._user(email)
+        remaining = max(0, int(user["canciones_restantes"]))
+        return {"plan": user["plan"], "canciones_restantes": remaining}
+
+    async def assign(self, email: str, plan: str, canciones: int) -> int:
+        remaining = canciones - len(self._reservations.get(email, {}))
+        self._users[email] = {"plan": plan, "canciones_restantes": remaining}
+        return remaining
+
+    async def reserve(self, email: str, reservation_id: str) -> Optional[int]:
+        user = self._user(email)
+        if int(user["canciones_restantes"]) <= 0:
+            return None
+        user["canciones_restantes"] -= 1
+        self._reservations.setdefault(email, {})[reservation_id] = time.time()
+        return int(user["canciones_restantes"])
+
+    async def commit(self, email: str, reservation_id: str) -> bool:
+        return self._reservations.get(email, {}).pop(reservation_id, None) is not None
+
+    async def refund(self, email: str, reservation_id: str) -> Optional[int]:
+        if self._reservations.get(email, {}).pop(reservation_id, None) is None:
+            return None
+        user = self._user(email)
+        user["canciones_restantes"] += 1
+        return int(user["canciones_restantes"])
+
+    async def reap(self, max_age: float) -> int:
+        limit = time.time() - max_age
+        expired = [
+            (email, reservation_id)
+            for email, reservations in self._reservations.items()
+            for reservation_id, created in reservations.items()
+            if created < limit
+        ]
+        for email, reservation_id in expired:
+            await self.refund(email, reservation_id)
+        return len(expired)
+
+
+class RedisQuotaLedger(QuotaLedger):
+    """
+    Libro compartido en un servidor con protocolo Redis.
+
+    Claves por usuario (con hash tag para que caigan en el mismo slot):
+        quota:{email}               hash con `plan` y `remaining`
+        quota:{email}:reservations  hash reservation_id -> timestamp
+    """
+
+    name = "redis"
+
+    def __init__(self, client: Any):
+        self.client = client
+        self._reserve = client.register_script(_RESERVE_SCRIPT)
+        self._assign = client.register_script(_ASSIGN_SCRIPT)
+        self._refund = client.register_script(_REFUND_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisQuotaLedger":
+        if aioredis is None:
+            raise RuntimeError("El paquete 'redis' no está instalado")
+        return cls(aioredis.from_url(url, decode_responses=True))
+
+    @staticmethod
+    def _keys(email: str) -> List[str]:
+        base = f"quota:{{{email}}}"
+        return [base, f"{base}:reservations"]
+
+    async def get(self, email: str) -> Dict[str, Any]:
+        plan, remaining = await self.client.hmget(self._keys(email)[0], "plan", "remaining")
+        return {"plan": plan or None, "canciones_restantes": max(0, int(remaining or 0))}
+
+    async def assign(self, email: str, plan: str, canciones: int) -> int:
+        return int(await self._assign(keys=self._keys(email), args=[plan, canciones]))
+
+    async def reserve(self, email: str, reservation_id: str) -> Optional[int]:
+        result = int(
+            await self._reserve(keys=self._keys(email), args=[reservation_id, time.time()])
+        )
+        return None if result < 0 else result
+
+    async def commit(self, email: str, reservation_id: str) -> bool:
+        return bool(await self.client.hdel(self._keys(email)[1], reservation_id))
+
+    async def refund(self, email: str, reservation_id: str) -> Optional[int]:
+        result = int(await self._refund(keys=self._keys(email), args=[reservation_id]))
+        return None if result < 0 else result
+
+    async def reap(self, max_age: float) -> int:
+        # Recorre las reservas de todos los usuarios; el script de devolución es
+        # atómico, así que varios workers pueden barrer a la vez sin devolver dos veces
+        limit = time.time() - max_age
+        reaped = 0
+        async for key in self.client.scan_iter(match="quota:{*}:reservations", count=500):
+            email = key[len("quota:{") : -len("}:reservations")]
+            reservations = await self.client.hgetall(key)
+            for reservation_id, created in reservations.items():
+                if float(created) < limit and await self.refund(email, reservation_id) is not None:
+                    reaped += 1
+        return reaped
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class ReservationReaper:
+    """
+    Devuelve cada `interval` segundos las reservas abiertas con más de
+    `max_age` segundos: trabajos que se perdieron con un worker caído.
+
+    Si la generación termina después, `commit` ya no encuentra la reserva y
+    la canción no se cobra; por eso `max_age` debe superar con holgura la
+    duración de una generación.
+    """
+
+    def __init__(self, max_age: float = 3600, interval: float = 60):
+        self.max_age = max_age
+        self.interval = interval
+        self.reaped = 0
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    async def start(self, ledger: QuotaLedger) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(ledger), name="quota-reaper")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, ledger: QuotaLedger) -> None:
+        while True:
+            try:
+                reaped = await ledger.reap(self.max_age)
+            except Exception as e:
+                logger.warning(f"No se pudieron revisar las reservas abiertas: {e}")
+            else:
+                if reaped:
+                    self.reaped += reaped
+                    logger.warning(f"Devueltas {reaped} reservas de cuota abandonadas")
+            await asyncio.sleep(self.interval)
+
+
+async def create_quota_ledger(backend: str, redis_url: str) -> QuotaLedger:
+    """
+    Crea el libro de cuotas configurado.
+
+    Args:
+        backend: "redis", "memory" o "auto" (Redis si responde, si no memoria)
+        redis_url: URL del servidor Redis
+    """
+    if backend == "memory":
+        return InMemoryQuotaLedger()
+    ledger: Optional[RedisQuotaLedger] = None
+    try:
+        ledger = RedisQuotaLedger.from_url(redis_url)
+        await ledger.client.ping()
+        logger.info("Libro de cuotas en Redis")
+        return ledger
+    except Exception as e:
+        if ledger is not None:
+            await ledger.close()
+        if backend == "redis":
+            raise
+        logger.warning(f"Redis no disponible ({e}); cuotas en memoria de un solo proceso")
+        return InMemoryQuotaLedger()
@@ -1,21 +1,102 @@
-from fastapi import APIRouter, HTTPException
-from backend.utils.ai_integration import AIIntegration
+import hmac
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import JSONResponse
+from backend.ai_integration import AIIntegration
+from backend.auth import Principal, get_current_user
+from backend.config import OPENAI_API_KEY
+from backend.config import SUNO_CALLBACK_URL, SUNO_WEBHOOK_SECRET
+from backend.config import SUNO_POLL_MIN_INTERVAL, SUNO_POLL_MAX_INTERVAL
+from backend.config import SUNO_POLL_BATCH_SIZE, SUNO_TASK_TIMEOUT
+from backend.suno_client import SunoError
+from backend.suno_tasks import SunoTaskTracker
 
 router = APIRouter()
-ai_client = AIIntegration(api_key="YOUR_API_KEY")
+# Comparte el pool de conexiones con el cliente de main.py (misma API key)
+ai_client = AIIntegration(api_key=OPENAI_API_KEY)
+# Generaciones de Suno pendientes; el sondeo se arranca en el lifespan de main.py
+suno_tasks = SunoTaskTracker(
+    ai_client.suno,
+    min_interval=SUNO_POLL_MIN_INTERVAL,
+    max_interval=SUNO_POLL_MAX_INTERVAL,
+    batch_size=SUNO_POLL_BATCH_SIZE,
+    task_timeout=SUNO_TASK_TIMEOUT,
+)
 
 
 @router.post("/generate-text")
-async def generate_text(prompt: str):
-    result = ai_client.generate_text(prompt)
+async def generate_text(prompt: str, use_cache: bool = True) -> Dict[str, Any]:
+    result = await ai_client.agenerate_text(prompt, use_cache=use_cache)
     if not result["success"]:
         raise HTTPException(status_code=500, detail=result["error"])
     return result
 
 
 @router.post("/generate-image")
-async def generate_image(description: str):
-    result = ai_client.generate_image(description)
+async def generate_image(description: str, use_cache: bool = True) -> Dict[str, Any]:
+    result = await ai_client.agenerate_image(description, use_cache=use_cache)
     if not result["success"]:
         raise HTTPException(status_code=500, detail=result["error"])
     return result
+
+
+@router.get("/cache/metrics", tags=["infra"])
+async def cache_metrics() -> Dict[str, Any]:
+    """Aciertos, fallos y ocupación de la caché de prompts y llamadas compartidas."""
+    single_flight = ai_client.flights.metrics()
+    if ai_client.cache is None:
+        return {"enabled": False, "single_flight": single_flight}
+    return {"enabled": True, **ai_client.cache.metrics(), "single_flight": single_flight}
+
+
+@router.get("/suno/health", tags=["infra"])
+async def suno_health() -> Dict[str, Any]:
+    """Estado del circuit breaker y contadores de reintentos del cliente de Suno."""
+    return ai_client.suno.metrics()
+
+
+@router.post("/generate-song", status_code=202)
+async def generate_song(
+    prompt: str, style: str = "pop", principal: Principal = Depends(get_current_user)
+) -> Dict[str, Any]:
+    """Lanza la generación en Suno y devuelve la tarea para consultar su estado."""
+    try:
+        task = await suno_tasks.submit(
+            prompt, style, owner=principal.email, callback_url=SUNO_CALLBACK_URL or None
+        )
+    except SunoError as e:
+        raise HTTPException(status_code=503 if e.status_code == 503 else 502, detail=e.message)
+    return {**task.to_dict(), "status_url": f"/ai/songs/{task.id}"}
+
+
+@router.get("/songs/{task_id}")
+async def get_song_task(task_id: str, principal: Principal = Depends(get_current_user)) -> Any:
+    """Estado de la generación; incluye `audio_url` al completarse (202 mientras siga)."""
+    task = suno_tasks.get(task_id)
+    if task is None or task.owner != principal.email:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    if not task.finished:
+        return JSONResponse(status_code=202, content=task.to_dict())
+    return task.to_dict()
+
+
+@router.post("/suno/callback", include_in_schema=False)
+async def suno_callback(
+    request: Request, token: Optional[str] = None, x_suno_token: Optional[str] = Header(None)
+) -> Dict[str, Any]:
+    """Webhook de Suno: resuelve las tareas al instante sin esperar al sondeo."""
+    supplied = x_suno_token or token or ""
+    if not SUNO_WEBHOOK_SECRET or not hmac.compare_digest(supplied, SUNO_WEBHOOK_SECRET):
+        raise HTTPException(status_code=403, detail="Webhook no autorizado")
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cuerpo JSON inválido")
+    return {"updated": suno_tasks.apply_webhook(payload)}
+
+
+@router.get("/suno/tasks/metrics", tags=["infra"])
+async def suno_task_metrics() -> Dict[str, Any]:
+    """Tareas de Suno pendientes, sondeos realizados y actualizaciones por webhook."""
+    return suno_tasks.metrics()
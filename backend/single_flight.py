@@ -0,0 +1,77 @@
+"""
+Deduplicación de llamadas idénticas en vuelo ("single-flight").
+
+La primera petición con una clave lanza la llamada real como tarea propia;
+las que llegan mientras sigue en curso esperan esa misma tarea en lugar de
+repetirla. Si un cliente se desconecta solo deja de esperar: la llamada
+compartida se cancela únicamente cuando ya no queda nadie esperándola.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[Any]"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Agrupa por clave las llamadas asíncronas concurrentes.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, _Call] = {}
+        self.stats = {"leaders": 0, "shared": 0, "cancelled": 0}
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Ejecuta `factory()` una sola vez por clave entre los llamantes concurrentes.
+
+        Args:
+            key: Identifica llamadas equivalentes
+            factory: Crea la corrutina con la llamada real
+
+        Returns:
+            El resultado (o la excepción) de la llamada compartida
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = leader = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+
+            def forget(_: "asyncio.Future[Any]") -> None:
+                self._forget(key, leader)
+
+            call.task.add_done_callback(forget)
+            self.stats["leaders"] += 1
+        else:
+            self.stats["shared"] += 1
+        call.waiters += 1
+        try:
+            # shield: cancelar a un llamante no cancela la llamada de los demás
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # Era el último interesado: se aborta la llamada y las nuevas
+                # peticiones con la misma clave empiezan una desde cero
+                self._forget(key, call)
+                call.task.cancel()
+                self.stats["cancelled"] += 1
+            raise
+        finally:
+            call.waiters -= 1
+
+    def metrics(self) -> Dict[str, int]:
+        return {**self.stats, "in_flight": len(self._calls)}
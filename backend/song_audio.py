@@ -0,0 +1,336 @@
+"""
+Audio de las canciones generadas.
+
+Guarda el audio de cada canción en el almacén de blobs (el renderizado
+localmente por `/create-song` o el descargado de Suno al completarse la
+tarea) y ejecuta la etapa posterior a la generación: decodificar una vez y
+precalcular los picos de la forma de onda para el reproductor.
+
+Las canciones locales se identifican por su receta (título, género,
+duración y usuario que la creó), guardada como blob fijado: el id de la
+canción es su hash. En el
+modo previa primero solo se genera al momento una previa corta, con
+fundidos y normalizada en sonoridad; el máster completo se genera la
+primera vez que se pide. Previa y máster quedan enlazados a la receta como
+anexos y, si el presupuesto de disco los expulsa, se vuelven a generar
+(el render es determinista).
+
+Las canciones con voz clonada llevan en la receta el blob de la muestra de
+voz: el instrumental se renderiza igual y se mezcla con la voz en el pool
+de `Mixer` (remuestreo, ganancias, limitador y sonoridad objetivo).
+"""
+
+import asyncio
+import json
+import logging
+from dataclasses import asdict, dataclass, replace
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from backend.audio import SAMPLE_RATE, apply_fades, encode_wav, normalize_loudness, render_song
+from backend.blob_store import BlobMeta, BlobStore
+from backend.mixing import MixSettings, Mixer
+from backend.single_flight import SingleFlight
+from backend.uploads import StoredUpload, UploadStore
+from backend.waveform import Waveform, build_waveform, load_waveform
+
+logger = logging.getLogger("backend")
+
+# Tipo con el que se guardan las recetas; cualquier otro blob no es una canción
+RECIPE_CONTENT_TYPE = "application/json"
+
+
+@dataclass(frozen=True)
+class SongRecipe:
+    """Parámetros con los que se renderiza una canción local."""
+
+    title: str
+    genre: str = ""
+    seconds: float = 180.0
+    sample_rate: int = SAMPLE_RATE
+    # Blob de la muestra de voz que se mezcla sobre el instrumental
+    vocal: Optional[str] = None
+    # Usuario que creó la canción; solo él puede pedir el máster
+    owner: Optional[str] = None
+
+    def to_bytes(self) -> bytes:
+        # Los campos opcionales vacíos se omiten: los ids anteriores no cambian
+        fields = {k: v for k, v in asdict(self).items() if v is not None}
+        return json.dumps(fields, sort_keys=True, ensure_ascii=False).encode("utf-8")
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "SongRecipe":
+        return cls(**json.loads(data))
+
+
+def render_master(recipe: SongRecipe) -> np.ndarray:
+    return render_song(recipe.title, recipe.genre, recipe.seconds, recipe.sample_rate)
+
+
+def preview_window(recipe: SongRecipe, seconds: float) -> Tuple[float, float]:
+    """Inicio y duración de la previa: a un 30 % de la canción, donde suele entrar el estribillo."""
+    length = min(seconds, recipe.seconds)
+    return max(0.0, min(recipe.seconds * 0.3, recipe.seconds - length)), length
+
+
+def render_preview(
+    recipe: SongRecipe, seconds: float, sample_rate: int, target_lufs: Optional[float]
+) -> np.ndarray:
+    """
+    Sintetiza solo el tramo de la previa, con fundidos y normalizada a
+    `target_lufs` (sin normalizar ni fundidos si es None: lo hace la mezcla).
+    """
+    start, length = preview_window(recipe, seconds)
+    samples = render_song(recipe.title, recipe.genre, length, sample_rate, start=start)
+    if target_lufs is None:
+        return samples
+    return normalize_loudness(apply_fades(samples, sample_rate), sample_rate, target_lufs)
+
+
+class SongAudio:
+    """
+    Args:
+        blobs: Almacén donde quedan el audio y sus picos
+        max_bytes: Tamaño máximo de un audio descargado
+        samples_per_peak: Muestras por pico del nivel más fino
+        levels: Niveles de resolución de los picos
+        bits: Bits por pico (8 o 16)
+        preview_seconds: Duración de la previa
+        preview_sample_rate: Frecuencia de muestreo de la previa
+        preview_lufs: Sonoridad objetivo de la previa
+        mixer: Pool de mezcla para las canciones con voz (se crea uno si no se pasa)
+        mix: Ajustes de mezcla del máster; la previa usa su frecuencia y sonoridad
+    """
+
+    def __init__(
+        self,
+        blobs: BlobStore,
+        max_bytes: int = 100 * 2**20,
+        samples_per_peak: int = 256,
+        levels: int = 4,
+        bits: int = 8,
+        preview_seconds: float = 30.0,
+        preview_sample_rate: int = 22050,
+        preview_lufs: float = -14.0,
+        mixer: Optional[Mixer] = None,
+        mix: MixSettings = MixSettings(),
+    ):
+        self.blobs = blobs
+        self.uploads = UploadStore(blobs, max_bytes)
+        self.samples_per_peak = samples_per_peak
+        self.levels = levels
+        self.bits = bits
+        self.preview_seconds = preview_seconds
+        self.preview_sample_rate = preview_sample_rate
+        self.preview_lufs = preview_lufs
+        self.mixer = mixer or Mixer()
+        self.mix = mix
+        self._http: Optional[httpx.AsyncClient] = None
+        self._flights = SingleFlight()
+        self.stats = {
+            "stored": 0,
+            "downloads": 0,
+            "waveforms": 0,
+            "waveform_errors": 0,
+            "previews": 0,
+            "preview_hits": 0,
+            "masters": 0,
+            "master_hits": 0,
+            "mix_errors": 0,
+        }
+
+    async def start(self, transport: Optional[httpx.AsyncBaseTransport] = None) -> None:
+        """Crea el cliente de descargas (si no se llama, se crea en la primera descarga)."""
+        if self._http is None:
+            # Cliente propio sin la cabecera de Suno: el audio lo sirve su CDN
+            self._http = httpx.AsyncClient(
+                follow_redirects=True,
+                timeout=httpx.Timeout(60.0, connect=10.0),
+                transport=transport,
+            )
+
+    async def close(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        self.mixer.shutdown()
+
+    async def store_samples(self, samples: np.ndarray, sample_rate: int) -> BlobMeta:
+        """Codifica muestras float32 como WAV y las guarda en el almacén."""
+        data = await asyncio.to_thread(encode_wav, samples, sample_rate)
+        meta, _ = await self.blobs.put(data, "audio/wav")
+        self.stats["stored"] += 1
+        return meta
+
+    async def store_url(self, url: str) -> StoredUpload:
+        """Descarga un audio por streaming (con el límite de tamaño) y lo guarda en el almacén."""
+        await self.start()
+        assert self._http is not None
+        async with self._http.stream("GET", url) as response:
+            response.raise_for_status()
+            self.uploads.check_length(response.headers.get("content-length"))
+            content_type = response.headers.get("content-type", "audio/mpeg")
+            stored = await self.uploads.ingest(response.aiter_bytes(), content_type)
+        self.stats["downloads"] += 1
+        return stored
+
+    async def postprocess(self, sha256: str) -> Optional[Waveform]:
+        """
+        Etapa posterior a la generación: picos de la forma de onda.
+
+        Un fallo aquí no invalida la canción: se registra y devuelve None.
+        """
+        try:
+            waveform: Waveform = await self._flights.do(
+                sha256,
+                lambda: build_waveform(
+                    self.blobs, sha256, self.samples_per_peak, self.levels, self.bits
+                ),
+            )
+        except Exception as e:
+            self.stats["waveform_errors"] += 1
+            logger.warning(f"No se pudieron calcular los picos de {sha256}: {e}")
+            return None
+        self.stats["waveforms"] += 1
+        return waveform
+
+    async def waveform(self, sha256: str) -> Optional[Waveform]:
+        return await load_waveform(self.blobs, sha256)
+
+    def assets(self, sha256: str, waveform: Optional[Waveform]) -> Dict[str, Any]:
+        """Campos de respuesta con las URLs del audio guardado y de sus picos."""
+        data: Dict[str, Any] = {"audio_blob": sha256, "audio": f"/blobs/{sha256}"}
+        if waveform is not None:
+            data["waveform_url"] = f"/songs/{sha256}/waveform"
+            data["duration"] = round(waveform.duration, 3)
+        return data
+
+    async def is_voice_sample(self, sha256: str, owner: Optional[str]) -> bool:
+        """True si el blob es audio subido por `owner` (una muestra de voz suya)."""
+        meta = await self.blobs.get(sha256)
+        if meta is None or not meta.content_type.startswith("audio/"):
+            return False
+        return owner is not None and owner in await self.blobs.owners(sha256)
+
+    async def register(self, recipe: SongRecipe) -> str:
+        """
+        Guarda la receta (fijada: sin ella no se puede regenerar el audio) y
+        devuelve el id de la canción. La muestra de voz también se fija. La
+        receta queda a nombre de su dueño: solo él puede leerla en /blobs.
+
+        Raises:
+            KeyError: Si la muestra de voz no está en el almacén, no es audio
+                o no la subió el dueño de la receta
+        """
+        if recipe.vocal is not None and not (
+            await self.is_voice_sample(recipe.vocal, recipe.owner)
+            and await self.blobs.pin(recipe.vocal)
+        ):
+            raise KeyError(recipe.vocal)
+        meta, _ = await self.blobs.put(recipe.to_bytes(), RECIPE_CONTENT_TYPE, pin=True)
+        if recipe.owner is not None:
+            await self.blobs.add_owner(meta.sha256, recipe.owner)
+        return meta.sha256
+
+    async def recipe(self, song_id: str) -> Optional[SongRecipe]:
+        """Receta de la canción; None si el blob no existe o no es una receta."""
+        meta = await self.blobs.get(song_id)
+        if meta is None or meta.content_type != RECIPE_CONTENT_TYPE:
+            return None
+        with self.blobs.open(song_id) as data:
+            try:
+                return SongRecipe.from_bytes(bytes(data))
+            except (TypeError, ValueError):
+                # JSON ajeno con el mismo tipo (o corrupto): no es una canción
+                return None
+
+    async def _linked(self, song_id: str, name: str) -> Optional[str]:
+        """Blob enlazado a la canción, o None si no se generó o fue expulsado."""
+        ref = await self.blobs.get_sidecar(song_id, name)
+        if ref is None:
+            return None
+        sha256 = ref.decode("ascii")
+        return sha256 if await self.blobs.get(sha256) is not None else None
+
+    async def _render(
+        self,
+        song_id: str,
+        name: str,
+        render: Callable[[SongRecipe], Tuple[np.ndarray, int]],
+        settings: Callable[[SongRecipe], MixSettings],
+    ) -> Optional[Dict[str, Any]]:
+        sha256 = await self._linked(song_id, name)
+        if sha256 is not None:
+            self.stats[f"{name}_hits"] += 1
+            waveform = await self.waveform(sha256) or await self.postprocess(sha256)
+            return self.assets(sha256, waveform)
+        recipe = await self.recipe(song_id)
+        if recipe is None:
+            return None
+        samples, sample_rate = await asyncio.to_thread(render, recipe)
+        meta = await self.store_samples(samples, sample_rate)
+        if recipe.vocal is not None:
+            try:
+                meta, _ = await self.mixer.mix(
+                    self.blobs, recipe.vocal, meta.sha256, settings(recipe)
+                )
+            except Exception:
+                self.stats["mix_errors"] += 1
+                raise
+        await self.blobs.put_sidecar(song_id, name, meta.sha256.encode("ascii"))
+        self.stats[f"{name}s"] += 1
+        return self.assets(meta.sha256, await self.postprocess(meta.sha256))
+
+    async def preview(self, song_id: str) -> Optional[Dict[str, Any]]:
+        """Previa corta normalizada; se genera la primera vez y después se reutiliza."""
+        rate = self.preview_sample_rate
+
+        def render(recipe: SongRecipe) -> Tuple[np.ndarray, int]:
+            target = None if recipe.vocal is not None else self.preview_lufs
+            return render_preview(recipe, self.preview_seconds, rate, target), rate
+
+        def settings(recipe: SongRecipe) -> MixSettings:
+            # La voz se alinea con el tramo de la previa
+            start, _ = preview_window(recipe, self.preview_seconds)
+            return replace(
+                self.mix,
+                sample_rate=rate,
+                target_lufs=self.preview_lufs,
+                vocal_offset=start,
+                fade_in=0.5,
+                fade_out=1.5,
+            )
+
+        assets = await self._flights.do(
+            f"preview:{song_id}", lambda: self._render(song_id, "preview", render, settings)
+        )
+        if assets is None:
+            return None
+        master_url = f"/songs/{song_id}/master"
+        return {**assets, "song_id": song_id, "preview": True, "master_url": master_url}
+
+    async def master(self, song_id: str) -> Optional[Dict[str, Any]]:
+        """Máster completo; solo se genera cuando alguien lo pide."""
+        def render(recipe: SongRecipe) -> Tuple[np.ndarray, int]:
+            return render_master(recipe), recipe.sample_rate
+
+        def settings(recipe: SongRecipe) -> MixSettings:
+            return replace(self.mix, sample_rate=recipe.sample_rate)
+
+        assets = await self._flights.do(
+            f"master:{song_id}", lambda: self._render(song_id, "master", render, settings)
+        )
+        if assets is None:
+            return None
+        return {**assets, "song_id": song_id, "preview": False}
+
+    async def on_suno_complete(self, task: Any) -> None:
+        """Descarga el audio de una tarea de Suno terminada y calcula sus picos."""
+        stored = await self.store_url(task.audio_url)
+        waveform = await self.postprocess(stored.sha256)
+        task.assets.update(self.assets(stored.sha256, waveform))
+
+    def metrics(self) -> Dict[str, Any]:
+        return {**self.stats, "uploads": self.uploads.metrics(), "mixer": self.mixer.metrics()}
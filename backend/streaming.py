@@ -0,0 +1,117 @@
+"""
+Respuestas Server-Sent Events para texto generado token a token.
+
+Cada token se envía como evento `token` en cuanto llega; al terminar se
+envía `done` con el texto completo (o `error`). El generador solo pide el
+siguiente token cuando el anterior ya se escribió en el socket, así que un
+cliente lento frena la generación en lugar de acumular memoria, y si el
+cliente se desconecta se cierra el generador de origen (y con él la llamada
+a OpenAI o la generación local).
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Awaitable, Callable, Deque, Dict, List, Optional
+
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger("backend")
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(data: Any, event: Optional[str] = None) -> bytes:
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+class StreamStats:
+    """Tiempo hasta el primer token y resultado de los streams servidos."""
+
+    def __init__(self, window: int = 512) -> None:
+        self._ttft: Deque[float] = deque(maxlen=window)
+        self.stats = {"streams": 0, "completed": 0, "cancelled": 0, "errors": 0}
+
+    def record_ttft(self, seconds: float) -> None:
+        self._ttft.append(seconds)
+
+    def metrics(self) -> Dict[str, Any]:
+        ttft = sorted(self._ttft)
+
+        def percentile(p: float) -> Optional[float]:
+            if not ttft:
+                return None
+            return ttft[min(len(ttft) - 1, int(p * len(ttft)))] * 1000
+
+        return {**self.stats, "ttft_p50_ms": percentile(0.50), "ttft_p95_ms": percentile(0.95)}
+
+
+stream_stats = StreamStats()
+
+
+async def sse_tokens(
+    tokens: AsyncGenerator[str, None],
+    on_complete: Optional[Callable[[str], Awaitable[Dict[str, Any]]]] = None,
+    on_abort: Optional[Callable[[], Awaitable[None]]] = None,
+) -> AsyncGenerator[bytes, None]:
+    """
+    Convierte un generador de tokens en eventos SSE.
+
+    Args:
+        tokens: Generador asíncrono de fragmentos de texto
+        on_complete: Se llama con el texto completo; su resultado va en `done`
+        on_abort: Se llama si el stream falla o el cliente se desconecta
+    """
+    started = time.perf_counter()
+    ttft: Optional[float] = None
+    parts = []
+    finished = errored = False
+    stream_stats.stats["streams"] += 1
+    try:
+        async for token in tokens:
+            if ttft is None:
+                ttft = time.perf_counter() - started
+                stream_stats.record_ttft(ttft)
+            parts.append(token)
+            yield sse_event({"token": token}, "token")
+        text = "".join(parts)
+        extra = await on_complete(text) if on_complete is not None else {}
+        finished = True
+        stream_stats.stats["completed"] += 1
+        yield sse_event(
+            {"text": text, "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None, **extra},
+            "done",
+        )
+    except Exception as e:
+        logger.error(f"Error en stream de texto: {e}")
+        errored = True
+        stream_stats.stats["errors"] += 1
+        yield sse_event({"error": str(e)}, "error")
+    finally:
+        if not finished:
+            if not errored:
+                stream_stats.stats["cancelled"] += 1
+            # Cierra el origen aunque el stream se haya cortado a medias
+            cleanup: List[Awaitable[Any]] = [tokens.aclose()]
+            if on_abort is not None:
+                cleanup.append(on_abort())
+            await _run_to_end(*cleanup)
+
+
+async def _run_to_end(*coros: Awaitable[Any]) -> None:
+    """Ejecuta la limpieza aunque la tarea actual esté siendo cancelada."""
+    # shield: si llega una cancelación, la limpieza sigue en segundo plano
+    results = await asyncio.shield(asyncio.gather(*coros, return_exceptions=True))
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Error al cerrar un stream: {result}")
+
+
+def sse_response(events: AsyncGenerator[bytes, None]) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
@@ -0,0 +1,462 @@
+"""
+Cliente de la API de Suno con pool keep-alive, reintentos y circuit breaker.
+
+Las llamadas reutilizan conexiones (httpx asíncrono o `requests.Session`),
+reintentan los 429/5xx y errores de red con backoff exponencial y jitter
+respetando `Retry-After`, y un circuit breaker corta las llamadas mientras
+Suno está degradado en lugar de seguir insistiendo.
+
+Los POST (cada uno es una generación de pago) solo se reintentan cuando es
+seguro que Suno no aceptó el trabajo: fallos al conectar y respuestas 429 o
+503. Un timeout de lectura o un 500/502/504 pueden llegar con la canción ya
+encargada, así que se devuelven sin repetir la petición.
+"""
+
+import asyncio
+import email.utils
+import json
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import httpx
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("backend")
+
+# Respuestas transitorias que merece la pena reintentar
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Respuestas en las que Suno rechazó el trabajo: reintentables también en POST
+POST_RETRY_STATUSES = frozenset({429, 503})
+
+
+def _connect_failed(error: requests.RequestException) -> bool:
+    """True si la petición no llegó a enviarse porque falló la conexión."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+class SunoError(Exception):
+    """
+    Error devuelto por Suno o de transporte.
+
+    Atributos:
+        message (str): Mensaje de error
+        status_code (int): Código HTTP de Suno (504 si hubo timeout)
+    """
+
+    def __init__(self, message: str, status_code: int = 502):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class CircuitOpenError(SunoError):
+    """El circuito está abierto: se falla sin llamar a Suno."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Suno no disponible temporalmente (circuito abierto)", status_code=503)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker clásico de tres estados.
+
+    Tras `failure_threshold` llamadas fallidas seguidas se abre y rechaza
+    todo durante `reset_timeout` segundos; después pasa a semiabierto y deja
+    pasar una única llamada de prueba que decide si se cierra o se reabre.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.stats = {"rejected": 0, "opened": 0}
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def retry_after(self) -> float:
+        if self._state != self.OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+
+    def allow(self) -> bool:
+        """Indica si la llamada puede salir (en semiabierto, solo la de prueba)."""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.stats["rejected"] += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            # Falla la prueba en semiabierto, o se supera el umbral estando cerrado
+            if self._probing or (
+                self._state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self.stats["opened"] += 1
+                logger.warning(f"Circuito de Suno abierto tras {self._failures} fallos")
+            self._probing = False
+
+    def release(self) -> None:
+        """Libera la prueba en curso si la llamada se abandonó sin resultado."""
+        with self._lock:
+            self._probing = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "retry_after": round(self.retry_after(), 3),
+            **self.stats,
+        }
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Convierte `Retry-After` (segundos o fecha HTTP) en segundos de espera."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class SunoClient:
+    """
+    Cliente de Suno compartido por el proceso.
+
+    Args:
+        base_url: URL base de la API (p. ej. https://api.suno.ai/v1)
+        api_key: Token Bearer de Suno
+        timeout: Timeout de cada intento, en segundos
+        max_connections: Conexiones del pool keep-alive
+        max_retries: Reintentos tras el primer intento
+        backoff_base: Espera base del backoff exponencial, en segundos
+        backoff_max: Espera máxima entre intentos
+        max_retry_after: Si Suno pide esperar más que esto, no se reintenta
+        breaker: Circuit breaker (uno nuevo por defecto)
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        timeout: float = 30.0,
+        max_connections: int = 20,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        max_retry_after: float = 30.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.breaker = breaker or CircuitBreaker()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._session: Optional[requests.Session] = None
+        self.stats = {"requests": 0, "attempts": 0, "retries": 0, "failures": 0}
+
+    @property
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+
+    async def start(self, transport: Optional[httpx.AsyncBaseTransport] = None) -> None:
+        """Crea el cliente HTTP asíncrono (si no se llama, se crea en la primera petición)."""
+        if self._client is not None:
+            return
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self._headers,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+            timeout=self.timeout,
+            transport=transport,
+        )
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def _get_session(self) -> requests.Session:
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=self.max_connections, max_retries=0
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(self._headers)
+            self._session = session
+        return self._session
+
+    # --- Política de reintentos ---
+
+    def _delay(self, attempt: int, retry_after: Optional[float]) -> float:
+        # Backoff exponencial con "full jitter"; Retry-After marca el mínimo
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def _check(
+        self, status_code: int, body: Any, retry_after: Optional[str], idempotent: bool = True
+    ) -> Optional[float]:
+        """
+        Decide qué hacer con una respuesta.
+
+        Args:
+            idempotent: False en los POST, que solo reintentan `POST_RETRY_STATUSES`
+
+        Returns:
+            None si es correcta; segundos pedidos por Retry-After (o 0) si es reintentable
+
+        Raises:
+            SunoError: Si la respuesta es un error definitivo
+        """
+        if status_code < 400:
+            return None
+        message = self._error_message(body) or f"HTTP {status_code}"
+        if status_code not in (RETRY_STATUSES if idempotent else POST_RETRY_STATUSES):
+            raise SunoError(message, status_code=status_code)
+        wait = parse_retry_after(retry_after)
+        if wait is not None and wait > self.max_retry_after:
+            raise SunoError(f"{message} (Retry-After {wait:.0f}s)", status_code=status_code)
+        return wait if wait is not None else 0.0
+
+    @staticmethod
+    def _error_message(body: Any) -> str:
+        if isinstance(body, dict):
+            for field in ("message", "detail", "error"):
+                if body.get(field):
+                    return str(body[field])
+        return str(body) if body else ""
+
+    def _gate(self) -> None:
+        self.stats["requests"] += 1
+        if not self.breaker.allow():
+            raise CircuitOpenError(self.breaker.retry_after())
+
+    def _settle(self, error: Optional[SunoError]) -> None:
+        """Informa al breaker del resultado final (los 4xx no cuentan como caída)."""
+        if error is None or (error.status_code < 500 and error.status_code != 429):
+            self.breaker.record_success()
+        else:
+            self.stats["failures"] += 1
+            self.breaker.record_failure()
+
+    # --- Llamadas ---
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        payload: Optional[Dict[str, Any]] = None,
+        params: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """Petición asíncrona con reintentos y circuit breaker."""
+        self._gate()
+        try:
+            data = await self._request_with_retries(method, path, payload, params, timeout)
+        except SunoError as e:
+            self._settle(e)
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        self._settle(None)
+        return data
+
+    async def post(
+        self, path: str, payload: Dict[str, Any], timeout: Optional[float] = None
+    ) -> Any:
+        return await self.request("POST", path, payload, timeout=timeout)
+
+    async def _request_with_retries(
+        self,
+        method: str,
+        path: str,
+        payload: Optional[Dict[str, Any]],
+        params: Optional[Dict[str, Any]],
+        timeout: Optional[float],
+    ) -> Any:
+        if self._client is None:
+            await self.start()
+        assert self._client is not None
+        idempotent = method.upper() != "POST"
+        attempt = 0
+        while True:
+            self.stats["attempts"] += 1
+            retryable = True
+            try:
+                response = await self._client.request(
+                    method,
+                    path,
+                    json=payload,
+                    params=params,
+                    timeout=timeout if timeout is not None else self.timeout,
+                )
+                body = self._json(response.content, response.text)
+                wait = self._check(
+                    response.status_code, body, response.headers.get("retry-after"), idempotent
+                )
+                if wait is None:
+                    return body
+                error = SunoError(f"Suno respondió {response.status_code}", response.status_code)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                # La petición no llegó a salir: reintentar no duplica nada
+                wait, error = None, SunoError(f"Error de conexión con Suno: {e}", status_code=502)
+            except httpx.TimeoutException:
+                wait, error = None, SunoError("Timeout al conectar con Suno", status_code=504)
+                retryable = idempotent
+            except httpx.HTTPError as e:
+                wait, error = None, SunoError(f"Error de conexión con Suno: {e}", status_code=502)
+                retryable = idempotent
+            if not retryable or attempt >= self.max_retries:
+                raise error
+            self.stats["retries"] += 1
+            await asyncio.sleep(self._delay(attempt, wait))
+            attempt += 1
+
+    def post_sync(self, path: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+        """Versión bloqueante de `post` sobre una `requests.Session` con pool."""
+        self._gate()
+        try:
+            data = self._post_with_retries_sync(path, payload, timeout)
+        except SunoError as e:
+            self._settle(e)
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        self._settle(None)
+        return data
+
+    def _post_with_retries_sync(
+        self, path: str, payload: Dict[str, Any], timeout: Optional[float]
+    ) -> Any:
+        session = self._get_session()
+        attempt = 0
+        while True:
+            self.stats["attempts"] += 1
+            retryable = False
+            try:
+                response = session.post(
+                    f"{self.base_url}{path}",
+                    json=payload,
+                    timeout=timeout if timeout is not None else self.timeout,
+                )
+                body = self._json(response.content, response.text)
+                wait = self._check(
+                    response.status_code, body, response.headers.get("retry-after"), False
+                )
+                if wait is None:
+                    return body
+                error = SunoError(f"Suno respondió {response.status_code}", response.status_code)
+                retryable = True
+            except requests.Timeout as e:
+                wait, error = None, SunoError("Timeout al conectar con Suno", status_code=504)
+                retryable = _connect_failed(e)
+            except requests.RequestException as e:
+                wait, error = None, SunoError(f"Error de conexión con Suno: {e}", status_code=502)
+                retryable = _connect_failed(e)
+            if not retryable or attempt >= self.max_retries:
+                raise error
+            self.stats["retries"] += 1
+            time.sleep(self._delay(attempt, wait))
+            attempt += 1
+
+    @staticmethod
+    def _json(content: bytes, text: str) -> Any:
+        if not content:
+            return None
+        try:
+            return json.loads(content)
+        except ValueError:
+            return text
+
+    async def generate_song(
+        self,
+        prompt: str,
+        style: str = "pop",
+        timeout: Optional[float] = None,
+        callback_url: Optional[str] = None,
+    ) -> Any:
+        payload: Dict[str, Any] = {"prompt": prompt, "style": style}
+        if callback_url:
+            payload["callback_url"] = callback_url
+        return await self.post("/generate-song", payload, timeout)
+
+    async def get_tasks(self, task_ids: Sequence[str]) -> List[Dict[str, Any]]:
+        """Consulta en una sola petición el estado de varias generaciones."""
+        data = await self.request("GET", "/tasks", params={"ids": ",".join(task_ids)})
+        if isinstance(data, dict):
+            data = data.get("tasks", data.get("data", []))
+        return data if isinstance(data, list) else []
+
+    def generate_song_sync(
+        self, prompt: str, style: str = "pop", timeout: Optional[float] = None
+    ) -> Any:
+        return self.post_sync("/generate-song", {"prompt": prompt, "style": style}, timeout)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {**self.stats, "circuit": self.breaker.snapshot()}
@@ -0,0 +1,358 @@
+"""
+Seguimiento de generaciones de Suno de larga duración.
+
+Suno genera el audio de forma asíncrona: la petición inicial solo devuelve
+un id de tarea. En lugar de mantener una corrutina dormida por canción, un
+único bucle consulta por lotes el estado de todas las tareas pendientes con
+un intervalo que crece según la edad de cada una, y el webhook de Suno (si
+está configurado) las resuelve al instante sin esperar al siguiente sondeo.
+
+Al completarse una tarea se puede lanzar en segundo plano una etapa
+posterior (`on_complete`, p. ej. descargar el audio y calcular sus picos);
+lo que añada en `task.assets` aparece en el estado de la tarea.
+
+Las tareas viven en memoria del proceso que las lanzó. Con varios workers,
+un webhook que llega a otro worker no encuentra la tarea y se ignora; el
+sondeo del worker original la resuelve igualmente, solo que más tarde.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from backend.job_queue import JobStatus
+from backend.suno_client import SunoClient, SunoError
+
+logger = logging.getLogger("backend")
+
+# Estados de Suno que dan la tarea por terminada
+_COMPLETED = {"complete", "completed", "success", "succeeded", "done"}
+_FAILED = {"failed", "error", "canceled", "cancelled", "timeout"}
+
+
+def _field(item: Dict[str, Any], *names: str) -> Any:
+    for name in names:
+        if item.get(name):
+            return item[name]
+    return None
+
+
+@dataclass
+class SunoTask:
+    """
+    Generación de Suno en curso o terminada.
+    """
+
+    id: str
+    owner: Optional[str] = None
+    status: str = JobStatus.PENDING
+    upstream_status: Optional[str] = None
+    audio_url: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    checks: int = 0
+    next_check: float = 0.0
+    # Recursos derivados de la etapa posterior (blob de audio, forma de onda)
+    assets: Dict[str, Any] = field(default_factory=dict)
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.COMPLETED, JobStatus.FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "task_id": self.id,
+            "status": self.status,
+            "upstream_status": self.upstream_status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "checks": self.checks,
+        }
+        if self.status == JobStatus.COMPLETED:
+            data["audio_url"] = self.audio_url
+            data.update(self.assets)
+        if self.status == JobStatus.FAILED:
+            data["error"] = self.error
+        return data
+
+
+class SunoTaskTracker:
+    """
+    Registro de tareas de Suno con un sondeo compartido y adaptativo.
+
+    Args:
+        client: Cliente de Suno (reintentos y circuit breaker incluidos)
+        min_interval: Espera antes del primer sondeo de una tarea, en segundos
+        max_interval: Espera máxima entre sondeos de una misma tarea
+        backoff: Factor de crecimiento del intervalo tras cada sondeo sin cambios
+        batch_size: Tareas consultadas por petición de estado
+        task_timeout: Segundos tras los que una tarea pendiente se da por fallida
+        result_ttl: Segundos que se conservan las tareas terminadas
+        on_complete: Etapa posterior que se lanza en segundo plano al completarse una tarea
+    """
+
+    def __init__(
+        self,
+        client: SunoClient,
+        min_interval: float = 2.0,
+        max_interval: float = 30.0,
+        backoff: float = 1.5,
+        batch_size: int = 50,
+        task_timeout: float = 900.0,
+        result_ttl: float = 3600.0,
+        on_complete: Optional[Callable[[SunoTask], Awaitable[None]]] = None,
+    ):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.batch_size = max(1, batch_size)
+        self.task_timeout = task_timeout
+        self.result_ttl = result_ttl
+        self.on_complete = on_complete
+        self._postprocessing: Set["asyncio.Task[None]"] = set()
+        self._tasks: Dict[str, SunoTask] = {}
+        self._schedule: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._finished: Deque[Tuple[float, str]] = deque()
+        self._wake: Optional[asyncio.Event] = None
+        self._poller: Optional["asyncio.Task[None]"] = None
+        self.stats = {
+            "tracked": 0,
+            "completed": 0,
+            "failed": 0,
+            "polls": 0,
+            "poll_errors": 0,
+            "webhook_updates": 0,
+            "postprocessed": 0,
+            "postprocess_errors": 0,
+        }
+
+    async def start(self) -> None:
+        if self._poller is not None:
+            return
+        self._wake = asyncio.Event()
+        self._poller = asyncio.create_task(self._poll_loop(), name="suno-poller")
+
+    async def stop(self) -> None:
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+            self._poller = None
+        for job in list(self._postprocessing):
+            job.cancel()
+        await asyncio.gather(*self._postprocessing, return_exceptions=True)
+
+    def get(self, task_id: str) -> Optional[SunoTask]:
+        return self._tasks.get(task_id)
+
+    async def wait(self, task: SunoTask, timeout: Optional[float] = None) -> SunoTask:
+        """Espera a que la tarea termine (con o sin error)."""
+        await asyncio.wait_for(task.done.wait(), timeout)
+        return task
+
+    def pending(self) -> int:
+        return sum(1 for task in self._tasks.values() if not task.finished)
+
+    async def submit(
+        self,
+        prompt: str,
+        style: str = "pop",
+        owner: Optional[str] = None,
+        callback_url: Optional[str] = None,
+    ) -> SunoTask:
+        """
+        Lanza una generación en Suno y empieza a seguirla.
+
+        Raises:
+            SunoError: Si Suno rechaza la petición o no devuelve id de tarea
+        """
+        data = await self.client.generate_song(prompt, style, callback_url=callback_url)
+        item = data.get("data", data) if isinstance(data, dict) else None
+        task_id = _field(item, "task_id", "taskId", "id") if isinstance(item, dict) else None
+        if not isinstance(item, dict) or not task_id:
+            raise SunoError("Suno no devolvió un id de tarea", status_code=502)
+        task = self.track(str(task_id), owner=owner)
+        # Algunas generaciones vuelven ya resueltas (p. ej. desde caché)
+        self.update(item)
+        return task
+
+    def track(self, task_id: str, owner: Optional[str] = None) -> SunoTask:
+        """Registra una tarea ya lanzada para sondearla."""
+        task = self._tasks.get(task_id)
+        if task is not None:
+            return task
+        self._prune()
+        task = SunoTask(id=task_id, owner=owner)
+        self._tasks[task_id] = task
+        self.stats["tracked"] += 1
+        self._schedule_check(task, self.min_interval)
+        return task
+
+    def update(self, item: Dict[str, Any], from_webhook: bool = False) -> Optional[SunoTask]:
+        """
+        Aplica un estado recibido de Suno (sondeo o webhook).
+
+        Returns:
+            La tarea actualizada, o None si no se conoce
+        """
+        task_id = _field(item, "task_id", "taskId", "id")
+        task = self._tasks.get(str(task_id)) if task_id else None
+        if task is None or task.finished:
+            return task
+        if from_webhook:
+            self.stats["webhook_updates"] += 1
+        status = str(_field(item, "status", "state") or "").lower()
+        task.upstream_status = status or task.upstream_status
+        audio_url = _field(item, "audio_url", "audioUrl", "stream_audio_url")
+        if status in _COMPLETED or (audio_url and not status):
+            if audio_url:
+                self._finish(task, JobStatus.COMPLETED, audio_url=audio_url)
+            else:
+                self._finish(task, JobStatus.FAILED, error="Suno terminó sin URL de audio")
+        elif status in _FAILED:
+            error = _field(item, "error", "error_message", "errorMessage", "message")
+            self._finish(task, JobStatus.FAILED, error=str(error or f"Suno devolvió '{status}'"))
+        return task
+
+    def _finish(
+        self,
+        task: SunoTask,
+        status: str,
+        audio_url: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        task.status = status
+        task.audio_url = audio_url
+        task.error = error
+        task.finished_at = time.time()
+        self.stats["completed" if status == JobStatus.COMPLETED else "failed"] += 1
+        self._finished.append((task.finished_at, task.id))
+        task.done.set()
+        if status == JobStatus.COMPLETED and self.on_complete is not None:
+            job = asyncio.create_task(self._postprocess(task), name=f"suno-postprocess-{task.id}")
+            self._postprocessing.add(job)
+            job.add_done_callback(self._postprocessing.discard)
+
+    async def _postprocess(self, task: SunoTask) -> None:
+        assert self.on_complete is not None
+        try:
+            await self.on_complete(task)
+            self.stats["postprocessed"] += 1
+        except Exception as e:
+            self.stats["postprocess_errors"] += 1
+            logger.warning(f"Etapa posterior de la tarea de Suno {task.id} fallida: {e}")
+
+    def _schedule_check(self, task: SunoTask, delay: float) -> None:
+        task.next_check = time.monotonic() + delay
+        entry = (task.next_check, next(self._seq), task.id)
+        heapq.heappush(self._schedule, entry)
+        # Solo hace falta despertar al bucle si esta es ahora la próxima consulta
+        if self._wake is not None and self._schedule[0] is entry:
+            self._wake.set()
+
+    def _interval(self, task: SunoTask) -> float:
+        return min(self.max_interval, self.min_interval * self.backoff ** task.checks)
+
+    def _due(self, now: float) -> List[SunoTask]:
+        """Saca de la agenda las tareas cuyo sondeo ya toca."""
+        due: List[SunoTask] = []
+        while self._schedule and self._schedule[0][0] <= now:
+            check_at, _, task_id = heapq.heappop(self._schedule)
+            task = self._tasks.get(task_id)
+            # Entradas obsoletas: tarea terminada, olvidada o reprogramada
+            if task is None or task.finished or task.next_check != check_at:
+                continue
+            if time.time() - task.created_at > self.task_timeout:
+                self._finish(task, JobStatus.FAILED, error="Tiempo de espera agotado en Suno")
+                continue
+            due.append(task)
+        return due
+
+    async def poll_once(self) -> int:
+        """Consulta por lotes las tareas que tocan ahora; devuelve cuántas se consultaron."""
+        due = self._due(time.monotonic())
+        for start in range(0, len(due), self.batch_size):
+            await self._check_batch(due[start : start + self.batch_size])
+        return len(due)
+
+    async def _check_batch(self, batch: List[SunoTask]) -> None:
+        self.stats["polls"] += 1
+        try:
+            items = await self.client.get_tasks([task.id for task in batch])
+        except SunoError as e:
+            # Incluye el circuito abierto: se reintenta más tarde sin contar el sondeo
+            self.stats["poll_errors"] += 1
+            logger.warning(f"Error al consultar {len(batch)} tareas de Suno: {e.message}")
+            retry_after = self.client.breaker.retry_after()
+            for task in batch:
+                self._schedule_check(task, max(self._interval(task), retry_after))
+            return
+        for item in items:
+            if isinstance(item, dict):
+                self.update(item)
+        for task in batch:
+            if not task.finished:
+                task.checks += 1
+                self._schedule_check(task, self._interval(task))
+
+    async def _poll_loop(self) -> None:
+        assert self._wake is not None
+        while True:
+            self._wake.clear()
+            try:
+                await self.poll_once()
+            except Exception as e:
+                logger.error(f"Error en el sondeo de Suno: {e}", exc_info=True)
+            timeout = None
+            if self._schedule:
+                timeout = max(0.0, self._schedule[0][0] - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def apply_webhook(self, payload: Any) -> int:
+        """Aplica el cuerpo de un callback de Suno; devuelve las tareas que cambiaron."""
+        items: Iterable[Any]
+        if isinstance(payload, list):
+            items = payload
+        elif isinstance(payload, dict) and isinstance(payload.get("data"), list):
+            items = payload["data"]
+        elif isinstance(payload, dict):
+            items = [payload.get("data") if isinstance(payload.get("data"), dict) else payload]
+        else:
+            items = []
+        changed = 0
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            task = self._tasks.get(str(_field(item, "task_id", "taskId", "id")))
+            was_finished = task is not None and task.finished
+            task = self.update(item, from_webhook=True)
+            if task is not None and task.finished and not was_finished:
+                changed += 1
+        return changed
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "pending": self.pending(),
+            "tracked_tasks": len(self._tasks),
+            "scheduled_checks": len(self._schedule),
+            "postprocessing": len(self._postprocessing),
+        }
+
+    def _prune(self) -> None:
+        """Olvida las tareas terminadas cuyo resultado ya caducó."""
+        limit = time.time() - self.result_ttl
+        while self._finished and self._finished[0][0] < limit:
+            _, task_id = self._finished.popleft()
+            self._tasks.pop(task_id, None)
@@ -0,0 +1,156 @@
+"""
+Acceso asíncrono a Supabase (GoTrue para auth y PostgREST para tablas).
+
+Un único `httpx.AsyncClient` con pool de conexiones keep-alive se crea en el
+lifespan de la app y se comparte entre peticiones, de modo que un login no
+bloquea el event loop ni paga un handshake TCP/TLS nuevo cada vez.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Union
+
+import httpx
+
+logger = logging.getLogger("backend")
+
+Rows = Union[Dict[str, Any], List[Dict[str, Any]]]
+
+
+class SupabaseError(Exception):
+    """
+    Error devuelto por Supabase o de transporte.
+
+    Atributos:
+        message (str): Mensaje de error
+        status_code (int): Código HTTP de Supabase (504 si hubo timeout)
+    """
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class SupabaseClient:
+    """
+    Cliente asíncrono mínimo para los endpoints de Supabase que usa el backend.
+
+    Args:
+        url: URL del proyecto Supabase
+        key: API key (anon o service role)
+        timeout: Timeout por defecto de cada llamada, en segundos
+        max_connections: Conexiones simultáneas del pool
+        max_keepalive: Conexiones ociosas que se mantienen abiertas
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        timeout: float = 10.0,
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+    ):
+        self.url = url.rstrip("/")
+        self.key = key
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_keepalive
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self, transport: Optional[httpx.AsyncBaseTransport] = None) -> None:
+        """Crea el cliente HTTP compartido (llamar desde el lifespan)."""
+        if self._client is not None:
+            return
+        self._client = httpx.AsyncClient(
+            base_url=self.url,
+            headers={"apikey": self.key, "Authorization": f"Bearer {self.key}"},
+            limits=self.limits,
+            timeout=self.timeout,
+            transport=transport,
+        )
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> Any:
+        if self._client is None:
+            raise SupabaseError("Cliente de Supabase no iniciado", status_code=503)
+        try:
+            response = await self._client.request(
+                method, path, timeout=timeout if timeout is not None else self.timeout, **kwargs
+            )
+        except httpx.TimeoutException:
+            raise SupabaseError("Timeout al conectar con Supabase", status_code=504)
+        except httpx.HTTPError as e:
+            raise SupabaseError(f"Error de conexión con Supabase: {e}", status_code=502)
+        if response.status_code >= 400:
+            raise SupabaseError(self._error_message(response), status_code=response.status_code)
+        if not response.content:
+            return None
+        return response.json()
+
+    @staticmethod
+    def _error_message(response: httpx.Response) -> str:
+        try:
+            body = response.json()
+        except ValueError:
+            return response.text or f"HTTP {response.status_code}"
+        if isinstance(body, dict):
+            for field in ("msg", "message", "error_description", "error"):
+                if body.get(field):
+                    return str(body[field])
+        return str(body)
+
+    # --- Auth (GoTrue) ---
+
+    async def sign_up(
+        self, email: str, password: str, timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Registra un usuario; devuelve el usuario creado."""
+        data = await self._request(
+            "POST", "/auth/v1/signup", json={"email": email, "password": password}, timeout=timeout
+        )
+        return data.get("user", data) if isinstance(data, dict) else {}
+
+    async def sign_in_with_password(
+        self, email: str, password: str, timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Inicia sesión; devuelve la sesión con `user` y `access_token`."""
+        session: Dict[str, Any] = await self._request(
+            "POST",
+            "/auth/v1/token",
+            params={"grant_type": "password"},
+            json={"email": email, "password": password},
+            timeout=timeout,
+        )
+        return session
+
+    # --- Tablas (PostgREST) ---
+
+    async def upsert(
+        self,
+        table: str,
+        rows: Rows,
+        on_conflict: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        """Inserta o actualiza una o varias filas en una sola petición."""
+        params = {"on_conflict": on_conflict} if on_conflict else None
+        await self._request(
+            "POST",
+            f"/rest/v1/{table}",
+            json=rows,
+            params=params,
+            headers={"Prefer": "resolution=merge-duplicates,return=minimal"},
+            timeout=timeout,
+        )
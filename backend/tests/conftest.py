@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def app_storage(tmp_path, monkeypatch):
+    """Arranca la app con auditoría, caché de prompts y blobs en tmp_path y cuotas en memoria."""
+    from backend import main
+    from backend.ai_integration import get_prompt_cache
+
+    monkeypatch.setattr(main, "QUOTA_BACKEND", "memory")
+    monkeypatch.setattr(main.audit_store, "path", str(tmp_path / "audit.db"))
+    if hasattr(main.blob_store, "root"):
+        root = str(tmp_path / "blobs")
+        monkeypatch.setattr(main.blob_store, "root", root)
+        monkeypatch.setattr(main.blob_store, "tmp_dir", os.path.join(root, "tmp"))
+    cache = get_prompt_cache()
+    if cache is not None:
+        cache.close()
+        monkeypatch.setattr(cache, "path", str(tmp_path / "prompt_cache.db"))
+    yield main
+    if cache is not None:
+        cache.close()
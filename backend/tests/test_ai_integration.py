@@ -1,10 +1,11 @@
 import pytest
 from backend.ai_integration import AIIntegration
+from backend.prompt_cache import PromptCache
 
 
 @pytest.fixture
 def ai_client():
-    return AIIntegration(api_key="TEST_API_KEY")
+    return AIIntegration(api_key="TEST_API_KEY", cache=PromptCache(None))
 
 
 def test_generate_text(ai_client):
@@ -19,3 +20,124 @@ def test_generate_image(ai_client):
     result = ai_client.generate_image(description)
     assert result["success"]
     assert result["data"].startswith("http")
+
+
+def _mock_openai(monkeypatch, api_key, handler):
+    import httpx
+    from openai import AsyncOpenAI
+    from backend import ai_integration
+
+    client = AsyncOpenAI(
+        api_key=api_key,
+        base_url="http://openai.local/v1",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    monkeypatch.setitem(ai_integration._ASYNC_CLIENTS, api_key, client)
+
+
+def _completion(text):
+    return {
+        "id": "c",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-3.5-turbo",
+        "choices": [
+            {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}
+        ],
+    }
+
+
+def test_agenerate_text_respects_model_in_flight_limit(monkeypatch):
+    import asyncio
+    import httpx
+
+    state = {"in_flight": 0, "peak": 0}
+
+    async def handler(request):
+        state["in_flight"] += 1
+        state["peak"] = max(state["peak"], state["in_flight"])
+        await asyncio.sleep(0.01)
+        state["in_flight"] -= 1
+        return httpx.Response(200, json=_completion(" un poema "))
+
+    from backend import ai_integration
+
+    _mock_openai(monkeypatch, "ASYNC_KEY", handler)
+    monkeypatch.setattr(ai_integration, "_SEMAPHORES", {})
+    client = AIIntegration(
+        api_key="ASYNC_KEY", model_limits={"gpt-3.5-turbo": 2}, cache=PromptCache(None)
+    )
+    # Como main y las rutas /ai: otra instancia comparte el mismo límite
+    other = AIIntegration(api_key="ASYNC_KEY", cache=PromptCache(None))
+
+    async def scenario():
+        return await asyncio.gather(
+            *((other if i % 2 else client).agenerate_text(f"poema {i}") for i in range(6))
+        )
+
+    results = asyncio.run(scenario())
+    assert all(r == {"success": True, "data": "un poema"} for r in results)
+    assert state["peak"] == 2
+
+
+def test_agenerate_image_reports_upstream_error(monkeypatch):
+    import asyncio
+    import httpx
+
+    def handler(request):
+        return httpx.Response(400, json={"error": {"message": "prompt rechazado"}})
+
+    _mock_openai(monkeypatch, "ASYNC_KEY_IMG", handler)
+    client = AIIntegration(api_key="ASYNC_KEY_IMG", cache=PromptCache(None))
+    result = asyncio.run(client.agenerate_image("x"))
+    assert not result["success"]
+    assert "prompt rechazado" in result["error"]
+
+
+def test_agenerate_text_serves_repeats_from_cache(monkeypatch):
+    import asyncio
+    import httpx
+
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json=_completion("estrofa"))
+
+    _mock_openai(monkeypatch, "ASYNC_KEY_CACHE", handler)
+    cache = PromptCache(None)
+    client = AIIntegration(api_key="ASYNC_KEY_CACHE", cache=cache)
+
+    async def scenario():
+        first = await client.agenerate_text("Una  Estrofa")
+        again = await client.agenerate_text("una estrofa")
+        fresh = await client.agenerate_text("una estrofa", use_cache=False)
+        return first, again, fresh
+
+    first, again, fresh = asyncio.run(scenario())
+    assert first == again == fresh == {"success": True, "data": "estrofa"}
+    assert len(calls) == 2
+    assert cache.stats["memory_hits"] == 1
+    assert cache.stats["bypassed"] == 1
+
+
+def test_concurrent_identical_prompts_share_one_upstream_call(monkeypatch):
+    import asyncio
+    import httpx
+
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.02)
+        return httpx.Response(200, json=_completion("coro"))
+
+    _mock_openai(monkeypatch, "ASYNC_KEY_FLIGHT", handler)
+    client = AIIntegration(api_key="ASYNC_KEY_FLIGHT", cache=PromptCache(None))
+
+    async def scenario():
+        return await asyncio.gather(*(client.agenerate_text("Coro viral") for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert all(r == {"success": True, "data": "coro"} for r in results)
+    assert len(calls) == 1
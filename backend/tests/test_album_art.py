@@ -0,0 +1,138 @@
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from backend.album_art import VARIANT_FORMATS, AlbumArtCache, art_key, render_album_art
+from backend.media import etag_matches
+
+
+def test_key_depends_on_description_style_and_size():
+    assert art_key("Noche", "Rock", 600) == art_key("Noche", "rock ", 600)
+    assert art_key("Noche", "rock", 600) != art_key("Noche", "rock", 300)
+    assert art_key("Noche", "rock", 600) != art_key("noche", "rock", 600)
+
+
+def test_render_returns_png_of_requested_size():
+    img = Image.open(io.BytesIO(render_album_art("Una descripción larga " * 20, "jazz", 256)))
+    assert img.format == "PNG"
+    assert img.size == (256, 256)
+
+
+def test_cache_renders_once_and_evicts_by_bytes():
+    renders = []
+
+    class CountingExecutor(ThreadPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            renders.append(args)
+            return super().submit(fn, *args, **kwargs)
+
+    cache = AlbumArtCache(max_items=10, max_bytes=3000, executor=CountingExecutor(2))
+
+    async def scenario():
+        first, second = await asyncio.gather(
+            cache.get_or_render("mar", "pop", 128), cache.get_or_render("mar", "pop", 128)
+        )
+        assert first is second
+        assert await cache.get_or_render("mar", "pop", 128) is first
+        others = [await cache.get_or_render(f"otra {i}", "pop", 128) for i in range(5)]
+        assert cache.get(first.key) is None
+        again = await cache.get_by_key(first.key)
+        return first, again, others
+
+    first, again, others = asyncio.run(scenario())
+    assert again.data == first.data
+    # La expulsada vuelve desde el almacén de blobs, sin otro render
+    assert len(renders) == 6
+    assert cache.stats["stored_hits"] == 1
+    assert cache.metrics()["bytes"] <= 3000
+    assert cache.stats["evictions"] >= 1
+    assert asyncio.run(cache.get_by_key("desconocida")) is None
+
+
+def test_variants_are_generated_lazily_for_known_widths():
+    cache = AlbumArtCache(executor=ThreadPoolExecutor(1), variant_widths=(64, 128))
+
+    async def scenario():
+        base = await cache.get_or_render("Tarde de verano", "pop", 256)
+        renders = cache.stats["variant_renders"]
+        thumb = await cache.get_variant(base.key, 64, "webp")
+        again = await cache.get_variant(base.key, 64, "webp")
+        assert cache.stats["variant_renders"] == renders + 1
+        rejected = [
+            await cache.get_variant(base.key, 100, "webp"),
+            await cache.get_variant(base.key, 64, "gif"),
+            await cache.get_variant("0" * 64, 64, "png"),
+        ]
+        return base, thumb, again, rejected
+
+    base, thumb, again, rejected = asyncio.run(scenario())
+    assert thumb is again
+    assert thumb.content_type == "image/webp"
+    assert Image.open(io.BytesIO(thumb.data)).size == (64, 64)
+    assert thumb.etag != base.etag
+    assert rejected == [None, None, None]
+    urls = cache.variant_urls(base.key, 256)
+    assert list(urls) == ["64", "128", "256"]
+    assert urls["64"]["webp"] == f"/album-art/{base.key}/64.webp"
+    assert set(urls["256"]) == set(VARIANT_FORMATS)
+
+
+def test_keys_are_served_by_other_workers_and_after_restart(tmp_path):
+    from backend.blob_store import LocalBlobStore
+
+    def worker():
+        blobs = LocalBlobStore(str(tmp_path))
+        return AlbumArtCache(executor=ThreadPoolExecutor(1), variant_widths=(64,), blobs=blobs)
+
+    first, second = worker(), worker()
+
+    async def scenario():
+        base = await first.get_or_render("Faro", "rock", 128)
+        thumb = await first.get_variant(base.key, 64, "png")
+        # Otro worker (o el mismo tras reiniciar) solo conoce la clave de la URL
+        served = await second.get_by_key(base.key)
+        served_thumb = await second.get_variant(base.key, 64, "png")
+        unknown = await second.get_by_key(art_key("Faro", "rock", 256))
+        return base, thumb, served, served_thumb, unknown
+
+    base, thumb, served, served_thumb, unknown = asyncio.run(scenario())
+    assert served.data == base.data and served.etag == base.etag
+    assert served_thumb.data == thumb.data and served_thumb.key == thumb.key
+    assert second.stats["renders"] == second.stats["variant_renders"] == 0
+    assert second.stats["stored_hits"] == 2
+    assert unknown is None
+
+
+def test_etag_matching():
+    assert etag_matches('"a", W/"b"', '"b"')
+    assert etag_matches("*", '"c"')
+    assert not etag_matches(None, '"a"')
+    assert not etag_matches('"x"', '"a"')
+
+
+def test_album_art_endpoint_serves_from_memory_with_etag(app_storage, monkeypatch):
+    from backend import main
+
+    monkeypatch.setattr(main.album_art_cache, "_executor", ThreadPoolExecutor(1))
+    with TestClient(main.app) as http:
+        created = http.post(
+            "/generate-album-art", params={"description": "Luna", "style": "pop", "size": 200}
+        ).json()
+        assert created["success"]
+        response = http.get(created["imageUrl"])
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/png"
+        assert response.headers["etag"] == created["etag"]
+        assert "immutable" in response.headers["cache-control"]
+        assert Image.open(io.BytesIO(response.content)).size == (200, 200)
+        cached = http.get(created["imageUrl"], headers={"If-None-Match": created["etag"]})
+        assert cached.status_code == 304 and cached.content == b""
+        assert http.get("/album-art/" + "0" * 64 + ".png").status_code == 404
+        thumb = http.get(created["variants"]["128"]["webp"])
+        assert thumb.status_code == 200
+        assert thumb.headers["content-type"] == "image/webp"
+        assert "max-age=31536000" in thumb.headers["cache-control"]
+        assert Image.open(io.BytesIO(thumb.content)).size == (128, 128)
@@ -0,0 +1,263 @@
+import asyncio
+import sqlite3
+
+import pytest
+from backend.audit_store import AuditStore
+
+
+def test_batched_writes_persist_and_paginate(tmp_path):
+    path = str(tmp_path / "audit.db")
+
+    async def write():
+        store = AuditStore(path, batch_size=1000, flush_interval=60)
+        await store.start()
+        for i in range(5):
+            store.record_song(
+                f"u{i % 2}@example.com", f"cancion {i}", f"2026-01-0{i + 1}T00:00:00+00:00"
+            )
+        # Nada llega al disco hasta el volcado
+        assert store.pending() == 5
+        await store.stop()
+
+    async def read():
+        store = AuditStore(path)
+        await store.start()
+        first = await store.page("songs", limit=2)
+        second = await store.page("songs", cursor=first["next_cursor"], limit=2)
+        third = await store.page("songs", cursor=second["next_cursor"], limit=2)
+        ranged = await store.page(
+            "songs", since="2026-01-02T00:00:00+00:00", until="2026-01-04T00:00:00+00:00"
+        )
+        by_email = await store.page("songs", email="u1@example.com")
+        await store.stop()
+        return first, second, third, ranged, by_email
+
+    asyncio.run(write())
+    first, second, third, ranged, by_email = asyncio.run(read())
+    assert [s["title"] for s in first["items"]] == ["cancion 0", "cancion 1"]
+    assert [s["title"] for s in second["items"]] == ["cancion 2", "cancion 3"]
+    assert [s["title"] for s in third["items"]] == ["cancion 4"]
+    assert third["next_cursor"] is None
+    assert [s["title"] for s in ranged["items"]] == ["cancion 1", "cancion 2"]
+    assert [s["title"] for s in by_email["items"]] == ["cancion 1", "cancion 3"]
+
+
+def test_failed_flush_keeps_events_in_order(tmp_path, monkeypatch):
+    async def scenario():
+        store = AuditStore(str(tmp_path / "audit.db"), batch_size=1000, flush_interval=60)
+        await store.start()
+        store.record_song("a@example.com", "primera")
+        original = store._write_batch
+
+        def locked(batch):
+            store.record_song("a@example.com", "durante el fallo")
+            raise sqlite3.OperationalError("database is locked")
+
+        monkeypatch.setattr(store, "_write_batch", locked)
+        assert await store.flush() == 0
+        monkeypatch.setattr(store, "_write_batch", original)
+        assert await store.flush() == 2
+        titles = [row["title"] for row in await store.latest("songs")]
+        await store.stop()
+        return titles
+
+    assert asyncio.run(scenario()) == ["durante el fallo", "primera"]
+
+
+def test_aggregate_queries(tmp_path):
+    async def scenario():
+        store = AuditStore(str(tmp_path / "audit.db"), batch_size=2, flush_interval=60)
+        await store.start()
+        store.record_purchase("a@example.com", "paquete1")
+        store.record_purchase("b@example.com", "paquete2")
+        store.record_purchase("a@example.com", "paquete2")
+        store.record_song("c@example.com", "x")
+        result = (
+            await store.purchases_by_plan(),
+            sorted(await store.distinct_emails()),
+            await store.count("songs"),
+            [p["email"] for p in await store.latest("purchases", limit=2)],
+        )
+        await store.stop()
+        return result
+
+    by_plan, emails, songs, latest = asyncio.run(scenario())
+    assert by_plan == {"paquete1": 1, "paquete2": 2}
+    assert emails == ["a@example.com", "b@example.com", "c@example.com"]
+    assert songs == 1
+    assert latest == ["a@example.com", "b@example.com"]
+
+
+def test_open_adds_price_to_existing_purchases(tmp_path):
+    path = str(tmp_path / "audit.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE purchases (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "email TEXT NOT NULL, plan TEXT NOT NULL, timestamp TEXT NOT NULL)"
+    )
+    conn.execute(
+        "INSERT INTO purchases (email, plan, timestamp) VALUES ('a@example.com', 'paquete1', 't')"
+    )
+    conn.commit()
+    conn.close()
+
+    async def scenario():
+        store = AuditStore(path)
+        await store.start()
+        store.record_purchase("b@example.com", "paquete1", 99)
+        totals = await store.purchase_totals()
+        await store.stop()
+        return totals
+
+    assert asyncio.run(scenario()) == {"paquete1": (2, 99, 1)}
+
+
+def _aggregates():
+    from backend.aggregates import InMemorySalesAggregates, RedisSalesAggregates
+
+    factories = [InMemorySalesAggregates]
+    try:
+        import fakeredis
+
+        factories.append(
+            lambda: RedisSalesAggregates(fakeredis.FakeAsyncRedis(decode_responses=True))
+        )
+    except ImportError:
+        pass
+    return factories
+
+
+@pytest.mark.parametrize("aggregates_factory", _aggregates())
+def test_sales_aggregates_load_and_update(tmp_path, aggregates_factory):
+    planes = {"paquete1": {"precio": 149}, "paquete2": {"precio": 399}}
+
+    async def scenario():
+        store = AuditStore(str(tmp_path / "audit.db"))
+        await store.start()
+        # Compra antigua sin precio: se valora con el catálogo
+        store.record_purchase("a@example.com", "paquete1")
+        # Compra con el precio de entonces: el catálogo actual no la cambia
+        store.record_purchase("b@example.com", "paquete2", 299)
+        store.record_song("a@example.com", "x")
+        stats = aggregates_factory()
+        await stats.load(store, planes)
+        await store.stop()
+        loaded = (await stats.sales())["total_ventas"], await stats.total_songs()
+        await stats.record_purchase("c@example.com", "paquete2", 399)
+        await stats.record_song("d@example.com")
+        return loaded, await stats.sales(), await stats.total_songs(), await stats.active_users()
+
+    loaded, sales, songs, users = asyncio.run(scenario())
+    assert loaded == (448, 1)
+    assert sales == {
+        "total_ventas": 847,
+        "ventas_por_plan": {"paquete1": 149, "paquete2": 698},
+        "compras_por_plan": {"paquete1": 1, "paquete2": 2},
+        "total_compras": 3,
+    }
+    assert songs == 2
+    assert users == {"a@example.com", "b@example.com", "c@example.com", "d@example.com"}
+
+
+def test_redis_sales_aggregates_are_shared_between_workers(tmp_path):
+    fakeredis = pytest.importorskip("fakeredis")
+    from backend.aggregates import RedisSalesAggregates
+
+    server = fakeredis.FakeServer()
+
+    def worker():
+        return RedisSalesAggregates(fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+
+    async def scenario():
+        store = AuditStore(str(tmp_path / "audit.db"))
+        await store.start()
+        store.record_purchase("a@example.com", "paquete1", 149)
+        first, second = worker(), worker()
+        await first.load(store, {})
+        await first.record_song("a@example.com")
+        # El segundo worker arranca después y no vuelve a cargar la auditoría
+        await second.load(store, {})
+        await second.record_purchase("b@example.com", "paquete2", 399)
+        await store.stop()
+        return await first.sales(), await first.total_songs(), await second.active_users()
+
+    sales, songs, users = asyncio.run(scenario())
+    assert sales["total_ventas"] == 548
+    assert sales["total_compras"] == 2
+    assert songs == 1
+    assert users == {"a@example.com", "b@example.com"}
+
+
+def test_redis_sales_aggregates_concurrent_loads_publish_once(tmp_path):
+    fakeredis = pytest.importorskip("fakeredis")
+    from backend.aggregates import RedisSalesAggregates
+
+    server = fakeredis.FakeServer()
+
+    def worker():
+        return RedisSalesAggregates(fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+
+    async def scenario():
+        store = AuditStore(str(tmp_path / "audit.db"))
+        await store.start()
+        store.record_purchase("a@example.com", "paquete1", 149)
+        store.record_song("a@example.com", "x")
+        first, second = worker(), worker()
+        await asyncio.gather(first.load(store, {}), second.load(store, {}))
+        await store.stop()
+        client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        # Solo quedan los contadores publicados, sin copias temporales ni caducidad
+        keys = sorted(await client.keys("*"))
+        ttls = {await client.ttl(key) for key in keys}
+        return await first.sales(), await second.total_songs(), keys, ttls
+
+    sales, songs, keys, ttls = asyncio.run(scenario())
+    assert sales["total_ventas"] == 149 and sales["total_compras"] == 1
+    assert songs == 1
+    assert keys == [
+        "sales:loaded", "sales:purchases_by_plan", "sales:revenue_by_plan", "sales:totals",
+        "sales:users",
+    ]
+    assert ttls == {-1}
+
+
+def test_redis_sales_aggregates_keep_events_recorded_during_load(tmp_path):
+    fakeredis = pytest.importorskip("fakeredis")
+    from backend.aggregates import RedisSalesAggregates
+
+    server = fakeredis.FakeServer()
+
+    def worker():
+        return RedisSalesAggregates(fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+
+    async def scenario():
+        store = AuditStore(str(tmp_path / "audit.db"))
+        await store.start()
+        loading, other = worker(), worker()
+        # Anotado antes de la carga: ya entra en la instantánea y no se suma dos veces
+        store.record_purchase("a@example.com", "paquete1", 149)
+        await other.record_purchase("a@example.com", "paquete1", 149)
+        snapshot = loading._snapshot
+
+        async def snapshot_then_record(*args):
+            result = await snapshot(*args)
+            # Otro worker registra entre la instantánea y la publicación
+            await other.record_purchase("b@example.com", "paquete2", 399)
+            await other.record_song("c@example.com")
+            return result
+
+        loading._snapshot = snapshot_then_record
+        await loading.load(store, {})
+        await other.record_song("c@example.com")
+        await store.stop()
+        client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        pending = await client.keys("sales:pending:*")
+        sales = await loading.sales()
+        return sales, await loading.total_songs(), await other.active_users(), pending
+
+    sales, songs, users, pending = asyncio.run(scenario())
+    assert sales["ventas_por_plan"] == {"paquete1": 149, "paquete2": 399}
+    assert sales["total_compras"] == 2
+    assert songs == 2
+    assert users == {"a@example.com", "b@example.com", "c@example.com"}
+    assert pending == []
@@ -0,0 +1,77 @@
+import time
+
+import jwt
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from backend import auth
+from backend.auth import Principal, TokenCache, create_jwt_token, get_current_user, require_admin
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(auth, "token_cache", TokenCache(max_size=8))
+    app = FastAPI()
+
+    @app.get("/me")
+    async def me(principal: Principal = Depends(get_current_user)):
+        return {"email": principal.email, "role": principal.role}
+
+    @app.get("/admin")
+    async def admin(principal: Principal = Depends(require_admin)):
+        return {"email": principal.email}
+
+    return TestClient(app)
+
+
+def _headers(**claims):
+    return {"Authorization": f"Bearer {create_jwt_token(claims)}"}
+
+
+def test_token_decoded_once_then_served_from_cache(client, monkeypatch):
+    calls = []
+    original = auth.verify_jwt_token
+    monkeypatch.setattr(auth, "verify_jwt_token", lambda t: calls.append(t) or original(t))
+    headers = _headers(sub="a@example.com")
+    for _ in range(3):
+        response = client.get("/me", headers=headers)
+        assert response.json() == {"email": "a@example.com", "role": "user"}
+    assert len(calls) == 1
+    assert auth.token_cache.stats()["hits"] == 2
+
+
+def test_admin_dependency_checks_role(client):
+    assert client.get("/admin", headers=_headers(sub="u@example.com")).status_code == 403
+    response = client.get("/admin", headers=_headers(sub="admin@example.com", role="admin"))
+    assert response.json() == {"email": "admin@example.com"}
+
+
+def test_invalid_token_rejected(client):
+    response = client.get("/me", headers={"Authorization": "Bearer no-es-un-jwt"})
+    assert response.status_code == 401
+
+
+def test_cache_evicts_expired_and_least_recent():
+    cache = TokenCache(max_size=2)
+    now = time.time()
+    cache.put("caducado", Principal("a@example.com", "user", now - 1))
+    assert cache.get("caducado") is None
+    assert len(cache) == 0
+    cache.put("t1", Principal("1@example.com", "user", now + 60))
+    cache.put("t2", Principal("2@example.com", "user", now + 60))
+    cache.get("t1")
+    cache.put("t3", Principal("3@example.com", "user", now + 60))
+    assert cache.get("t2") is None
+    assert cache.get("t1") is not None
+
+
+def test_token_without_exp_is_accepted_with_bounded_cache_ttl(client, monkeypatch):
+    monkeypatch.setattr(auth, "token_cache", TokenCache(max_size=8, ttl=0.05))
+    token = jwt.encode({"sub": "viejo@example.com"}, auth.JWT_SECRET, algorithm=auth.JWT_ALGORITHM)
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/me", headers=headers).json() == {
+        "email": "viejo@example.com", "role": "user"
+    }
+    assert auth.token_cache.get(token) is not None
+    time.sleep(0.06)
+    assert auth.token_cache.get(token) is None
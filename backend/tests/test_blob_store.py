@@ -0,0 +1,172 @@
+import asyncio
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.blob_store import InMemoryBlobStore, LocalBlobStore, create_blob_store
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=["local", "memory"])
+def store_and_clock(request, tmp_path):
+    clock = Clock()
+    if request.param == "local":
+        store = LocalBlobStore(str(tmp_path), max_bytes=3000, clock=clock)
+    else:
+        store = InMemoryBlobStore(max_bytes=3000, clock=clock)
+    asyncio.run(store.start())
+    yield store, clock
+    asyncio.run(store.close())
+
+
+def test_put_deduplicates_and_reads_back(store_and_clock):
+    store, _ = store_and_clock
+    data = os.urandom(1000)
+
+    async def scenario():
+        first = await store.put(data, "audio/mpeg")
+        second = await store.put(data, "audio/mpeg")
+        return first, second
+
+    (meta, duplicate), (again, duplicate_again) = asyncio.run(scenario())
+    assert (duplicate, duplicate_again) == (False, True)
+    assert meta.sha256 == again.sha256 and meta.size == 1000
+    with store.open(meta.sha256) as buffer:
+        assert buffer[:] == data
+    assert store.metrics()["bytes"] == 1000
+
+
+def test_budget_evicts_least_recently_used_but_never_pinned(store_and_clock):
+    store, clock = store_and_clock
+    blobs = [os.urandom(1000) for _ in range(4)]
+
+    async def scenario():
+        pinned, _ = await store.put(blobs[0], "audio/wav", pin=True)
+        clock.now += 100
+        old, _ = await store.put(blobs[1], "audio/wav")
+        clock.now += 100
+        recent, _ = await store.put(blobs[2], "audio/wav")
+        clock.now += 100
+        newest, _ = await store.put(blobs[3], "audio/wav")
+        return [await store.get(m.sha256) for m in (pinned, old, recent, newest)]
+
+    pinned, old, recent, newest = asyncio.run(scenario())
+    assert old is None
+    assert pinned is not None and pinned.pinned
+    assert recent is not None and newest is not None
+    assert store.metrics()["evictions"] == 1
+    assert store.metrics()["bytes"] == 3000
+
+
+def test_ttl_expires_unpinned_blobs(store_and_clock):
+    store, clock = store_and_clock
+
+    async def scenario():
+        short, _ = await store.put(b"corto", "text/plain", ttl=10)
+        kept, _ = await store.put(b"fijado", "text/plain", ttl=10, pin=True)
+        clock.now += 11
+        missing = await store.get(short.sha256)
+        freed = await store.evict()
+        return missing, freed, await store.get(kept.sha256)
+
+    missing, freed, kept = asyncio.run(scenario())
+    assert missing is None
+    assert freed == len(b"corto")
+    assert kept is not None
+
+
+def test_local_index_survives_restart(tmp_path):
+    data = os.urandom(2048)
+
+    async def write():
+        store = LocalBlobStore(str(tmp_path))
+        await store.start()
+        meta, _ = await store.put(data, "audio/flac")
+        await store.close()
+        return meta
+
+    async def reopen(sha256):
+        store = create_blob_store("local", str(tmp_path), 2**20)
+        await store.start()
+        meta = await store.get(sha256)
+        metrics = store.metrics()
+        await store.close()
+        return meta, metrics
+
+    written = asyncio.run(write())
+    meta, metrics = asyncio.run(reopen(written.sha256))
+    assert meta is not None and meta.content_type == "audio/flac"
+    assert metrics["bytes"] == 2048
+    assert (tmp_path / "objects" / written.sha256[:2] / written.sha256).read_bytes() == data
+    with pytest.raises(ValueError):
+        create_blob_store("s3", str(tmp_path), 1)
+
+
+def test_blob_endpoint_serves_immutable_content(tmp_path, app_storage, monkeypatch):
+    from backend import main
+
+    for store in (LocalBlobStore(str(tmp_path)), InMemoryBlobStore()):
+        monkeypatch.setattr(main, "blob_store", store)
+        data = os.urandom(5000)
+        with TestClient(main.app) as http:
+            meta, _ = asyncio.run(store.put(data, "audio/ogg"))
+            response = http.get(f"/blobs/{meta.sha256}")
+            assert response.status_code == 200
+            assert response.content == data
+            assert response.headers["etag"] == f'"{meta.sha256}"'
+            assert "immutable" in response.headers["cache-control"]
+            etag = {"If-None-Match": f'"{meta.sha256}"'}
+            cached = http.get(f"/blobs/{meta.sha256}", headers=etag)
+            assert cached.status_code == 304
+            assert http.get("/blobs/" + "0" * 64).status_code == 404
+
+
+def test_owners_are_recorded_and_dropped_with_the_blob(store_and_clock):
+    store, _ = store_and_clock
+
+    async def scenario():
+        meta, _ = await store.put(b"voz", "audio/wav")
+        assert not await store.add_owner("0" * 64, "a@example.com")
+        assert await store.add_owner(meta.sha256, "a@example.com")
+        assert await store.add_owner(meta.sha256, "b@example.com")
+        assert await store.add_owner(meta.sha256, "a@example.com")
+        owners = await store.owners(meta.sha256)
+        await store.delete(meta.sha256)
+        await store.put(b"voz", "audio/wav")
+        return owners, await store.owners(meta.sha256)
+
+    owners, after_delete = asyncio.run(scenario())
+    assert owners == {"a@example.com", "b@example.com"}
+    assert after_delete == set()
+
+
+def test_blob_endpoint_keeps_private_blobs_to_their_owners(app_storage, monkeypatch):
+    from backend import main
+    from backend.auth import create_jwt_token
+
+    store = InMemoryBlobStore()
+    monkeypatch.setattr(main, "blob_store", store)
+
+    def auth(email, role="user"):
+        return {"Authorization": f"Bearer {create_jwt_token({'sub': email, 'role': role})}"}
+
+    with TestClient(main.app) as http:
+        voice, _ = asyncio.run(store.put(b"RIFF voz", "audio/wav"))
+        asyncio.run(store.add_owner(voice.sha256, "a@example.com"))
+        recipe, _ = asyncio.run(store.put(b'{"owner": "a@example.com"}', "application/json"))
+        for sha256 in (voice.sha256, recipe.sha256):
+            assert http.get(f"/blobs/{sha256}").status_code == 404
+            assert http.get(f"/blobs/{sha256}", headers=auth("b@example.com")).status_code == 404
+        response = http.get(f"/blobs/{voice.sha256}", headers=auth("a@example.com"))
+        assert response.status_code == 200 and response.content == b"RIFF voz"
+        assert response.headers["cache-control"].startswith("private")
+        admin = http.get(f"/blobs/{recipe.sha256}", headers=auth("root@example.com", "admin"))
+        assert admin.status_code == 200
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+from backend.job_queue import JobStatus, QueueFullError, SongJobQueue
+
+
+async def _echo(payload):
+    await asyncio.sleep(0.01)
+    if payload.get("fail"):
+        raise ValueError("fallo simulado")
+    return {"success": True, "title": payload["title"]}
+
+
+def test_job_completes_and_exposes_result():
+    async def scenario():
+        queue = SongJobQueue(_echo, concurrency=2, max_queue_size=10)
+        await queue.start()
+        job = queue.submit("a@example.com", {"title": "Mi Corrido"})
+        assert queue.get(job.id) is job
+        await queue.wait(job, timeout=1)
+        await queue.stop()
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.status == JobStatus.COMPLETED
+    assert job.to_dict()["result"] == {"success": True, "title": "Mi Corrido"}
+
+
+def test_failed_job_records_error():
+    async def scenario():
+        queue = SongJobQueue(_echo, concurrency=1)
+        await queue.start()
+        job = queue.submit("a@example.com", {"title": "x", "fail": True})
+        await queue.wait(job, timeout=1)
+        metrics = queue.metrics()
+        await queue.stop()
+        return job, metrics
+
+    job, metrics = asyncio.run(scenario())
+    assert job.status == JobStatus.FAILED
+    assert job.error == "fallo simulado"
+    assert metrics["failed"] == 1
+
+
+def test_bounded_queue_rejects_when_full():
+    async def scenario():
+        queue = SongJobQueue(_echo, concurrency=1, max_queue_size=2)
+        await queue.start()
+        jobs = [queue.submit("a@example.com", {"title": str(i)}) for i in range(2)]
+        with pytest.raises(QueueFullError):
+            queue.submit("a@example.com", {"title": "extra"})
+        depth = queue.metrics()["queue_depth"]
+        await asyncio.gather(*(queue.wait(j, timeout=1) for j in jobs))
+        metrics = queue.metrics()
+        await queue.stop()
+        return depth, metrics
+
+    depth, metrics = asyncio.run(scenario())
+    assert depth == 2
+    assert metrics["rejected"] == 1
+    assert metrics["completed"] == 2
+    assert metrics["queue_depth"] == 0
+
+
+def test_stop_hands_pending_jobs_to_discard_handler():
+    discarded = []
+
+    async def slow(payload):
+        await asyncio.sleep(10)
+
+    async def discard(payload):
+        discarded.append(payload["title"])
+
+    async def scenario():
+        queue = SongJobQueue(slow, concurrency=1, on_discard=discard)
+        await queue.start()
+        jobs = [queue.submit("a@example.com", {"title": str(i)}) for i in range(3)]
+        await asyncio.sleep(0.01)
+        await queue.stop()
+        return jobs
+
+    jobs = asyncio.run(scenario())
+    # El primero estaba en curso (lo cancela su propio handler); los otros se descartan
+    assert discarded == ["1", "2"]
+    assert all(job.status == JobStatus.FAILED and job.done.is_set() for job in jobs)
@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend.local_ai import ENGINES, LocalTextModel, MicroBatcher, _conv1d_to_linear
+
+
+def _fake_factory(loads):
+    def factory(task, model):
+        loads.append((task, model))
+        time.sleep(0.05)
+
+        def pipe(prompt, **kwargs):
+            return [{"generated_text": f"{prompt} [{threading.current_thread().name}]"}]
+
+        return pipe
+
+    return factory
+
+
+def test_model_loads_once_and_runs_off_the_event_loop():
+    loads = []
+    model = LocalTextModel("gpt2", factory=_fake_factory(loads))
+
+    async def scenario():
+        return await asyncio.gather(
+            *(model.generate(f"verso {i}", max_length=20) for i in range(4))
+        )
+
+    results = asyncio.run(scenario())
+    model.shutdown()
+    assert loads == [("text-generation", "gpt2")]
+    assert all("[local-ai" in r[0]["generated_text"] for r in results)
+    metrics = model.metrics()
+    assert metrics["loaded"] and metrics["calls"] == 4 and metrics["errors"] == 0
+    assert metrics["load_seconds"] >= 0.05
+    assert metrics["rss_bytes"] > 0
+    assert metrics["latency_p50"] is not None
+
+
+def test_preload_and_errors_are_counted():
+    loads = []
+
+    def factory(task, model):
+        loads.append(model)
+
+        def pipe(prompt, **kwargs):
+            raise ValueError("entrada inválida")
+
+        return pipe
+
+    model = LocalTextModel("distilgpt2", factory=factory)
+
+    async def scenario():
+        await model.aload()
+        assert model.loaded
+        try:
+            await model.generate("x")
+        except ValueError:
+            return True
+        return False
+
+    assert asyncio.run(scenario())
+    model.shutdown()
+    assert loads == ["distilgpt2"]
+    assert model.stats == {
+        "calls": 1, "errors": 1, "prompts": 1, "streams_cancelled": 0, "streams_stalled": 0
+    }
+
+
+def _batch_model(calls):
+    def factory(task, model):
+        def pipe(prompts, **kwargs):
+            calls.append((list(prompts), kwargs))
+            if "falla" in prompts:
+                raise RuntimeError("sin memoria")
+            return [[{"generated_text": p.upper()}] for p in prompts]
+
+        return pipe
+
+    return LocalTextModel("gpt2", factory=factory)
+
+
+def test_micro_batcher_groups_concurrent_prompts():
+    calls = []
+    model = _batch_model(calls)
+    batcher = MicroBatcher(model, max_batch=4, max_wait_ms=20)
+
+    async def scenario():
+        results = await asyncio.gather(
+            *(batcher.submit(f"p{i}", max_length=50) for i in range(10)),
+            batcher.submit("largo", max_length=200),
+        )
+        await batcher.stop()
+        return results
+
+    results = asyncio.run(scenario())
+    model.shutdown()
+    assert [r[0]["generated_text"] for r in results] == [f"P{i}" for i in range(10)] + ["LARGO"]
+    sizes = sorted(len(prompts) for prompts, _ in calls)
+    assert sizes == [1, 2, 4, 4]
+    assert all(kwargs["batch_size"] == len(prompts) for prompts, kwargs in calls)
+    assert ["largo"] in [prompts for prompts, _ in calls]
+    assert batcher.metrics()["batches"] == 4
+
+
+def test_micro_batcher_skips_cancelled_and_scatters_errors():
+    calls = []
+    model = _batch_model(calls)
+    batcher = MicroBatcher(model, max_batch=8, max_wait_ms=20)
+
+    async def scenario():
+        gone = asyncio.create_task(batcher.submit("se va"))
+        failing = [asyncio.create_task(batcher.submit(p)) for p in ("falla", "otro")]
+        await asyncio.sleep(0)
+        gone.cancel()
+        results = await asyncio.gather(*failing, return_exceptions=True)
+        await batcher.stop()
+        return results
+
+    results = asyncio.run(scenario())
+    model.shutdown()
+    assert calls[0][0] == ["falla", "otro"]
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_engine_is_selected_by_name():
+    assert LocalTextModel("gpt2", engine="int8")._factory is ENGINES["int8"]
+    assert LocalTextModel("gpt2", engine="onnx").metrics()["engine"] == "onnx"
+    with pytest.raises(ValueError):
+        LocalTextModel("gpt2", engine="tensorrt")
+
+
+def test_conv1d_layers_become_equivalent_linear_layers():
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+
+    config = transformers.GPT2Config(n_layer=1, n_embd=16, n_head=2, vocab_size=50, n_positions=32)
+    model = transformers.GPT2LMHeadModel(config).eval()
+    ids = torch.tensor([[1, 2, 3, 4]])
+    with torch.no_grad():
+        expected = model(ids).logits
+        assert _conv1d_to_linear(model) == 4
+        assert isinstance(model.transformer.h[0].attn.c_attn, torch.nn.Linear)
+        assert torch.allclose(model(ids).logits, expected, atol=1e-5)
@@ -0,0 +1,96 @@
+import asyncio
+import os
+
+from fastapi.testclient import TestClient
+
+from backend.media import MediaFileResponse, resolve_media_path
+
+
+def _audio(tmp_path, size=100_000):
+    data = os.urandom(size)
+    (tmp_path / "cancion.mp3").write_bytes(data)
+    return data
+
+
+def test_resolve_media_path_stays_inside_root(tmp_path):
+    _audio(tmp_path)
+    expected = os.path.realpath(tmp_path / "cancion.mp3")
+    assert resolve_media_path(str(tmp_path), "cancion.mp3") == expected
+    assert resolve_media_path(str(tmp_path), "../cancion.mp3") is None
+    assert resolve_media_path(str(tmp_path), "nada.mp3") is None
+
+
+def test_audio_endpoint_supports_ranges_and_conditional_requests(
+    tmp_path, app_storage, monkeypatch
+):
+    from backend import main
+
+    data = _audio(tmp_path)
+    monkeypatch.setattr(main, "MEDIA_AUDIO_DIR", str(tmp_path))
+    with TestClient(main.app) as http:
+        full = http.get("/audio/cancion.mp3")
+        assert full.status_code == 200
+        assert full.content == data
+        assert full.headers["content-type"] == "audio/mpeg"
+        assert full.headers["accept-ranges"] == "bytes"
+        etag = full.headers["etag"]
+
+        part = http.get("/audio/cancion.mp3", headers={"Range": "bytes=1000-1999"})
+        assert part.status_code == 206
+        assert part.headers["content-range"] == f"bytes 1000-1999/{len(data)}"
+        assert part.content == data[1000:2000]
+
+        tail = http.get("/audio/cancion.mp3", headers={"Range": "bytes=-500"})
+        assert tail.content == data[-500:]
+
+        unsatisfiable = http.get("/audio/cancion.mp3", headers={"Range": f"bytes={len(data) + 1}-"})
+        assert unsatisfiable.status_code == 416
+
+        cached = http.get("/audio/cancion.mp3", headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        assert cached.headers["etag"] == etag
+
+        head = http.head("/audio/cancion.mp3")
+        assert head.headers["content-length"] == str(len(data))
+        assert http.get("/audio/..%2Fsecreto.mp3").status_code == 404
+
+        monkeypatch.setattr(main, "MEDIA_ACCEL_REDIRECT", "/_media/audio/")
+        offloaded = http.get("/audio/cancion.mp3")
+        assert offloaded.headers["x-accel-redirect"] == "/_media/audio/cancion.mp3"
+        assert offloaded.content == b""
+
+
+def test_zerocopy_extension_is_used_when_offered(tmp_path):
+    data = _audio(tmp_path, 4096)
+    path = str(tmp_path / "cancion.mp3")
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.zerocopy":
+            file = message["file"]
+            file.seek(message["offset"])
+            message = {**message, "data": file.read(message["count"])}
+        sent.append(message)
+
+    def scope(headers):
+        return {
+            "type": "http",
+            "method": "GET",
+            "headers": headers,
+            "extensions": {"http.response.zerocopy": {}},
+            "asgi": {"spec_version": "2.4"},
+        }
+
+    asyncio.run(MediaFileResponse(path)(scope([(b"range", b"bytes=100-199")]), receive, send))
+    assert sent[0]["status"] == 206
+    assert sent[1]["type"] == "http.response.zerocopy"
+    assert (sent[1]["offset"], sent[1]["count"]) == (100, 100)
+    assert sent[1]["data"] == data[100:200]
+
+    sent.clear()
+    asyncio.run(MediaFileResponse(path)(scope([]), receive, send))
+    assert sent[0]["status"] == 200 and sent[1]["data"] == data
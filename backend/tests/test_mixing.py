@@ -0,0 +1,125 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.audio import decode_wav, encode_wav, integrated_loudness, render_song
+from backend.blob_store import InMemoryBlobStore
+from backend.mixing import ArraySource, Limiter, MixSettings, Mixer, ResampledSource, mix_files
+from backend.song_audio import SongAudio
+
+
+def _sine(frequency, seconds, rate, amplitude=0.5):
+    t = np.arange(int(seconds * rate)) / rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32)[:, None]
+
+
+def test_resampler_is_accurate_and_independent_of_block_size():
+    source = ResampledSource(ArraySource(_sine(1000, 1.0, 48000, amplitude=1.0), 48000), 44100)
+    assert source.frames == 44100
+    whole = source.read(0, 44100)
+    reference = np.sin(2 * np.pi * 1000 * np.arange(44100) / 44100)
+    # Lejos de los bordes (donde la entrada se rellena con ceros) el error es mínimo
+    assert np.abs(whole[100:-100, 0] - reference[100:-100]).max() < 1e-4
+    blocks = np.concatenate([source.read(start, 1000) for start in range(0, 44100, 1000)])
+    np.testing.assert_array_equal(blocks[:44100], whole)
+
+
+def test_limiter_respects_ceiling_and_block_size():
+    rng = np.random.default_rng(1)
+    signal = (rng.standard_normal((30000, 2)) * 0.6).astype(np.float32)
+    ceiling = 10 ** (-1 / 20)
+
+    whole = Limiter(8000, 2)
+    out = np.concatenate([whole.process(signal), whole.flush()])
+    chunked = Limiter(8000, 2)
+    pieces = [chunked.process(signal[i : i + 777]) for i in range(0, len(signal), 777)]
+    out_chunked = np.concatenate(pieces + [chunked.flush()])
+
+    assert out.shape == signal.shape
+    assert np.abs(out).max() <= ceiling + 1e-6
+    np.testing.assert_allclose(out_chunked, out, atol=1e-6)
+    # Por debajo del techo la señal pasa intacta
+    quiet = Limiter(8000, 1)
+    tone = _sine(440, 1.0, 8000, amplitude=0.5)
+    np.testing.assert_array_equal(np.concatenate([quiet.process(tone), quiet.flush()]), tone)
+
+
+def test_mix_files_resamples_vocal_and_hits_target_loudness(tmp_path):
+    vocal_path, instrumental_path, out_path = (
+        str(tmp_path / name) for name in ("v.wav", "i.wav", "o.wav")
+    )
+    with open(vocal_path, "wb") as f:
+        f.write(encode_wav(_sine(330, 6.0, 16000, amplitude=0.2), 16000))
+    with open(instrumental_path, "wb") as f:
+        f.write(encode_wav(render_song("Faro", "rock", 5.0, 22050), 22050))
+
+    settings = MixSettings(sample_rate=22050, target_lufs=-18, block_size=4096)
+    report = mix_files(vocal_path, instrumental_path, out_path, settings)
+
+    with open(out_path, "rb") as f:
+        samples, rate = decode_wav(f.read())
+    assert rate == 22050 and samples.shape == (5 * 22050, 2)
+    assert report["output_lufs"] == pytest.approx(integrated_loudness(samples, rate), abs=0.05)
+    assert report["output_lufs"] == pytest.approx(-18, abs=0.5)
+    assert report["vocal_gain_db"] - report["instrumental_gain_db"] == pytest.approx(
+        report["instrumental_lufs"] + settings.vocal_level_db - report["vocal_lufs"], abs=0.02
+    )
+    assert np.abs(samples).max() <= 10 ** (-1 / 20) + 1e-4
+
+
+def test_create_song_with_cloned_voice_mixes_vocal(app_storage, monkeypatch):
+    from backend import main
+    from backend.auth import create_jwt_token
+
+    blobs = InMemoryBlobStore()
+    audio = SongAudio(
+        blobs,
+        preview_seconds=2,
+        preview_sample_rate=8000,
+        preview_lufs=-20,
+        mixer=Mixer(executor=ThreadPoolExecutor(1)),
+    )
+    monkeypatch.setattr(main, "blob_store", blobs)
+    monkeypatch.setattr(main, "song_audio", audio)
+    monkeypatch.setattr(main, "LOCAL_SONG_SECONDS", 6.0)
+    token = create_jwt_token({"sub": "voz@example.com", "role": "user"})
+    auth = {"Authorization": f"Bearer {token}"}
+    form = {"title": "Eco", "description": "voz propia", "genre": "pop"}
+
+    with TestClient(main.app) as http:
+        wav = encode_wav(_sine(220, 8.0, 16000, amplitude=0.3), 16000)
+        vocal, _ = asyncio.run(blobs.put(wav, "audio/wav"))
+        asyncio.run(blobs.add_owner(vocal.sha256, "voz@example.com"))
+        # Muestra de otro usuario y blob propio que no es audio
+        foreign, _ = asyncio.run(blobs.put(wav + b"\0", "audio/wav"))
+        asyncio.run(blobs.add_owner(foreign.sha256, "otro@example.com"))
+        recipe, _ = asyncio.run(blobs.put(b"{}", "application/json"))
+        asyncio.run(blobs.add_owner(recipe.sha256, "voz@example.com"))
+        asyncio.run(main.quota_ledger.assign("voz@example.com", "basico", 1))
+        for sample_id in ("0" * 64, foreign.sha256, recipe.sha256):
+            rejected = http.post(
+                "/create-song",
+                params={"wait": True},
+                json={**form, "voice_sample_id": sample_id},
+                headers=auth,
+            )
+            assert rejected.status_code == 404
+        assert not asyncio.run(blobs.get(foreign.sha256)).pinned
+        song = http.post(
+            "/create-song",
+            params={"wait": True, "preview": True},
+            json={**form, "voice_sample_id": vocal.sha256},
+            headers=auth,
+        ).json()
+        assert song["preview"] is True and song["duration"] == 2.0
+        master = http.post(song["master_url"], headers=auth).json()
+
+    assert master["duration"] == 6.0
+    assert audio.mixer.stats["mixes"] == 2
+    assert (asyncio.run(blobs.get(vocal.sha256))).pinned
+    with blobs.open(song["audio_blob"]) as data:
+        samples, rate = decode_wav(data)
+    assert rate == 8000 and integrated_loudness(samples, rate) == pytest.approx(-20, abs=0.5)
@@ -0,0 +1,60 @@
+import gc
+import os
+import sys
+
+import pytest
+
+from backend.local_ai import LocalTextModel, process_memory
+from backend.prefork import PreforkServer, preload, touch_weights
+
+
+class _Pipe:
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, prompt, **kwargs):
+        return [{"generated_text": prompt}]
+
+
+def test_touch_weights_reads_every_float_tensor():
+    torch = pytest.importorskip("torch")
+
+    module = torch.nn.Sequential(torch.nn.Linear(64, 32), torch.nn.LayerNorm(32))
+    expected = sum(t.numel() * 4 for t in [*module.parameters(), *module.buffers()])
+    assert touch_weights(_Pipe(module)) == expected
+    assert touch_weights(lambda prompt: prompt) == 0
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="usa /proc y fork")
+def test_preloaded_model_is_shared_with_forked_workers():
+    torch = pytest.importorskip("torch")
+
+    model = LocalTextModel("fake", factory=lambda task, name: _Pipe(torch.nn.Linear(2048, 2048)))
+    try:
+        preload(model)
+        weights = 2048 * 2048 * 4
+        ready_r, ready_w = os.pipe()
+        done_r, done_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # El worker usa el modelo ya cargado sin copiarlo
+            model.load()("hola")
+            os.write(ready_w, b"x")
+            os.read(done_r, 1)
+            os._exit(0)
+        os.read(ready_r, 1)
+        child = process_memory(pid)
+        os.write(done_w, b"x")
+        os.waitpid(pid, 0)
+    finally:
+        gc.unfreeze()
+    assert model.loaded
+    assert child["uss_bytes"] < weights
+    assert child["rss_bytes"] > weights
+
+
+def test_server_defaults_to_at_least_one_worker():
+    model = LocalTextModel("fake", factory=lambda t, n: _Pipe(None))
+    server = PreforkServer(workers=0, model=model)
+    assert server.workers == 1
+    assert server.memory() == {}
@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+from backend.prompt_cache import PromptCache, cache_key
+
+
+def test_cache_key_normalizes_prompt_but_not_params():
+    a = cache_key("text", "gpt-3.5-turbo", "  Hola\tMundo ", max_tokens=100)
+    b = cache_key("text", "gpt-3.5-turbo", "hola mundo", max_tokens=100)
+    assert a == b
+    assert a != cache_key("text", "gpt-3.5-turbo", "hola mundo", max_tokens=50)
+    assert a != cache_key("text", "gpt-4", "hola mundo", max_tokens=100)
+
+
+def test_disk_tier_survives_new_instance(tmp_path):
+    path = str(tmp_path / "cache.db")
+    first = PromptCache(path)
+    asyncio.run(first.set("k", {"success": True, "data": "letra"}))
+    first.close()
+
+    second = PromptCache(path)
+    assert asyncio.run(second.get("k")) == {"success": True, "data": "letra"}
+    assert asyncio.run(second.get("k")) == {"success": True, "data": "letra"}
+    assert second.stats["disk_hits"] == 1
+    assert second.stats["memory_hits"] == 1
+    second.close()
+
+
+def test_entries_expire_after_ttl(tmp_path):
+    cache = PromptCache(str(tmp_path / "cache.db"))
+    cache.set_sync("k", "v", ttl=0.05)
+    assert cache.get_sync("k") == "v"
+    time.sleep(0.06)
+    assert cache.get_sync("k") is None
+    assert cache.stats["misses"] == 1
+    cache.close()
+
+
+def test_disk_evicts_least_recently_used_over_budget(tmp_path):
+    cache = PromptCache(str(tmp_path / "cache.db"), memory_size=1, disk_max_bytes=25)
+    cache.set_sync("a", "x" * 8)
+    cache.set_sync("b", "y" * 8)
+    time.sleep(0.01)
+    assert cache.get_sync("a") == "x" * 8  # desde disco: refresca su último acceso
+    cache.set_sync("c", "z" * 8)
+    assert cache.metrics()["disk_bytes"] <= 25
+    assert cache.stats["evictions"] == 1
+    assert cache.get_sync("b") is None
+    assert cache.get_sync("a") == "x" * 8
+    cache.close()
+
+
+def test_disk_budget_is_shared_between_processes(tmp_path):
+    # Dos instancias sobre el mismo fichero hacen de dos workers
+    path = str(tmp_path / "cache.db")
+    first = PromptCache(path, memory_size=1, disk_max_bytes=25)
+    second = PromptCache(path, memory_size=1, disk_max_bytes=25)
+    first.set_sync("a", "x" * 8)
+    time.sleep(0.01)
+    second.set_sync("b", "y" * 8)
+    time.sleep(0.01)
+    first.set_sync("c", "z" * 8)
+    assert first.metrics()["disk_bytes"] == second.metrics()["disk_bytes"] <= 25
+    assert first.stats["evictions"] == 1
+    assert second.get_sync("a") is None
+    first.close()
+    second.close()
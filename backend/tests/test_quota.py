@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+from backend.quota import InMemoryQuotaLedger, RedisQuotaLedger, new_reservation_id
+
+
+def _ledgers():
+    ledgers = [InMemoryQuotaLedger]
+    try:
+        import fakeredis
+        from redis.exceptions import ResponseError
+    except ImportError:
+        return ledgers
+    try:
+        # Los scripts Lua del libro solo corren en fakeredis con `lupa` instalado
+        fakeredis.FakeRedis().script_load("return 1")
+    except ResponseError:
+        return ledgers
+    ledgers.append(
+        lambda: RedisQuotaLedger(fakeredis.FakeAsyncRedis(decode_responses=True))
+    )
+    return ledgers
+
+
+@pytest.fixture(params=_ledgers())
+def ledger_factory(request):
+    return request.param
+
+
+def test_reserve_commit_refund(ledger_factory):
+    async def scenario():
+        ledger = ledger_factory()
+        await ledger.assign("a@example.com", "paquete2", 2)
+        first, second, third = (new_reservation_id() for _ in range(3))
+        assert await ledger.reserve("a@example.com", first) == 1
+        assert await ledger.reserve("a@example.com", second) == 0
+        assert await ledger.reserve("a@example.com", third) is None
+        assert await ledger.commit("a@example.com", first)
+        assert await ledger.refund("a@example.com", second) == 1
+        # Operaciones repetidas sobre la misma reserva no cambian el saldo
+        assert await ledger.refund("a@example.com", second) is None
+        assert await ledger.refund("a@example.com", first) is None
+        return await ledger.get("a@example.com")
+
+    assert asyncio.run(scenario()) == {"plan": "paquete2", "canciones_restantes": 1}
+
+
+def test_concurrent_reservations_never_oversell(ledger_factory):
+    async def scenario():
+        ledger = ledger_factory()
+        await ledger.assign("a@example.com", "paquete2", 3)
+        results = await asyncio.gather(
+            *(ledger.reserve("a@example.com", new_reservation_id()) for _ in range(20))
+        )
+        return [r for r in results if r is not None], await ledger.get("a@example.com")
+
+    granted, user = asyncio.run(scenario())
+    assert sorted(granted) == [0, 1, 2]
+    assert user["canciones_restantes"] == 0
+
+
+def test_unknown_user_has_no_quota(ledger_factory):
+    async def scenario():
+        ledger = ledger_factory()
+        return await ledger.get("nadie@example.com"), await ledger.reserve(
+            "nadie@example.com", new_reservation_id()
+        )
+
+    user, reserved = asyncio.run(scenario())
+    assert user == {"plan": None, "canciones_restantes": 0}
+    assert reserved is None
+
+
+def test_assign_discounts_open_reservations(ledger_factory):
+    async def scenario():
+        ledger = ledger_factory()
+        await ledger.assign("a@example.com", "paquete1", 1)
+        pending = new_reservation_id()
+        await ledger.reserve("a@example.com", pending)
+        # Compra nueva con la generación anterior aún en curso
+        available = await ledger.assign("a@example.com", "paquete2", 3)
+        await ledger.refund("a@example.com", pending)
+        return available, await ledger.get("a@example.com")
+
+    available, user = asyncio.run(scenario())
+    assert available == 2
+    assert user["canciones_restantes"] == 3
+
+
+def test_reap_refunds_only_stale_reservations(ledger_factory):
+    async def scenario():
+        ledger = ledger_factory()
+        await ledger.assign("a@example.com", "paquete2", 3)
+        stale, fresh = new_reservation_id(), new_reservation_id()
+        await ledger.reserve("a@example.com", stale)
+        await asyncio.sleep(0.05)
+        await ledger.reserve("a@example.com", fresh)
+        reaped = await ledger.reap(max_age=0.03)
+        remaining = await ledger.get("a@example.com")
+        return reaped, remaining, await ledger.commit("a@example.com", fresh)
+
+    reaped, user, committed = asyncio.run(scenario())
+    assert reaped == 1
+    assert user["canciones_restantes"] == 2
+    assert committed
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from backend.single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"data": "ok"}
+
+    async def scenario():
+        results = await asyncio.gather(*(flights.do("k", fetch) for _ in range(4)))
+        # Terminada la llamada, la siguiente petición vuelve a salir
+        await flights.do("k", fetch)
+        return results
+
+    results = asyncio.run(scenario())
+    assert results == [{"data": "ok"}] * 4
+    assert len(calls) == 2
+    assert flights.metrics() == {"leaders": 2, "shared": 3, "cancelled": 0, "in_flight": 0}
+
+
+def test_errors_reach_every_waiter():
+    flights = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream caído")
+
+    async def scenario():
+        return await asyncio.gather(
+            *(flights.do("k", fetch) for _ in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_cancelled_waiter_does_not_cancel_the_others():
+    flights = SingleFlight()
+    started = []
+
+    async def fetch():
+        started.append(1)
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def scenario():
+        leaver = asyncio.create_task(flights.do("k", fetch))
+        stayer = asyncio.create_task(flights.do("k", fetch))
+        await asyncio.sleep(0.01)
+        leaver.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leaver
+        return await stayer
+
+    assert asyncio.run(scenario()) == "ok"
+    assert len(started) == 1
+    assert flights.stats["cancelled"] == 0
+
+
+def test_last_waiter_leaving_cancels_the_call():
+    flights = SingleFlight()
+    state = {"cancelled": False, "calls": 0}
+
+    async def fetch():
+        state["calls"] += 1
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+        return "tarde"
+
+    async def quick():
+        state["calls"] += 1
+        return "nuevo"
+
+    async def scenario():
+        waiters = [asyncio.create_task(flights.do("k", fetch)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        # Una petición posterior no se engancha a la llamada abortada
+        result = await flights.do("k", quick)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(scenario()) == "nuevo"
+    assert state["cancelled"]
+    assert state["calls"] == 2
+    assert flights.stats["cancelled"] == 1
@@ -0,0 +1,180 @@
+import asyncio
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.audio import decode_wav, integrated_loudness, normalize_loudness
+from backend.blob_store import InMemoryBlobStore
+from backend.song_audio import SongAudio, SongRecipe
+
+
+def _sine(amplitude, seconds=5.0, rate=48000, channels=1):
+    t = np.arange(int(seconds * rate)) / rate
+    tone = (amplitude * np.sin(2 * np.pi * 1000 * t)).astype(np.float32)
+    return np.repeat(tone[:, None], channels, axis=1)
+
+
+def test_integrated_loudness_follows_bs1770_reference_tone():
+    # Seno de 1 kHz a -20 dBFS de pico en un canal: -23 LUFS
+    # (la ponderación K suma ~0,69 dB a 1 kHz)
+    assert integrated_loudness(_sine(0.1), 48000) == pytest.approx(-23.0, abs=0.05)
+    assert integrated_loudness(_sine(0.1, channels=2), 48000) == pytest.approx(-20.0, abs=0.05)
+    # La puerta relativa ignora el silencio (solo cuentan los bloques de la frontera)
+    with_silence = np.concatenate([_sine(0.1), np.zeros((48000 * 5, 1), dtype=np.float32)])
+    assert integrated_loudness(with_silence, 48000) == pytest.approx(-23.0, abs=0.2)
+
+    louder = normalize_loudness(_sine(0.1, rate=22050), 22050, target_lufs=-16)
+    assert integrated_loudness(louder, 22050) == pytest.approx(-16.0, abs=0.05)
+    # El techo de pico manda sobre el objetivo
+    capped = normalize_loudness(_sine(0.1), 48000, target_lufs=0, peak_ceiling_db=-1)
+    assert np.abs(capped).max() == pytest.approx(10 ** (-1 / 20), rel=1e-4)
+
+
+def test_preview_is_rendered_once_and_master_only_on_demand():
+    blobs = InMemoryBlobStore()
+    audio = SongAudio(
+        blobs,
+        samples_per_peak=256,
+        levels=2,
+        preview_seconds=3,
+        preview_sample_rate=8000,
+        preview_lufs=-20,
+    )
+
+    async def scenario():
+        song_id = await audio.register(SongRecipe("Brisa", "pop", seconds=10))
+        first = await audio.preview(song_id)
+        again = await audio.preview(song_id)
+        stored_before_master = audio.stats["stored"]
+        master = await audio.master(song_id)
+        master_again = await audio.master(song_id)
+        return song_id, first, again, stored_before_master, master, master_again
+
+    song_id, first, again, stored_before_master, master, master_again = asyncio.run(scenario())
+    assert first == again and first["preview"] is True
+    assert first["master_url"] == f"/songs/{song_id}/master"
+    assert stored_before_master == 1
+    assert audio.stats["previews"] == 1 and audio.stats["preview_hits"] == 1
+    with blobs.open(first["audio_blob"]) as data:
+        samples, rate = decode_wav(data)
+    assert rate == 8000 and len(samples) == 3 * 8000
+    assert integrated_loudness(samples, rate) == pytest.approx(-20.0, abs=0.1)
+    assert master["duration"] == 10.0 and master == master_again
+    assert audio.stats["masters"] == 1 and audio.stats["master_hits"] == 1
+
+
+def test_evicted_preview_is_regenerated():
+    blobs = InMemoryBlobStore()
+    audio = SongAudio(blobs, preview_seconds=2, preview_sample_rate=8000)
+
+    async def scenario():
+        song_id = await audio.register(SongRecipe("Niebla", seconds=4))
+        first = await audio.preview(song_id)
+        await blobs.delete(first["audio_blob"])
+        second = await audio.preview(song_id)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first["audio_blob"] == second["audio_blob"]
+    assert audio.stats["previews"] == 2
+
+
+def test_recipe_ignores_blobs_that_are_not_recipes():
+    blobs = InMemoryBlobStore()
+    audio = SongAudio(blobs)
+
+    async def scenario():
+        wav, _ = await blobs.put(b"RIFF\x00\xff", "audio/wav")
+        garbage, _ = await blobs.put(b"\xff{no es json", "application/json")
+        foreign, _ = await blobs.put(b'{"otro": 1}', "application/json")
+        song_id = await audio.register(SongRecipe("Brisa", owner="a@example.com"))
+        rejected = [await audio.recipe(m.sha256) for m in (wav, garbage, foreign)]
+        return rejected, await audio.recipe(song_id)
+
+    rejected, recipe = asyncio.run(scenario())
+    assert rejected == [None, None, None]
+    assert recipe.owner == "a@example.com"
+
+
+def test_register_pins_only_the_owners_audio_samples():
+    blobs = InMemoryBlobStore()
+    audio = SongAudio(blobs)
+
+    async def scenario():
+        voice, _ = await blobs.put(b"RIFF voz", "audio/wav")
+        await blobs.add_owner(voice.sha256, "a@example.com")
+        other = SongRecipe("Brisa", vocal=voice.sha256, owner="b@example.com")
+        with pytest.raises(KeyError):
+            await audio.register(other)
+        recipe_id = await audio.register(SongRecipe("Brisa", owner="a@example.com"))
+        # Una receta propia no es una muestra de voz: no se fija como tal
+        with pytest.raises(KeyError):
+            await audio.register(SongRecipe("Eco", vocal=recipe_id, owner="a@example.com"))
+        assert not (await blobs.get(voice.sha256)).pinned
+        await audio.register(SongRecipe("Brisa", vocal=voice.sha256, owner="a@example.com"))
+        return (await blobs.get(voice.sha256)).pinned, await blobs.owners(recipe_id)
+
+    assert asyncio.run(scenario()) == (True, {"a@example.com"})
+
+
+def test_create_song_in_preview_mode_defers_master(app_storage, monkeypatch):
+    from backend import main
+    from backend.auth import create_jwt_token
+
+    blobs = InMemoryBlobStore()
+    audio = SongAudio(blobs, preview_seconds=2, preview_sample_rate=8000)
+    monkeypatch.setattr(main, "blob_store", blobs)
+    monkeypatch.setattr(main, "song_audio", audio)
+    monkeypatch.setattr(main, "LOCAL_SONG_SECONDS", 6.0)
+    token = create_jwt_token({"sub": "previa@example.com", "role": "user"})
+    auth = {"Authorization": f"Bearer {token}"}
+
+    with TestClient(main.app) as http:
+        asyncio.run(main.quota_ledger.assign("previa@example.com", "basico", 1))
+        song = http.post(
+            "/create-song",
+            params={"wait": True, "preview": True},
+            json={"title": "Lluvia", "description": "tarde gris", "genre": "jazz"},
+            headers=auth,
+        ).json()
+        assert song["preview"] is True and song["duration"] == 2.0
+        assert audio.stats["masters"] == 0
+        # Otro usuario con la URL (el id se puede adivinar) no obtiene el máster
+        intruder = create_jwt_token({"sub": "otro@example.com", "role": "user"})
+        other = {"Authorization": f"Bearer {intruder}"}
+        assert http.post(song["master_url"], headers=other).status_code == 404
+        assert audio.stats["masters"] == 0
+        master = http.post(song["master_url"], headers=auth).json()
+        assert master["duration"] == 6.0 and master["audio"] != song["audio"]
+        assert http.post("/songs/" + "0" * 64 + "/master", headers=auth).status_code == 404
+        # El sha de un audio no es una receta
+        assert http.post(f"/songs/{song['audio_blob']}/master", headers=auth).status_code == 404
+
+
+def test_failed_generation_is_not_counted_as_song(app_storage, monkeypatch):
+    from backend import main
+    from backend.auth import create_jwt_token
+
+    async def broken_register(recipe):
+        raise RuntimeError("render caído")
+
+    blobs = InMemoryBlobStore()
+    audio = SongAudio(blobs, preview_seconds=2, preview_sample_rate=8000)
+    monkeypatch.setattr(audio, "register", broken_register)
+    monkeypatch.setattr(main, "blob_store", blobs)
+    monkeypatch.setattr(main, "song_audio", audio)
+    token = create_jwt_token({"sub": "fallo@example.com", "role": "user"})
+
+    with TestClient(main.app) as http:
+        asyncio.run(main.quota_ledger.assign("fallo@example.com", "basico", 1))
+        before = asyncio.run(main.sales_stats.total_songs())
+        response = http.post(
+            "/create-song",
+            params={"wait": True},
+            json={"title": "Eco", "description": "nada", "genre": "pop"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 500
+        assert asyncio.run(main.sales_stats.total_songs()) == before
+        assert asyncio.run(main.quota_ledger.get("fallo@example.com"))["canciones_restantes"] == 1
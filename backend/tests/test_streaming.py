@@ -0,0 +1,203 @@
+import asyncio
+import json
+import time
+
+import httpx
+from fastapi.testclient import TestClient
+
+import pytest
+
+from backend.local_ai import LocalTextModel, StreamStalled
+from backend.streaming import sse_tokens
+
+
+def _events(raw: bytes):
+    events = []
+    for block in raw.decode().strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines.get("event"), json.loads(lines["data"])))
+    return events
+
+
+async def _collect(agen, limit=None):
+    out = []
+    async for item in agen:
+        out.append(item)
+        if limit is not None and len(out) >= limit:
+            await agen.aclose()
+            break
+    return out
+
+
+def test_sse_tokens_completes_and_reports_ttft():
+    async def tokens():
+        for t in ("Hola", " mundo"):
+            yield t
+
+    async def complete(text):
+        return {"palabras": len(text.split())}
+
+    events = _events(b"".join(asyncio.run(_collect(sse_tokens(tokens(), on_complete=complete)))))
+    assert events[:2] == [("token", {"token": "Hola"}), ("token", {"token": " mundo"})]
+    name, done = events[2]
+    assert name == "done" and done["text"] == "Hola mundo" and done["palabras"] == 2
+    assert done["ttft_ms"] is not None
+
+
+def test_disconnect_closes_source_and_aborts():
+    state = {"closed": False, "aborted": False}
+
+    async def tokens():
+        try:
+            for i in range(100):
+                yield f"t{i}"
+        finally:
+            state["closed"] = True
+
+    async def abort():
+        state["aborted"] = True
+
+    asyncio.run(_collect(sse_tokens(tokens(), on_abort=abort), limit=2))
+    assert state == {"closed": True, "aborted": True}
+
+
+def test_errors_are_sent_as_event_and_abort():
+    aborted = []
+
+    async def tokens():
+        yield "a"
+        raise RuntimeError("cuota de OpenAI agotada")
+
+    async def abort():
+        aborted.append(True)
+
+    events = _events(b"".join(asyncio.run(_collect(sse_tokens(tokens(), on_abort=abort)))))
+    assert events[-1] == ("error", {"error": "cuota de OpenAI agotada"})
+    assert aborted == [True]
+
+
+class _FakeTokenizer:
+    def __call__(self, prompt, return_tensors=None):
+        return {"input_ids": [ord(c) for c in prompt]}
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(chr(i) for i in ids)
+
+
+class _FakeModel:
+    def __init__(self):
+        self.emitted = 0
+
+    def generate(self, input_ids, streamer, max_new_tokens):
+        streamer.put(input_ids)
+        for c in ("la" * max_new_tokens)[:max_new_tokens]:
+            time.sleep(0.001)
+            streamer.put([ord(c)])
+            self.emitted += 1
+        streamer.end()
+
+
+class _FakePipe:
+    def __init__(self):
+        self.tokenizer = _FakeTokenizer()
+        self.model = _FakeModel()
+
+    def __call__(self, prompt, **kwargs):
+        return [prompt]
+
+
+def test_stalled_local_stream_is_cut_and_frees_inference():
+    pipe = _FakePipe()
+    model = LocalTextModel("gpt2", factory=lambda task, name: pipe, stall_timeout=0.2)
+
+    async def scenario():
+        stream = model.stream("prompt", max_new_tokens=500)
+        first = await stream.__anext__()
+        # El cliente no lee: /generate-text no espera al stream
+        started = time.perf_counter()
+        assert await model.generate("otro") == ["otro"]
+        generate_seconds = time.perf_counter() - started
+        await asyncio.sleep(0.5)
+        with pytest.raises(StreamStalled):
+            async for _ in stream:
+                pass
+        return first, generate_seconds
+
+    first, generate_seconds = asyncio.run(scenario())
+    model.shutdown()
+    assert first == "l"
+    assert generate_seconds < 0.2
+    assert pipe.model.emitted < 100
+    assert model.stats["streams_stalled"] == 1 and model.stats["streams_cancelled"] == 0
+
+
+def test_local_stream_yields_tokens_and_stops_on_disconnect():
+    pipe = _FakePipe()
+    model = LocalTextModel("gpt2", factory=lambda task, name: pipe)
+
+    async def scenario():
+        full = await _collect(model.stream("prompt", max_new_tokens=6))
+        partial = await _collect(model.stream("prompt", max_new_tokens=500), limit=3)
+        await asyncio.sleep(0.3)
+        return full, partial
+
+    full, partial = asyncio.run(scenario())
+    model.shutdown()
+    assert "".join(full) == "lalala"
+    assert len(partial) == 3
+    # La segunda generación se cortó poco después de la desconexión (cola acotada)
+    assert pipe.model.emitted < 6 + 100
+    assert model.stats["streams_cancelled"] == 1
+
+
+def _openai_stream(request):
+    chunks = []
+    for text in ("En ", "la ", "orilla"):
+        chunk = {
+            "id": "c",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "gpt-3.5-turbo",
+            "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}],
+        }
+        chunks.append(f"data: {json.dumps(chunk)}\n\n")
+    chunks.append("data: [DONE]\n\n")
+    return httpx.Response(
+        200, headers={"content-type": "text/event-stream"}, content="".join(chunks).encode()
+    )
+
+
+def test_create_song_stream_commits_quota_on_completion(app_storage, monkeypatch):
+    from openai import AsyncOpenAI
+
+    from backend import ai_integration, main
+    from backend.auth import create_jwt_token
+
+    client = AsyncOpenAI(
+        api_key=main.OPENAI_API_KEY,
+        base_url="http://openai.local/v1",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(_openai_stream)),
+    )
+    monkeypatch.setitem(ai_integration._ASYNC_CLIENTS, main.OPENAI_API_KEY, client)
+    monkeypatch.setattr(main.ai_client, "cache", None)
+    token = create_jwt_token({"sub": "stream@example.com", "role": "user"})
+
+    with TestClient(main.app) as http:
+        asyncio.run(main.quota_ledger.assign("stream@example.com", "basico", 1))
+        response = http.post(
+            "/create-song/stream",
+            json={"title": "Mar", "description": "la orilla", "genre": "pop"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = _events(response.content)
+        assert [e for e in events if e[0] == "token"][0] == ("token", {"token": "En "})
+        assert events[-1][0] == "done"
+        assert events[-1][1]["lyrics"] == "En la orilla"
+        assert events[-1][1]["canciones_restantes"] == 0
+        again = http.post(
+            "/create-song/stream",
+            json={"title": "Mar", "description": "la orilla", "genre": "pop"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert again.status_code == 402
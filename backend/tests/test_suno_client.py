@@ -0,0 +1,222 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from backend.suno_client import CircuitBreaker, CircuitOpenError, SunoClient, SunoError
+
+
+class FakeSuno:
+    """Servidor Suno local que responde según un guion de (status, headers, body)."""
+
+    def __init__(self):
+        self.script = []
+        self.requests = []
+        self.connections = set()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length))
+                fake.requests.append(
+                    {"path": self.path, "auth": self.headers["Authorization"], "body": body}
+                )
+                fake.connections.add(self.client_address)
+                status, headers, reply = (
+                    fake.script.pop(0) if fake.script else (200, {}, {"id": "song-1"})
+                )
+                payload = json.dumps(reply).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def fake_suno():
+    server = FakeSuno()
+    yield server
+    server.close()
+
+
+def _client(url, **kwargs):
+    kwargs.setdefault("backoff_base", 0.001)
+    return SunoClient(url, "suno-key", timeout=2, **kwargs)
+
+
+def test_sync_retries_transient_errors_over_one_connection(fake_suno):
+    fake_suno.script = [(503, {}, {"error": "ocupado"}), (429, {}, {})]
+    client = _client(fake_suno.url)
+    assert client.generate_song_sync("letra", "rock") == {"id": "song-1"}
+    assert client.generate_song_sync("otra") == {"id": "song-1"}
+    assert len(fake_suno.requests) == 4
+    assert fake_suno.requests[0] == {
+        "path": "/v1/generate-song",
+        "auth": "Bearer suno-key",
+        "body": {"prompt": "letra", "style": "rock"},
+    }
+    assert len(fake_suno.connections) == 1
+    assert client.stats["retries"] == 2
+    asyncio.run(client.aclose())
+
+
+def test_async_honors_retry_after(fake_suno):
+    fake_suno.script = [(429, {"Retry-After": "0.2"}, {"message": "despacio"})]
+    client = _client(fake_suno.url)
+
+    async def scenario():
+        started = time.monotonic()
+        data = await client.generate_song("letra")
+        elapsed = time.monotonic() - started
+        await client.aclose()
+        return data, elapsed
+
+    data, elapsed = asyncio.run(scenario())
+    assert data == {"id": "song-1"}
+    assert elapsed >= 0.2
+
+
+def test_client_errors_and_long_retry_after_are_not_retried(fake_suno):
+    fake_suno.script = [
+        (400, {}, {"message": "prompt inválido"}),
+        (503, {"Retry-After": "120"}, {}),
+    ]
+    client = _client(fake_suno.url, max_retry_after=5)
+    with pytest.raises(SunoError) as bad_request:
+        client.generate_song_sync("x")
+    assert bad_request.value.status_code == 400
+    assert bad_request.value.message == "prompt inválido"
+    with pytest.raises(SunoError) as busy:
+        client.generate_song_sync("x")
+    assert busy.value.status_code == 503
+    assert len(fake_suno.requests) == 2
+    assert client.breaker.state == CircuitBreaker.CLOSED
+    asyncio.run(client.aclose())
+
+
+def test_post_is_not_repeated_when_suno_may_have_accepted_it(fake_suno):
+    # Un 502 o un timeout de lectura pueden llegar con la generación ya encargada
+    fake_suno.script = [(502, {}, {}), (502, {}, {})]
+    client = _client(fake_suno.url)
+    with pytest.raises(SunoError) as sync_error:
+        client.generate_song_sync("x")
+
+    async def scenario():
+        with pytest.raises(SunoError) as async_error:
+            await client.generate_song("x")
+        await client.aclose()
+        return async_error.value
+
+    assert sync_error.value.status_code == asyncio.run(scenario()).status_code == 502
+    assert len(fake_suno.requests) == 2
+
+    def slow(request):
+        raise httpx.ReadTimeout("sin respuesta", request=request)
+
+    async def timed_out():
+        slow_client = _client("http://suno.test")
+        await slow_client.start(transport=httpx.MockTransport(slow))
+        with pytest.raises(SunoError) as error:
+            await slow_client.generate_song("x")
+        await slow_client.aclose()
+        return error.value.status_code, slow_client.stats["attempts"]
+
+    assert asyncio.run(timed_out()) == (504, 1)
+
+
+def test_connect_errors_are_retried_for_posts():
+    calls = []
+
+    def flaky(request):
+        calls.append(request.method)
+        if len(calls) == 1:
+            raise httpx.ConnectError("rechazada", request=request)
+        return httpx.Response(200, json={"id": "song-2"})
+
+    async def scenario():
+        client = _client("http://suno.test")
+        await client.start(transport=httpx.MockTransport(flaky))
+        data = await client.generate_song("x")
+        await client.aclose()
+        return data
+
+    assert asyncio.run(scenario()) == {"id": "song-2"}
+    assert calls == ["POST", "POST"]
+
+
+def test_breaker_opens_fails_fast_and_recovers_after_probe(fake_suno):
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+    client = _client(fake_suno.url, max_retries=0, breaker=breaker)
+    fake_suno.script = [(500, {}, {}), (500, {}, {})]
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(SunoError):
+                await client.generate_song("x")
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError) as rejected:
+            await client.generate_song("x")
+        assert rejected.value.retry_after == 10
+        assert len(fake_suno.requests) == 2
+
+        now[0] = 11
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert await client.generate_song("x") == {"id": "song-1"}
+        assert breaker.state == CircuitBreaker.CLOSED
+        await client.aclose()
+
+    asyncio.run(scenario())
+    assert client.metrics()["circuit"]["opened"] == 1
+    assert client.metrics()["circuit"]["rejected"] == 1
+
+
+def test_failed_probe_reopens_and_only_one_probe_runs():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=5, clock=lambda: now[0])
+    breaker.record_failure()
+    now[0] = 6
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_after() == 5
+
+
+def test_ai_integration_generate_song_suno(fake_suno, monkeypatch):
+    from backend import ai_integration
+
+    monkeypatch.setattr(ai_integration, "_SUNO_CLIENTS", {})
+    monkeypatch.setenv("SUNO_API_URL", fake_suno.url)
+    monkeypatch.setenv("SUNO_API_KEY", "suno-key")
+    client = ai_integration.AIIntegration(api_key="k")
+    fake_suno.script = [(503, {"Retry-After": "0"}, {})]
+    assert client.generate_song_suno("balada") == {"success": True, "data": {"id": "song-1"}}
+
+    async def scenario():
+        result = await client.agenerate_song_suno("balada")
+        await ai_integration.close_async_clients()
+        return result
+
+    assert asyncio.run(scenario()) == {"success": True, "data": {"id": "song-1"}}
@@ -0,0 +1,134 @@
+import asyncio
+import json
+
+import httpx
+
+from backend.job_queue import JobStatus
+from backend.suno_client import SunoClient
+from backend.suno_tasks import SunoTaskTracker
+
+
+class FakeSunoApi:
+    """Suno simulado: cada tarea se completa tras `ready_after` consultas de estado."""
+
+    def __init__(self, ready_after=1, fail_polls=0):
+        self.ready_after = ready_after
+        self.fail_polls = fail_polls
+        self.polls = []
+        self.seen = {}
+        self.created = 0
+
+    def __call__(self, request):
+        if request.url.path == "/v1/generate-song":
+            self.created += 1
+            body = json.loads(request.content)
+            task = {"taskId": f"t{self.created}", "status": "PENDING", "prompt": body["prompt"]}
+            return httpx.Response(200, json={"data": task})
+        if request.url.path == "/v1/tasks":
+            ids = request.url.params["ids"].split(",")
+            self.polls.append(ids)
+            if self.fail_polls:
+                self.fail_polls -= 1
+                return httpx.Response(503)
+            tasks = []
+            for task_id in ids:
+                self.seen[task_id] = self.seen.get(task_id, 0) + 1
+                if task_id == "boom":
+                    tasks.append({"id": task_id, "status": "FAILED", "errorMessage": "censurado"})
+                elif self.seen[task_id] >= self.ready_after:
+                    url = f"https://cdn/{task_id}.mp3"
+                    tasks.append({"id": task_id, "status": "SUCCESS", "audio_url": url})
+                else:
+                    tasks.append({"id": task_id, "status": "PENDING"})
+            return httpx.Response(200, json={"tasks": tasks})
+        return httpx.Response(404)
+
+
+async def _tracker(api, **kwargs):
+    client = SunoClient("http://suno.local/v1", "k", max_retries=0)
+    await client.start(transport=httpx.MockTransport(api))
+    kwargs.setdefault("min_interval", 0)
+    return SunoTaskTracker(client, **kwargs)
+
+
+def test_poll_once_checks_due_tasks_in_batches():
+    api = FakeSunoApi(ready_after=2)
+
+    async def scenario():
+        tracker = await _tracker(api, batch_size=2, max_interval=0)
+        tasks = [await tracker.submit(f"letra {i}", owner="a@example.com") for i in range(3)]
+        tracker.track("boom")
+        assert await tracker.poll_once() == 4
+        assert [task.status for task in tasks] == [JobStatus.PENDING] * 3
+        assert tracker.get("boom").error == "censurado"
+        assert await tracker.poll_once() == 3
+        return tracker, tasks
+
+    tracker, tasks = asyncio.run(scenario())
+    assert api.polls == [["t1", "t2"], ["t3", "boom"], ["t1", "t2"], ["t3"]]
+    assert [task.audio_url for task in tasks] == [f"https://cdn/t{i}.mp3" for i in (1, 2, 3)]
+    assert all(task.done.is_set() for task in tasks)
+    assert tracker.metrics()["pending"] == 0
+
+
+def test_interval_grows_and_poll_errors_reschedule():
+    api = FakeSunoApi(ready_after=99, fail_polls=1)
+
+    async def scenario():
+        tracker = await _tracker(api, min_interval=0.01, max_interval=0.04, backoff=2)
+        task = await tracker.submit("letra")
+        await asyncio.sleep(0.02)
+        await tracker.poll_once()
+        assert task.checks == 0
+        intervals = []
+        for _ in range(3):
+            await asyncio.sleep(tracker._interval(task) + 0.005)
+            await tracker.poll_once()
+            intervals.append(tracker._interval(task))
+        return tracker, task, intervals
+
+    tracker, task, intervals = asyncio.run(scenario())
+    assert tracker.stats["poll_errors"] == 1
+    assert task.checks == 3
+    assert intervals == [0.02, 0.04, 0.04]
+
+
+def test_background_loop_and_webhook_resolve_waiters():
+    api = FakeSunoApi(ready_after=3)
+
+    async def scenario():
+        tracker = await _tracker(api, min_interval=0.01, max_interval=0.02)
+        await tracker.start()
+        polled = await tracker.submit("letra")
+        hooked = await tracker.submit("otra")
+        changed = tracker.apply_webhook(
+            {"data": [
+                {"taskId": hooked.id, "status": "complete", "audioUrl": "https://cdn/hook.mp3"}
+            ]}
+        )
+        await tracker.wait(polled, timeout=2)
+        await tracker.stop()
+        return tracker, polled, hooked, changed
+
+    tracker, polled, hooked, changed = asyncio.run(scenario())
+    assert changed == 1
+    assert hooked.audio_url == "https://cdn/hook.mp3"
+    assert polled.to_dict()["audio_url"] == "https://cdn/t1.mp3"
+    assert all("t2" not in ids for ids in api.polls)
+    assert tracker.stats["webhook_updates"] == 1
+
+
+def test_pending_task_times_out():
+    api = FakeSunoApi(ready_after=99)
+
+    async def scenario():
+        tracker = await _tracker(api, task_timeout=0)
+        task = await tracker.submit("letra")
+        await asyncio.sleep(0.01)
+        await tracker.poll_once()
+        return task
+
+    task = asyncio.run(scenario())
+    assert task.status == JobStatus.FAILED
+    assert "Tiempo de espera" in task.error
+    assert api.polls == []
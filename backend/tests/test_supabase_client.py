@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from backend.supabase_client import SupabaseClient, SupabaseError
+
+
+def _handler(request: httpx.Request) -> httpx.Response:
+    assert request.headers["apikey"] == "anon-key"
+    if request.url.path == "/auth/v1/token":
+        body = json.loads(request.content)
+        if body["password"] != "secreto":
+            return httpx.Response(400, json={"error_description": "Invalid login credentials"})
+        return httpx.Response(200, json={"access_token": "t", "user": {"email": body["email"]}})
+    if request.url.path == "/rest/v1/songs":
+        assert "merge-duplicates" in request.headers["prefer"]
+        return httpx.Response(201)
+    if request.url.path == "/auth/v1/signup":
+        raise httpx.ReadTimeout("lento", request=request)
+    return httpx.Response(404)
+
+
+async def _client() -> SupabaseClient:
+    client = SupabaseClient("http://supabase.local/", "anon-key")
+    await client.start(transport=httpx.MockTransport(_handler))
+    return client
+
+
+def test_sign_in_and_upsert():
+    async def scenario():
+        client = await _client()
+        session = await client.sign_in_with_password("a@example.com", "secreto")
+        await client.upsert("songs", [{"id": "1"}, {"id": "2"}])
+        await client.aclose()
+        return session
+
+    assert asyncio.run(scenario())["user"] == {"email": "a@example.com"}
+
+
+def test_errors_carry_status_and_message():
+    async def scenario():
+        client = await _client()
+        try:
+            with pytest.raises(SupabaseError) as bad_login:
+                await client.sign_in_with_password("a@example.com", "otra")
+            with pytest.raises(SupabaseError) as timeout:
+                await client.sign_up("a@example.com", "secreto")
+        finally:
+            await client.aclose()
+        return bad_login.value, timeout.value
+
+    bad_login, timeout = asyncio.run(scenario())
+    assert (bad_login.status_code, bad_login.message) == (400, "Invalid login credentials")
+    assert timeout.status_code == 504
+
+
+def test_not_started_client_fails_fast():
+    client = SupabaseClient("http://supabase.local", "anon-key")
+    with pytest.raises(SupabaseError):
+        asyncio.run(client.upsert("songs", {"id": "1"}))
@@ -0,0 +1,109 @@
+import asyncio
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.blob_store import InMemoryBlobStore, LocalBlobStore
+from backend.uploads import UploadError, UploadStore, UploadTooLargeError
+
+BOUNDARY = "limite123"
+
+
+def _multipart(data: bytes, field="audioFile", filename="voz.wav"):
+    return (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="nota"\r\n\r\nhola\r\n'
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        "Content-Type: audio/wav\r\n\r\n"
+    ).encode() + data + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+async def _chunks(body: bytes, size: int, seen=None):
+    for i in range(0, len(body), size):
+        if seen is not None:
+            seen.append(i)
+        yield body[i : i + size]
+
+
+def test_multipart_file_is_streamed_hashed_and_deduplicated(tmp_path):
+    store = UploadStore(LocalBlobStore(str(tmp_path)), max_bytes=10_000)
+    sample = b"RIFF" + os.urandom(5000)
+    content_type = f"multipart/form-data; boundary={BOUNDARY}"
+
+    async def scenario():
+        first = await store.ingest(_chunks(_multipart(sample), 7), content_type, "audioFile")
+        second = await store.ingest(_chunks(_multipart(sample), 1024), content_type, "audioFile")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert (first.duplicate, second.duplicate) == (False, True)
+    assert first.sha256 == second.sha256
+    assert first.size == len(sample)
+    assert first.filename == "voz.wav" and first.content_type == "audio/wav"
+    with first.mmap() as data:
+        assert data[:] == sample
+    assert first.path == str(tmp_path / "objects" / first.sha256[:2] / first.sha256)
+    # Solo queda el blob final: los temporales se borraron
+    assert not list((tmp_path / "tmp").iterdir())
+    assert store.blobs.metrics()["blobs"] == 1
+    assert store.metrics()["duplicates"] == 1
+
+
+def test_oversized_upload_stops_reading_early(tmp_path):
+    store = UploadStore(LocalBlobStore(str(tmp_path)), max_bytes=1000)
+    seen = []
+
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(store.ingest(_chunks(b"x" * 100_000, 256, seen)))
+    assert len(seen) <= 5
+    assert not list((tmp_path / "tmp").iterdir())
+    assert store.blobs.metrics()["blobs"] == 0
+    with pytest.raises(UploadTooLargeError):
+        store.check_length("5000")
+    assert store.stats["rejected"] == 2
+
+
+def test_missing_field_and_empty_file_are_rejected():
+    store = UploadStore(InMemoryBlobStore(), max_bytes=1000)
+    content_type = f"multipart/form-data; boundary={BOUNDARY}"
+    with pytest.raises(UploadError, match="Falta"):
+        body = _chunks(_multipart(b"abc", field="otro"), 64)
+        asyncio.run(store.ingest(body, content_type, "audioFile"))
+    with pytest.raises(UploadError, match="vacío"):
+        asyncio.run(store.ingest(_chunks(b"", 64)))
+
+
+def test_cloned_voice_endpoint_reuses_result_for_identical_sample(app_storage, monkeypatch):
+    from backend import main
+    from backend.auth import create_jwt_token
+
+    blobs = InMemoryBlobStore()
+    monkeypatch.setattr(main, "voice_uploads", UploadStore(blobs, max_bytes=4096))
+    monkeypatch.setattr(main, "_voice_results", main.OrderedDict())
+    sample = b"ID3" + os.urandom(2000)
+
+    def upload(http, name, data, email):
+        token = create_jwt_token({"sub": email, "role": "user"})
+        return http.post(
+            "/generate-cloned-voice",
+            files={"audioFile": (name, data, "audio/mpeg")},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+
+    with TestClient(main.app) as http:
+        anonymous = http.post("/generate-cloned-voice", files={"audioFile": ("v.mp3", sample)})
+        first = upload(http, "v.mp3", sample, "a@example.com")
+        second = upload(http, "w.mp3", sample, "b@example.com")
+        too_big = upload(http, "x.mp3", b"0" * 50_000, "a@example.com")
+    assert anonymous.status_code in (401, 403)
+    assert first.status_code == 200
+    assert first.json()["format"] == "mp3"
+    assert first.json()["deduplicated"] is False
+    assert second.json()["deduplicated"] is True
+    assert second.json()["sampleId"] == first.json()["sampleId"]
+    # Cada usuario que sube la misma muestra puede usarla
+    owners = asyncio.run(blobs.owners(first.json()["sampleId"]))
+    assert owners == {"a@example.com", "b@example.com"}
+    assert too_big.status_code == 413
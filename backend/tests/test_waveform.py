@@ -0,0 +1,125 @@
+import asyncio
+import struct
+
+import httpx
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.audio import AudioDecodeError, decode_wav, encode_wav, render_song
+from backend.blob_store import InMemoryBlobStore
+from backend.song_audio import SongAudio
+from backend.suno_tasks import SunoTask
+from backend.waveform import Waveform, compute_peaks
+
+
+def _wav(payload: bytes, tag: int, channels: int, rate: int, bits: int) -> bytes:
+    block = channels * bits // 8
+    fmt = struct.pack("<HHIIHH", tag, channels, rate, rate * block, block, bits)
+    return (
+        b"RIFF" + struct.pack("<I", 4 + 8 + len(fmt) + 8 + len(payload)) + b"WAVE"
+        + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+        + b"data" + struct.pack("<I", len(payload)) + payload
+    )
+
+
+def test_decode_wav_formats():
+    pcm16 = np.array([[0, -32768], [16384, 32767]], dtype="<i2")
+    samples, rate = decode_wav(_wav(pcm16.tobytes(), 1, 2, 8000, 16))
+    assert rate == 8000 and samples.shape == (2, 2)
+    assert samples[1, 0] == 0.5 and samples[0, 1] == -1.0
+
+    pcm24 = b"\x00\x00\x80" + b"\xff\xff\x7f"
+    samples, _ = decode_wav(_wav(pcm24, 1, 1, 8000, 24))
+    assert samples[0, 0] == -1.0 and samples[1, 0] == pytest.approx(1.0, abs=1e-6)
+
+    floats = np.array([0.25, -0.75], dtype="<f4")
+    samples, _ = decode_wav(_wav(floats.tobytes(), 3, 1, 8000, 32))
+    assert samples[:, 0].tolist() == [0.25, -0.75]
+
+    song = render_song("Prueba", "pop", seconds=1.0)
+    decoded, rate = decode_wav(encode_wav(song, 44100))
+    assert rate == 44100 and np.abs(decoded - song).max() < 1e-4
+    with pytest.raises(AudioDecodeError):
+        decode_wav(b"ID3" + bytes(100))
+
+
+def test_compute_peaks_matches_naive_reduction_at_every_level():
+    rng = np.random.default_rng(7)
+    samples = rng.uniform(-1, 1, size=(10_000, 2)).astype(np.float32)
+    waveform = compute_peaks(samples, 8000, samples_per_peak=100, levels=3, bits=16)
+    envelope_low, envelope_high = samples.min(axis=1), samples.max(axis=1)
+    for level, peaks in enumerate(waveform.levels):
+        block = 100 * 4**level
+        expected = [
+            (envelope_low[i : i + block].min(), envelope_high[i : i + block].max())
+            for i in range(0, len(samples), block)
+        ]
+        assert peaks.dtype == np.int16
+        assert np.abs(peaks / 32767 - np.array(expected)).max() <= 1 / 32767
+    assert [len(p) for p in waveform.levels] == [100, 25, 7]
+    assert waveform.level_for(20) == 1 and waveform.level_for(5000) == 0
+
+    restored = Waveform.from_bytes(waveform.to_bytes())
+    assert all(np.array_equal(a, b) for a, b in zip(restored.levels, waveform.levels))
+    dat = restored.to_dat(2)
+    assert struct.unpack_from("<iIiiI", dat) == (1, 0, 8000, 1600, 7)
+    assert len(dat) == 20 + 7 * 2 * 2
+
+
+def test_song_audio_stores_and_postprocesses_suno_download(app_storage, monkeypatch):
+    from backend import main
+
+    blobs = InMemoryBlobStore()
+    audio = SongAudio(blobs, max_bytes=2**20, samples_per_peak=64, levels=2)
+    wav = encode_wav(render_song("Suno", seconds=0.5), 44100)
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, content=wav, headers={"content-type": "audio/wav"})
+    )
+
+    async def scenario():
+        await audio.start(transport=transport)
+        task = SunoTask(id="t1", audio_url="https://cdn/t1.wav")
+        await audio.on_suno_complete(task)
+        await audio.close()
+        return task
+
+    task = asyncio.run(scenario())
+    sha256 = task.assets["audio_blob"]
+    assert task.assets["waveform_url"] == f"/songs/{sha256}/waveform"
+    assert task.assets["duration"] == 0.5
+    assert audio.metrics()["waveforms"] == 1
+
+    monkeypatch.setattr(main, "song_audio", audio)
+    with TestClient(main.app) as http:
+        body = http.get(f"/songs/{sha256}/waveform", params={"width": 50}).json()
+        assert body["samples_per_pixel"] == 256 and body["bits"] == 8
+        assert len(body["data"]) == 2 * body["length"]
+        dat = http.get(f"/songs/{sha256}/waveform", params={"format": "dat"})
+        assert dat.headers["content-type"] == "application/octet-stream"
+        assert http.get("/songs/" + "0" * 64 + "/waveform").status_code == 404
+
+
+def test_create_song_stores_audio_and_waveform(app_storage, monkeypatch):
+    from backend import main
+    from backend.auth import create_jwt_token
+
+    blobs = InMemoryBlobStore()
+    monkeypatch.setattr(main, "blob_store", blobs)
+    monkeypatch.setattr(main, "song_audio", SongAudio(blobs, samples_per_peak=256, levels=3))
+    monkeypatch.setattr(main, "LOCAL_SONG_SECONDS", 2.0)
+    token = create_jwt_token({"sub": "picos@example.com", "role": "user"})
+
+    with TestClient(main.app) as http:
+        asyncio.run(main.quota_ledger.assign("picos@example.com", "basico", 1))
+        song = http.post(
+            "/create-song",
+            params={"wait": True, "preview": False},
+            json={"title": "Olas", "description": "el mar", "genre": "pop"},
+            headers={"Authorization": f"Bearer {token}"},
+        ).json()
+        assert song["audio"] == f"/blobs/{song['audio_blob']}"
+        assert song["duration"] == 2.0
+        waveform = http.get(song["waveform_url"]).json()
+        assert waveform["length"] == -(-2 * 44100 // 256)
+        assert http.get(song["audio"]).headers["content-type"] == "audio/wav"
@@ -0,0 +1,67 @@
+import asyncio
+
+from backend.supabase_client import SupabaseError
+from backend.write_behind import UpsertBuffer
+
+
+class FakeSupabase:
+    def __init__(self, fail_times=0):
+        self.calls = []
+        self.fail_times = fail_times
+
+    async def upsert(self, table, rows, on_conflict=None, timeout=None):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise SupabaseError("caído", status_code=503)
+        self.calls.append((table, [dict(r) for r in rows], on_conflict))
+
+
+def test_revisions_coalesce_into_one_bulk_upsert():
+    async def scenario():
+        client = FakeSupabase()
+        buffer = UpsertBuffer(client, "songs", max_batch=10, max_delay=0.05)
+        await buffer.start()
+        buffer.submit({"id": "a", "title": "v1"})
+        buffer.submit({"id": "b", "title": "v1"})
+        ack = buffer.submit({"id": "a", "title": "v2"}, wait=True)
+        await asyncio.wait_for(ack, 1)
+        await buffer.stop()
+        return client, buffer
+
+    client, buffer = asyncio.run(scenario())
+    assert client.calls == [
+        ("songs", [{"id": "b", "title": "v1"}, {"id": "a", "title": "v2"}], "id")
+    ]
+    assert buffer.stats["coalesced"] == 1
+
+
+def test_full_batch_flushes_without_waiting_for_delay():
+    async def scenario():
+        client = FakeSupabase()
+        buffer = UpsertBuffer(client, "songs", max_batch=2, max_delay=60)
+        await buffer.start()
+        buffer.submit({"id": "a"})
+        ack = buffer.submit({"id": "b"}, wait=True)
+        await asyncio.wait_for(ack, 1)
+        await buffer.stop()
+        return client
+
+    assert len(asyncio.run(scenario()).calls) == 1
+
+
+def test_failed_flush_notifies_waiters_and_retries_on_shutdown():
+    async def scenario():
+        client = FakeSupabase(fail_times=1)
+        buffer = UpsertBuffer(client, "songs", max_delay=60)
+        await buffer.start()
+        ack = buffer.submit({"id": "a"}, wait=True)
+        ok = await buffer.flush()
+        error = ack.exception()
+        buffer.submit({"id": "b"})
+        await buffer.stop()
+        return ok, error, client
+
+    ok, error, client = asyncio.run(scenario())
+    assert not ok
+    assert isinstance(error, SupabaseError)
+    assert client.calls == [("songs", [{"id": "a"}, {"id": "b"}], "id")]
@@ -0,0 +1,254 @@
+"""
+Ingesta de subidas por streaming, con límite de tamaño y hash de contenido.
+
+El cuerpo de la petición se lee por trozos directamente del socket (sin
+`UploadFile`, que lo vuelca entero a un fichero temporal antes de llamar al
+endpoint). Cada trozo se escribe a un temporal y se suma al SHA-256 a la
+vez; si la subida supera el máximo se corta en ese momento, y si el
+`Content-Length` ya lo anuncia ni siquiera se empieza a leer. Al terminar,
+el fichero pasa al almacén de blobs (`backend.blob_store`) con su hash: una
+segunda subida idéntica se detecta como duplicada y el trabajo posterior
+puede saltarse.
+"""
+
+import asyncio
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass, field as dataclass_field
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from backend.blob_store import BlobStore
+
+# Margen para cabeceras y delimitadores multipart al comparar con Content-Length
+MULTIPART_OVERHEAD = 16 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UploadTooLargeError(UploadError):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"El archivo supera el máximo de {max_bytes} bytes", status_code=413)
+        self.max_bytes = max_bytes
+
+
+@dataclass(frozen=True)
+class StoredUpload:
+    sha256: str
+    size: int
+    content_type: str
+    filename: str
+    duplicate: bool
+    store: BlobStore = dataclass_field(repr=False, compare=False)
+
+    @property
+    def path(self) -> Optional[str]:
+        return self.store.path(self.sha256)
+
+    @contextmanager
+    def mmap(self) -> Iterator[Any]:
+        """Contenido de solo lectura sin copiarlo (mmap en el almacén local)."""
+        with self.store.open(self.sha256) as data:
+            yield data
+
+
+class _Writer:
+    """Escribe a un temporal y calcula el hash mientras llegan los trozos."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hasher = hashlib.sha256()
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadTooLargeError(self.max_bytes)
+        self.hasher.update(chunk)
+        self.file.write(chunk)
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.file.close()
+
+    def discard(self) -> None:
+        self.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class _MultipartFile:
+    """
+    Extrae un campo de archivo de un cuerpo multipart/form-data a medida que
+    llega. Los demás campos se ignoran.
+    """
+
+    def __init__(self, boundary: bytes, field: str, writer: _Writer):
+        self.field = field
+        self.writer = writer
+        self.found = False
+        self.content_type = "application/octet-stream"
+        self.filename = ""
+        self._headers: Dict[bytes, bytes] = {}
+        self._name = b""
+        self._value = b""
+        self._active = False
+        self._pending: List[bytes] = []
+        self.parser = MultipartParser(
+            boundary,
+            {
+                "on_part_begin": self._part_begin,
+                "on_header_field": self._header_field,
+                "on_header_value": self._header_value,
+                "on_header_end": self._header_end,
+                "on_headers_finished": self._headers_finished,
+                "on_part_data": self._part_data,
+                "on_part_end": self._part_end,
+            },
+        )
+
+    def _part_begin(self) -> None:
+        self._headers = {}
+        self._active = False
+
+    def _header_field(self, data: bytes, start: int, end: int) -> None:
+        self._name += data[start:end]
+
+    def _header_value(self, data: bytes, start: int, end: int) -> None:
+        self._value += data[start:end]
+
+    def _header_end(self) -> None:
+        self._headers[self._name.lower()] = self._value
+        self._name = self._value = b""
+
+    def _headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        if name == self.field and b"filename" in options and not self.found:
+            self._active = self.found = True
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+            content_type = self._headers.get(b"content-type")
+            if content_type:
+                self.content_type = content_type.decode("latin-1")
+
+    def _part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._active:
+            self._pending.append(data[start:end])
+
+    def _part_end(self) -> None:
+        self._active = False
+
+    def feed(self, chunk: bytes) -> None:
+        """Procesa un trozo del cuerpo y escribe los datos del archivo que contenga."""
+        self.parser.write(chunk)
+        pending, self._pending = self._pending, []
+        for data in pending:
+            self.writer.write(data)
+
+
+class UploadStore:
+    """
+    Ingesta de subidas hacia un almacén de blobs.
+
+    Args:
+        blobs: Almacén donde quedan los archivos, direccionados por SHA-256
+        max_bytes: Tamaño máximo de un archivo
+    """
+
+    def __init__(self, blobs: BlobStore, max_bytes: int):
+        self.blobs = blobs
+        self.max_bytes = max_bytes
+        self.stats = {"uploads": 0, "duplicates": 0, "rejected": 0, "bytes": 0}
+
+    def check_length(self, content_length: Optional[str], overhead: int = 0) -> None:
+        """Rechaza antes de leer si el Content-Length ya supera el máximo."""
+        limit = self.max_bytes + overhead
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            self.stats["rejected"] += 1
+            raise UploadTooLargeError(self.max_bytes)
+
+    async def ingest(
+        self,
+        chunks: AsyncIterator[bytes],
+        content_type: str = "application/octet-stream",
+        field: Optional[str] = None,
+    ) -> StoredUpload:
+        """
+        Guarda un cuerpo recibido por trozos.
+
+        Args:
+            chunks: Trozos del cuerpo (p. ej. `request.stream()`)
+            content_type: Content-Type de la petición; si es multipart se extrae `field`
+            field: Campo de archivo del formulario multipart
+
+        Raises:
+            UploadTooLargeError: Si el archivo supera `max_bytes` (se corta la lectura)
+            UploadError: Si el formulario no trae el campo de archivo
+        """
+        os.makedirs(self.blobs.tmp_dir, exist_ok=True)
+        writer = _Writer(self.blobs.tmp_dir, self.max_bytes)
+        media_type, options = parse_options_header(content_type)
+        form: Optional[_MultipartFile] = None
+        if media_type == b"multipart/form-data":
+            boundary = options.get(b"boundary")
+            if not boundary or not field:
+                writer.discard()
+                raise UploadError("Formulario multipart sin boundary")
+            form = _MultipartFile(boundary, field, writer)
+        sink: Any = form.feed if form is not None else writer.write
+        try:
+            async for chunk in chunks:
+                if chunk:
+                    # Escritura y hash fuera del event loop
+                    await asyncio.to_thread(sink, chunk)
+            if form is not None:
+                form.parser.finalize()
+                if not form.found:
+                    raise UploadError(f"Falta el archivo '{field}'")
+            if writer.size == 0:
+                raise UploadError("El archivo está vacío")
+            writer.close()
+            file_type = form.content_type if form is not None else content_type
+            # El blob store se queda con el temporal (lo mueve o, si ya existe, lo borra)
+            meta, duplicate = await self.blobs.put_file(
+                writer.path, file_type, sha256=writer.hasher.hexdigest()
+            )
+        except UploadTooLargeError:
+            self.stats["rejected"] += 1
+            writer.discard()
+            raise
+        except BaseException:
+            writer.discard()
+            raise
+        self.stats["uploads"] += 1
+        self.stats["duplicates"] += duplicate
+        self.stats["bytes"] += 0 if duplicate else writer.size
+        return StoredUpload(
+            sha256=meta.sha256,
+            size=writer.size,
+            content_type=file_type,
+            filename=form.filename if form is not None else "",
+            duplicate=duplicate,
+            store=self.blobs,
+        )
+
+    async def ingest_request(self, request: Any, field: str) -> StoredUpload:
+        """Ingiere el cuerpo de una petición Starlette/FastAPI sin bufferizarlo entero."""
+        content_type = request.headers.get("content-type", "application/octet-stream")
+        overhead = MULTIPART_OVERHEAD if content_type.startswith("multipart/") else 0
+        self.check_length(request.headers.get("content-length"), overhead)
+        return await self.ingest(request.stream(), content_type, field)
+
+    def metrics(self) -> Dict[str, Any]:
+        return dict(self.stats)
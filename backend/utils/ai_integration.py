@@ -4,7 +4,7 @@ from openai import OpenAI
 
 class AIIntegration:
     def __init__(self, api_key: str):
-        self.client = OpenAI(api_key)
+        self.client = OpenAI(api_key=api_key)
 
     def generate_text(self, prompt: str, max_tokens: int = 100) -> Dict[str, Any]:
         try:
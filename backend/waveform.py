@@ -0,0 +1,169 @@
+"""
+Picos de la forma de onda de las canciones, precalculados con NumPy.
+
+Tras generar una canción se decodifica su audio una vez y se calculan
+pares (mínimo, máximo) por bloque de muestras con reducciones vectorizadas
+(`np.minimum.reduceat`). El nivel más fino usa WAVEFORM_SAMPLES_PER_PEAK
+muestras por pico y cada nivel siguiente agrupa 4 picos del anterior, así
+que el reproductor pide el nivel que encaje con su ancho en píxeles sin
+descargar ni decodificar el MP3.
+
+Los picos se cuantizan a int8 (o int16) y se guardan como anexo `peaks` del
+blob de la canción. Se sirven en los formatos de audiowaveform (JSON o
+binario `.dat`), que peaks.js y wavesurfer leen directamente.
+"""
+
+import asyncio
+import io
+import struct
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from backend.audio import decode_audio
+from backend.blob_store import BlobStore
+
+SIDECAR = "peaks"
+# Picos del nivel anterior que se agrupan en cada nivel más grueso
+LEVEL_FACTOR = 4
+
+
+@dataclass(frozen=True)
+class Waveform:
+    sample_rate: int
+    samples_per_peak: int
+    bits: int
+    frames: int
+    # Un array (n, 2) de int8/int16 con (mínimo, máximo) por nivel, del más fino al más grueso
+    levels: Sequence[np.ndarray]
+
+    @property
+    def duration(self) -> float:
+        return self.frames / self.sample_rate if self.sample_rate else 0.0
+
+    def level_samples_per_peak(self, level: int) -> int:
+        return int(self.samples_per_peak * LEVEL_FACTOR**level)
+
+    def level_for(self, width: Optional[int]) -> int:
+        """Nivel más grueso que aún da al menos `width` picos (el más fino si ninguno llega)."""
+        if not width:
+            return 0
+        for level in range(len(self.levels) - 1, -1, -1):
+            if len(self.levels[level]) >= width:
+                return level
+        return 0
+
+    def to_json(self, level: int = 0) -> Dict[str, Any]:
+        """Formato JSON de audiowaveform (versión 2, un canal): picos intercalados min, max."""
+        peaks = self.levels[level]
+        return {
+            "version": 2,
+            "channels": 1,
+            "sample_rate": self.sample_rate,
+            "samples_per_pixel": self.level_samples_per_peak(level),
+            "bits": self.bits,
+            "length": len(peaks),
+            "data": peaks.ravel().tolist(),
+        }
+
+    def to_dat(self, level: int = 0) -> bytes:
+        """Formato binario `.dat` de audiowaveform (versión 1)."""
+        peaks = self.levels[level]
+        flags = 1 if self.bits == 8 else 0
+        header = struct.pack(
+            "<iIiiI", 1, flags, self.sample_rate, self.level_samples_per_peak(level), len(peaks)
+        )
+        return header + peaks.astype("<i1" if self.bits == 8 else "<i2").tobytes()
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        meta = np.array(
+            [self.sample_rate, self.samples_per_peak, self.bits, self.frames], dtype=np.int64
+        )
+        levels: Dict[str, Any] = {f"level{i}": peaks for i, peaks in enumerate(self.levels)}
+        np.savez(buffer, meta=meta, **levels)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Waveform":
+        with np.load(io.BytesIO(data)) as arrays:
+            sample_rate, samples_per_peak, bits, frames = (int(v) for v in arrays["meta"])
+            levels = [arrays[f"level{i}"] for i in range(len(arrays.files) - 1)]
+        return cls(sample_rate, samples_per_peak, bits, frames, levels)
+
+
+def _quantize(values: np.ndarray, bits: int) -> np.ndarray:
+    scale = 2 ** (bits - 1) - 1
+    dtype = np.int8 if bits == 8 else np.int16
+    return np.asarray(np.clip(np.round(values * scale), -scale - 1, scale), dtype=dtype)
+
+
+def compute_peaks(
+    samples: np.ndarray,
+    sample_rate: int,
+    samples_per_peak: int = 256,
+    levels: int = 4,
+    bits: int = 8,
+) -> Waveform:
+    """
+    Calcula los picos multirresolución de unas muestras float (frames, canales).
+
+    Los canales se combinan tomando la envolvente de todos (mínimo de los
+    mínimos y máximo de los máximos), como dibujan los reproductores mono.
+    """
+    if bits not in (8, 16):
+        raise ValueError("bits debe ser 8 o 16")
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    frames = len(samples)
+    # Canal a canal: `min(axis=1)` sobre 2 columnas es mucho más lento
+    # que np.minimum elemento a elemento
+    low = samples[:, 0].copy()
+    high = samples[:, 0].copy()
+    for channel in range(1, samples.shape[1]):
+        np.minimum(low, samples[:, channel], out=low)
+        np.maximum(high, samples[:, channel], out=high)
+    result: List[np.ndarray] = []
+    step = max(1, samples_per_peak)
+    for _ in range(max(1, levels)):
+        if len(low) == 0:
+            result.append(np.zeros((0, 2), dtype=np.int8 if bits == 8 else np.int16))
+            break
+        # Un pico por bloque; el último bloque puede ser más corto
+        starts = np.arange(0, len(low), step)
+        low = np.minimum.reduceat(low, starts)
+        high = np.maximum.reduceat(high, starts)
+        result.append(_quantize(np.stack([low, high], axis=1), bits))
+        if len(low) <= 1:
+            break
+        step = LEVEL_FACTOR
+    return Waveform(sample_rate, max(1, samples_per_peak), bits, frames, result)
+
+
+async def build_waveform(
+    blobs: BlobStore, sha256: str, samples_per_peak: int = 256, levels: int = 4, bits: int = 8
+) -> Waveform:
+    """
+    Decodifica una vez el audio del blob, calcula sus picos y los guarda como
+    anexo del blob.
+
+    Raises:
+        AudioDecodeError: Si el audio no se puede decodificar
+        KeyError, FileNotFoundError: Si el blob no existe
+    """
+
+    def compute() -> Waveform:
+        with blobs.open(sha256) as buffer:
+            samples, sample_rate = decode_audio(buffer)
+        return compute_peaks(samples, sample_rate, samples_per_peak, levels, bits)
+
+    # NumPy suelta el GIL en las reducciones; un hilo basta para no bloquear el event loop
+    waveform = await asyncio.to_thread(compute)
+    await blobs.put_sidecar(sha256, SIDECAR, waveform.to_bytes())
+    return waveform
+
+
+async def load_waveform(blobs: BlobStore, sha256: str) -> Optional[Waveform]:
+    data = await blobs.get_sidecar(sha256, SIDECAR)
+    return Waveform.from_bytes(data) if data is not None else None
@@ -0,0 +1,175 @@
+"""
+Buffer write-behind para upserts en Supabase.
+
+Las filas se acumulan en memoria y se fusionan por clave (la última versión
+de cada `id` gana), y se vuelcan como un único upsert masivo cuando el lote
+se llena o pasa el tiempo máximo de espera. Quien necesite confirmación
+durable puede esperar al volcado que incluye su fila.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from backend.supabase_client import SupabaseClient
+
+logger = logging.getLogger("backend")
+
+
+class UpsertBuffer:
+    """
+    Coalesce y agrupa upserts de una tabla.
+
+    Args:
+        client: Cliente de Supabase ya iniciado
+        table: Tabla destino
+        key: Columna por la que se fusionan las filas (y `on_conflict`)
+        max_batch: Filas distintas que fuerzan un volcado inmediato
+        max_delay: Segundos máximos que una fila espera en memoria
+        max_retries: Reintentos de una fila cuyo volcado falló antes de descartarla
+    """
+
+    def __init__(
+        self,
+        client: SupabaseClient,
+        table: str,
+        key: str = "id",
+        max_batch: int = 100,
+        max_delay: float = 0.2,
+        max_retries: int = 3,
+    ):
+        self.client = client
+        self.table = table
+        self.key = key
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self._rows: "OrderedDict[Any, Dict[str, Any]]" = OrderedDict()
+        self._waiters: Dict[Any, List["asyncio.Future[None]"]] = {}
+        self._attempts: Dict[Any, int] = {}
+        self._has_rows: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flusher: Optional["asyncio.Task[None]"] = None
+        self.stats = {
+            "submitted": 0, "coalesced": 0, "flushes": 0, "rows_written": 0, "failures": 0
+        }
+
+    async def start(self) -> None:
+        self._has_rows = asyncio.Event()
+        self._full = asyncio.Event()
+        if self._rows:
+            self._has_rows.set()
+        self._flush_lock = asyncio.Lock()
+        self._flusher = asyncio.create_task(self._flush_loop(), name=f"upsert-{self.table}")
+
+    async def stop(self) -> None:
+        """Detiene el volcado periódico y vuelca todo lo pendiente."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        # Cada fallo consume un reintento, así que el bucle termina
+        while self._rows:
+            await self.flush()
+
+    def pending(self) -> int:
+        return len(self._rows)
+
+    def submit(self, row: Dict[str, Any], wait: bool = False) -> Optional["asyncio.Future[None]"]:
+        """
+        Encola una fila; si ya había una pendiente con la misma clave, la sustituye.
+
+        Args:
+            row: Fila completa a guardar
+            wait: Si es True devuelve un future que se resuelve al quedar escrita
+
+        Returns:
+            Future de confirmación durable, o None si `wait` es False
+        """
+        row_key = row[self.key]
+        self.stats["submitted"] += 1
+        if row_key in self._rows:
+            self.stats["coalesced"] += 1
+            self._rows.move_to_end(row_key)
+        self._rows[row_key] = row
+        self._attempts.pop(row_key, None)
+        future: Optional["asyncio.Future[None]"] = None
+        if wait:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(row_key, []).append(future)
+        if self._has_rows is not None and self._full is not None:
+            self._has_rows.set()
+            if len(self._rows) >= self.max_batch:
+                self._full.set()
+        return future
+
+    async def flush(self) -> bool:
+        """
+        Escribe un lote de hasta `max_batch` filas en un solo upsert.
+
+        Returns:
+            True si el lote se escribió (o no había nada que escribir)
+        """
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._rows:
+                return True
+            keys = list(self._rows)[: self.max_batch]
+            batch = {k: self._rows.pop(k) for k in keys}
+            waiters = {k: self._waiters.pop(k) for k in keys if k in self._waiters}
+            try:
+                await self.client.upsert(self.table, list(batch.values()), on_conflict=self.key)
+            except Exception as e:
+                self.stats["failures"] += 1
+                logger.error(f"Error al volcar {len(batch)} filas en {self.table}: {e}")
+                self._requeue(batch)
+                for futures in waiters.values():
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                return False
+            self.stats["flushes"] += 1
+            self.stats["rows_written"] += len(batch)
+            for k in keys:
+                self._attempts.pop(k, None)
+            for futures in waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_result(None)
+            return True
+
+    def _requeue(self, batch: Dict[Any, Dict[str, Any]]) -> None:
+        """Devuelve al buffer las filas fallidas que no tengan ya una versión más nueva."""
+        for row_key, row in reversed(list(batch.items())):
+            if row_key in self._rows:
+                continue
+            attempts = self._attempts.get(row_key, 0) + 1
+            if attempts > self.max_retries:
+                logger.error(
+                    f"Descartada la fila {row_key} de {self.table} tras {attempts - 1} reintentos"
+                )
+                self._attempts.pop(row_key, None)
+                continue
+            self._attempts[row_key] = attempts
+            self._rows[row_key] = row
+            self._rows.move_to_end(row_key, last=False)
+
+    async def _flush_loop(self) -> None:
+        assert self._has_rows is not None and self._full is not None
+        while True:
+            await self._has_rows.wait()
+            if len(self._rows) < self.max_batch:
+                # Da tiempo a que lleguen más revisiones antes de escribir
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+            written = await self.flush()
+            if not self._rows:
+                self._has_rows.clear()
+            if not written:
+                await asyncio.sleep(self.max_delay)